@@ -0,0 +1,988 @@
+import argparse
+import asyncio
+import collections
+import io
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import main
+
+
+def TimeIt(function, repeat: int = 5) -> float:
+    """
+    This function times a function a few times and keeps the fastest run,
+    since slower runs are only slower because of other things happening on the machine.
+    Parameters:
+        function: The function to time, called with no arguments.
+        repeat (int): How many times to run it.
+
+    Returns:
+        float: The fastest run, in seconds.
+    """
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def PrintTable(headers: list, rows: list):
+    """
+    This function prints rows as a lined up text table.
+    Parameters:
+        headers (list): The column titles.
+        rows (list): The rows, each a list with one value per column.
+
+    Returns:
+        None
+    """
+
+    rows = [[str(value) for value in row] for row in rows]
+    widths = [
+        max(len(headers[column]), *(len(row[column]) for row in rows))
+        for column in range(len(headers))
+    ]
+    print("  ".join(title.ljust(width) for title, width in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+
+
+# Expressions the backend benchmark runs, by the kind of numbers they use
+BACKEND_WORKLOADS = {
+    "integers": "12*34+56-78^2%9+(1024/8)*3",
+    "decimals": "0.1+0.2*3.5/7-1.25%0.3+2.5^2",
+    "big integers": "2^200+3^100*7-5^50+12345%11",
+    "logarithms": "log_2(1024)+log_10(1000)*log_(2.5)(6.25)",
+}
+
+
+def BenchBackends(args):
+    """
+    This function measures what each numeric backend costs compared to floats,
+    both for a full evaluation from text and for re-running an already compiled
+    expression.
+    Parameters:
+        args (argparse.Namespace): The command line options, uses args.number.
+
+    Returns:
+        None
+    """
+
+    rows = []
+    for workload, expression in BACKEND_WORKLOADS.items():
+        timings = {}
+        for backend in main.Backend:
+            compiled = main.Compile(expression, backend=backend)
+            timings[backend] = (
+                TimeIt(
+                    lambda: [
+                        main.EvaluateExpression(expression, backend=backend)
+                        for _ in range(args.number)
+                    ]
+                ),
+                TimeIt(lambda: [compiled.evaluate() for _ in range(args.number)]),
+            )
+        floatFull, floatCompiled = timings[main.Backend.FLOAT]
+        for backend, (full, compiled) in timings.items():
+            rows.append(
+                [
+                    workload,
+                    backend.value,
+                    f"{full / args.number * 1e6:.1f}",
+                    f"{full / floatFull:.2f}x",
+                    f"{compiled / args.number * 1e6:.1f}",
+                    f"{compiled / floatCompiled:.2f}x",
+                ]
+            )
+    PrintTable(
+        [
+            "workload",
+            "backend",
+            "full us",
+            "vs float",
+            "compiled us",
+            "vs float",
+        ],
+        rows,
+    )
+
+
+def RepeatedBlocksExpression(
+    blocks: int, repeats: int, variables: bool, seed: int = 0
+) -> str:
+    """
+    This function makes an expression like the machine generated ones,
+    where the same few logarithms and parenthesized blocks show up over and over.
+    Parameters:
+        blocks (int): How many different blocks there are.
+        repeats (int): How many times the blocks are used in total.
+        variables (bool): True to put x and y in the blocks, False for numbers only.
+        seed (int): The random seed, so every run gets the same expression.
+
+    Returns:
+        str: The expression.
+    """
+
+    chooser = random.Random(seed)
+    names = ["x", "y"] if variables else ["3", "7"]
+    shapes = [
+        "log_({a}+{n})({b}*{m}+1)",
+        "(({a}*{n}+{b})/({m}+1))",
+        "({a}^2%{n}+{b}*1)",
+        "log_2({a}*{a}+{n})",
+    ]
+    pieces = []
+    for _ in range(blocks):
+        pieces.append(
+            chooser.choice(shapes).format(
+                a=chooser.choice(names),
+                b=chooser.choice(names),
+                n=chooser.randint(2, 9),
+                m=chooser.randint(2, 9),
+            )
+        )
+    return "+".join(chooser.choice(pieces) for _ in range(repeats))
+
+
+def CountOperations(function) -> int:
+    """
+    This function counts how many operations the float backend applies while running a
+    function.
+    Parameters:
+        function: The function to run, called with no arguments.
+
+    Returns:
+        int: The number of operations applied.
+    """
+
+    apply = main.BACKEND_OPERATIONS[main.Backend.FLOAT]
+    count = 0
+
+    def CountingApply(operation, left, right):
+        nonlocal count
+        count += 1
+        return apply(operation, left, right)
+
+    main.BACKEND_OPERATIONS[main.Backend.FLOAT] = CountingApply
+    try:
+        function()
+    finally:
+        main.BACKEND_OPERATIONS[main.Backend.FLOAT] = apply
+    return count
+
+
+def BenchOptimizer(args):
+    """
+    This function measures how much work the optimizer saves on expressions with
+    repeated blocks, once for a single evaluation from text and once for a compiled
+    expression with variables.
+    Parameters:
+        args (argparse.Namespace): The command line options, uses args.number.
+
+    Returns:
+        None
+    """
+
+    rows = []
+    for blocks, repeats in [(5, 50), (20, 200), (50, 1000)]:
+        for variables in [False, True]:
+            expression = RepeatedBlocksExpression(blocks, repeats, variables)
+            plain = main.Compile(expression, optimize=False)
+            optimized = main.Compile(expression, optimize=True)
+            values = {"x": 1.5, "y": 2.5}
+            number = max(1, args.number // repeats)
+            if variables:
+                plainTime = TimeIt(
+                    lambda: [plain.evaluate(values) for _ in range(number)]
+                )
+                optimizedTime = TimeIt(
+                    lambda: [optimized.evaluate(values) for _ in range(number)]
+                )
+                plainWork = CountOperations(lambda: plain.evaluate(values))
+                optimizedWork = CountOperations(lambda: optimized.evaluate(values))
+            else:
+                # Without variables everything is folded, so the folding is the work
+                plainTime = TimeIt(
+                    lambda: [
+                        main.EvaluateExpression(expression, optimize=False)
+                        for _ in range(number)
+                    ]
+                )
+                optimizedTime = TimeIt(
+                    lambda: [
+                        main.EvaluateExpression(expression, optimize=True)
+                        for _ in range(number)
+                    ]
+                )
+                plainWork = CountOperations(
+                    lambda: main.EvaluateExpression(expression, optimize=False)
+                )
+                optimizedWork = CountOperations(
+                    lambda: main.EvaluateExpression(expression, optimize=True)
+                )
+            rows.append(
+                [
+                    f"{blocks}x{repeats}",
+                    "compiled" if variables else "from text",
+                    plainWork,
+                    optimizedWork,
+                    f"{plainTime / number * 1e6:.1f}",
+                    f"{optimizedTime / number * 1e6:.1f}",
+                    f"{plainTime / optimizedTime:.2f}x",
+                ]
+            )
+    PrintTable(
+        [
+            "blocks",
+            "mode",
+            "operations",
+            "optimized",
+            "plain us",
+            "optimized us",
+            "speedup",
+        ],
+        rows,
+    )
+
+
+# Expressions with variables the engine benchmark runs, from small to large
+ENGINE_WORKLOADS = {
+    "polynomial": "3*x^3-2*x^2+x/4-7",
+    "mixed": "log_2(x+1)*y-(x%3)/(y+1)+x^2",
+    "long": "+".join(f"(x*{i}-y/{i + 1})" for i in range(1, 40)),
+}
+
+
+def BenchEngines(args):
+    """
+    This function compares the engines on compiled expressions evaluated over and over,
+    which is where the closure engine is meant to win.
+    Parameters:
+        args (argparse.Namespace): The command line options, uses args.number.
+
+    Returns:
+        None
+    """
+
+    engines = [main.Engine.STACK, main.Engine.AST, main.Engine.CLOSURE]
+    values = {"x": 1.5, "y": 2.5}
+    rows = []
+    for workload, expression in ENGINE_WORKLOADS.items():
+        timings = {}
+        for engine in engines:
+            compiled = main.Compile(expression, engine)
+            timings[engine] = TimeIt(
+                lambda: [compiled.evaluate(values) for _ in range(args.number)]
+            )
+        for engine in engines:
+            rows.append(
+                [
+                    workload,
+                    engine.value,
+                    f"{timings[engine] / args.number * 1e6:.2f}",
+                    f"{timings[main.Engine.STACK] / timings[engine]:.2f}x",
+                ]
+            )
+    PrintTable(["workload", "engine", "us", "vs stack"], rows)
+
+
+def BenchMemory(args):
+    """
+    This function measures how much memory compiled expressions take up with each
+    engine, one expression at a time and for a whole cache full of them.
+    Parameters:
+        args (argparse.Namespace): The command line options, uses args.number as the
+        cache size.
+
+    Returns:
+        None
+    """
+
+    engines = [
+        main.Engine.AST,
+        main.Engine.STACK,
+        main.Engine.CLOSURE,
+        main.Engine.BYTECODE,
+    ]
+    rows = []
+    for terms in [1, 5, 20, 100]:
+        expression = "+".join(f"({i}*x-{i + 1}/y)" for i in range(1, terms + 1))
+        sizes = {
+            engine: main.CompiledSize(main.CompileExpression(expression, engine))
+            for engine in engines
+        }
+        for engine in engines:
+            rows.append(
+                [
+                    f"{terms} terms",
+                    engine.value,
+                    sizes[engine],
+                    f"{sizes[main.Engine.AST] / sizes[engine]:.1f}x",
+                ]
+            )
+    PrintTable(["expression", "engine", "bytes", "vs ast"], rows)
+
+    # A full cache, measured by what Python actually allocated
+    print()
+    rows = []
+    expressions = [
+        f"{i}*x^2+{i % 7}*x-log_2(y+{i})/{i % 5 + 1}" for i in range(args.number)
+    ]
+    for engine in engines:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        cache = main.ExpressionCache(args.number)
+        for expression in expressions:
+            cache.put(expression, main.CompileExpression(expression, engine), "")
+        allocated = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        compiled = cache.entries[expressions[0]][0]
+        timing = TimeIt(
+            lambda: [
+                main.RunCompiled(compiled, engine, {"x": 1.5, "y": 2.5})
+                for _ in range(1000)
+            ]
+        )
+        rows.append(
+            [
+                engine.value,
+                args.number,
+                f"{allocated / args.number:.0f}",
+                f"{cache.memory()['bytesPerEntry']:.0f}",
+                f"{timing / 1000 * 1e6:.2f}",
+            ]
+        )
+    PrintTable(
+        [
+            "engine",
+            "entries",
+            "allocated per entry",
+            "compiled per entry",
+            "evaluate us",
+        ],
+        rows,
+    )
+
+
+def PeakMemory(function) -> int:
+    """
+    This function measures the most memory Python had allocated at once while running a
+    function.
+    Parameters:
+        function: The function to run, called with no arguments.
+
+    Returns:
+        int: The peak, in bytes.
+    """
+
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def BenchStream(args):
+    """
+    This function compares streaming a huge expression from a file with reading it all
+    in first, to show that streaming memory stays flat as the expression grows.
+    Parameters:
+        args (argparse.Namespace): The command line options, uses args.number as the
+        smallest number of terms.
+
+    Returns:
+        None
+    """
+
+    path = os.path.join(tempfile.mkdtemp(), "expression.txt")
+
+    def Streamed():
+        with open(path) as stream:
+            main.EvaluateStream(stream)
+
+    def WholeFile():
+        with open(path) as stream:
+            main.EvaluateExpression(stream.read())
+
+    rows = []
+    for terms in [args.number, args.number * 10, args.number * 100]:
+        with open(path, "w") as stream:
+            stream.write("+".join(f"({i % 97}*3-{i % 13}/2)" for i in range(terms)))
+        rows.append(
+            [
+                terms,
+                f"{os.path.getsize(path) / 1e6:.1f}",
+                f"{TimeIt(Streamed, 1):.2f}",
+                f"{PeakMemory(Streamed) / 1e6:.1f}",
+                f"{TimeIt(WholeFile, 1):.2f}",
+                f"{PeakMemory(WholeFile) / 1e6:.1f}",
+            ]
+        )
+    os.remove(path)
+    PrintTable(
+        ["terms", "MB", "stream s", "stream peak MB", "whole s", "whole peak MB"], rows
+    )
+
+
+def GenerateExpression(
+    terms: int,
+    depth: int = 0,
+    operators: str = "+-*/",
+    logDensity: float = 0.0,
+    seed: int = 0,
+) -> str:
+    """
+    This function makes an expression for the benchmark suite that is always valid and
+    never divides by zero, so every run does the same amount of work.
+    Parameters:
+        terms (int): How many operands the expression has.
+        depth (int): How deeply the parentheses nest.
+        operators (str): The operators to choose from, like "+-" or "+-*/%^".
+        logDensity (float): The share of operands that are logarithms, from 0 to 1.
+        seed (int): The random seed, so every run gets the same expression.
+
+    Returns:
+        str: The expression.
+    """
+
+    chooser = random.Random(seed)
+
+    def Operand() -> str:
+        if chooser.random() < logDensity:
+            return f"log_{chooser.randint(2, 9)}({chooser.randint(1, 999)})"
+        return str(chooser.randint(1, 9))
+
+    def Chain(count: int) -> str:
+        parts = [Operand()]
+        operator = None
+        for _ in range(count - 1):
+            # Small plain numbers after /, % and ^, so there is no dividing by zero or
+            # overflowing, and no 2^3^2^... towers
+            operator = chooser.choice(
+                operators.replace("^", "")
+                if operator == "^" and operators != "^"
+                else operators
+            )
+            parts.append(operator)
+            if operator == "^":
+                parts.append(str(chooser.randint(1, 3)))
+            elif operator in "/%":
+                parts.append(str(chooser.randint(2, 9)))
+            else:
+                parts.append(Operand())
+        return "".join(parts)
+
+    # Every level of nesting wraps the one inside it, with some terms of its own around
+    # it
+    perLevel = max(1, terms // (depth + 1))
+    expression = Chain(max(1, terms - perLevel * depth))
+    joiners = [operator for operator in operators if operator in "+-*"] or ["+"]
+    for _ in range(depth):
+        expression = f"{Chain(perLevel)}{chooser.choice(joiners)}({expression})"
+    return expression
+
+
+def TimePerCall(function, budget: float = 0.02) -> float:
+    """
+    This function times one call of a function, running it enough times to fill the
+    budget so quick functions are measured as precisely as slow ones.
+    Parameters:
+        function: The function to time, called with no arguments.
+        budget (float): About how long each timing should take, in seconds.
+
+    Returns:
+        float: The fastest time for one call, in seconds.
+    """
+
+    start = time.perf_counter()
+    function()
+    once = max(time.perf_counter() - start, 1e-7)
+    number = max(1, int(budget / once))
+    return TimeIt(lambda: [function() for _ in range(number)]) / number
+
+
+def RunBatchLines(lines: list):
+    """
+    This function runs a batch of expressions end to end, the way --batch does.
+    Parameters:
+        lines (list): The expressions, one per line.
+
+    Returns:
+        None
+    """
+
+    main.RunBatch(
+        io.StringIO("\n".join(lines) + "\n"),
+        io.StringIO(),
+        cache=main.ExpressionCache(0),
+    )
+
+
+# What the suite times, each given the expression to work on
+SUITE_TARGETS = {
+    "GeneralSyntax": main.GeneralSyntax,
+    "EvaluateExpression": lambda expression: main.EvaluateExpression(expression),
+    "FindStartAndEnd": lambda expression: main.FindStartAndEnd(expression, "+"),
+    "ReplaceLogarithms": main.ReplaceLogarithms,
+    "batch": lambda expression: RunBatchLines([expression] * 100),
+}
+# The workloads for each kind of scaling curve, smallest first
+SUITE_CURVES = {
+    "length": [dict(terms=terms) for terms in [25, 50, 100, 200, 400]],
+    "depth": [dict(terms=100, depth=depth) for depth in [1, 4, 16, 64]],
+    "operators": [
+        dict(terms=100, operators=operators) for operators in ["+-", "+-*/", "+-*/%^"]
+    ],
+    "logs": [
+        dict(terms=100, logDensity=density, operators="+*")
+        for density in [0.0, 0.25, 0.5, 1.0]
+    ],
+}
+
+
+def GrowthExponent(sizes: list, timings: list) -> float:
+    """
+    This function fits timings to size^k and returns k, so 1 means linear and 2 means
+    quadratic.
+    Parameters:
+        sizes (list): The sizes measured.
+        timings (list): The time taken for each size.
+
+    Returns:
+        float: The exponent, from a least squares fit on a log-log scale.
+    """
+
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(timing) for timing in timings]
+    meanX = sum(xs) / len(xs)
+    meanY = sum(ys) / len(ys)
+    return sum((x - meanX) * (y - meanY) for x, y in zip(xs, ys)) / sum(
+        (x - meanX) ** 2 for x in xs
+    )
+
+
+def Curve(timings: list, width: int = 40) -> list:
+    """
+    This function draws timings as bars, scaled so the slowest is width characters long.
+    Parameters:
+        timings (list): The timings to draw.
+        width (int): The length of the longest bar.
+
+    Returns:
+        list: One bar per timing.
+    """
+
+    slowest = max(timings)
+    return ["#" * max(1, round(timing / slowest * width)) for timing in timings]
+
+
+def BenchSuite(args):
+    """
+    This function times every suite target on generated expressions that grow in length,
+    depth, operator mix and logarithm density, prints the scaling curves, and writes the
+    results as JSON. With a baseline it fails when anything got slower than the
+    threshold allows.
+    Parameters:
+        args (argparse.Namespace): The command line options, uses args.output,
+        args.baseline and args.threshold.
+
+    Returns:
+        None
+    """
+
+    results = []
+    for curve, workloads in SUITE_CURVES.items():
+        for target, function in SUITE_TARGETS.items():
+            if target == "ReplaceLogarithms" and curve != "logs":
+                continue  # Nothing to find without logarithms
+            sizes = []
+            timings = []
+            for workload in workloads:
+                expression = GenerateExpression(**workload)
+                timing = TimePerCall(lambda: function(expression))
+                sizes.append(
+                    len(expression) if curve == "length" else workload.get("depth")
+                )
+                timings.append(timing)
+                results.append(
+                    {
+                        "target": target,
+                        "curve": curve,
+                        "workload": workload,
+                        "characters": len(expression),
+                        "seconds": timing,
+                    }
+                )
+            print(f"{target} by {curve}")
+            rows = [
+                [workload, f"{timing * 1e6:.1f}", bar]
+                for workload, timing, bar in zip(workloads, timings, Curve(timings))
+            ]
+            if curve in ("length", "depth"):
+                growth = GrowthExponent(sizes, timings)
+                rows.append(
+                    ["growth", f"n^{growth:.2f}", "quadratic?" if growth > 1.5 else ""]
+                )
+            PrintTable(["workload", "us", ""], rows)
+            print()
+
+    if args.output:
+        with open(args.output, "w") as stream:
+            json.dump(
+                {"python": platform.python_version(), "results": results},
+                stream,
+                indent=1,
+            )
+
+    if args.baseline:
+        with open(args.baseline) as stream:
+            baseline = {
+                ResultKey(result): result["seconds"]
+                for result in json.load(stream)["results"]
+            }
+        regressions = []
+        for result in results:
+            before = baseline.get(ResultKey(result))
+            if before is not None and result["seconds"] > before * (1 + args.threshold):
+                regressions.append(
+                    f"{ResultKey(result)}: {before * 1e6:.1f}us -> "
+                    f"{result['seconds'] * 1e6:.1f}us"
+                )
+        if regressions:
+            print("Slower than the baseline:")
+            print("\n".join(regressions))
+            raise SystemExit(1)
+        print("No regressions against", args.baseline)
+
+
+def ResultKey(result: dict) -> str:
+    """
+    This function names a suite result, so it can be matched with the same one in a
+    baseline.
+    Parameters:
+        result (dict): The result.
+
+    Returns:
+        str: The name.
+    """
+
+    workload = json.dumps(result["workload"], sort_keys=True)
+    return f"{result['target']} {result['curve']} {workload}"
+
+
+def TimeCommand(command: list, stdin: str = "") -> float:
+    """
+    This function times how long a command takes to run from start to finish, best of 5.
+    It runs next to main.py, so "import main" and "-m main" find it.
+    Parameters:
+        command (list): The program and its arguments.
+        stdin (str): The text to send to its stdin.
+
+    Returns:
+        float: The fastest run, in seconds.
+    """
+
+    return TimeIt(
+        lambda: subprocess.run(
+            command,
+            input=stdin,
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(main.__file__)),
+        )
+    )
+
+
+def BenchStartup(args):
+    """
+    This function measures the time to the first result for each way of launching the
+    calculator, since scripts start a new process for every expression.
+    Parameters:
+        args (argparse.Namespace): The command line options, uses args.against,
+        an older main.py to compare the interactive launch with.
+
+    Returns:
+        None
+    """
+
+    script = main.__file__
+    runs = {
+        "import only": ([sys.executable, "-c", "import main"], ""),
+        "one-shot argv": ([sys.executable, script, "2+3*4"], ""),
+        # Scripts are compiled every time they run, modules come from the bytecode cache
+        "one-shot -m main": ([sys.executable, "-m", "main", "2+3*4"], ""),
+        "one-shot stdin": ([sys.executable, script, "-"], "2+3*4\n"),
+        "interactive": ([sys.executable, script], "2+3*4\nquit\n"),
+        "self-test": ([sys.executable, script, "--self-test"], ""),
+    }
+    if args.against:
+        runs[f"interactive ({args.against})"] = (
+            [sys.executable, args.against],
+            "2+3*4\nquit\n",
+        )
+    timings = {
+        name: TimeCommand(command, stdin) for name, (command, stdin) in runs.items()
+    }
+    python = TimeCommand([sys.executable, "-c", "pass"])
+    fastest = timings["one-shot argv"]
+    PrintTable(
+        ["launch", "ms", "without python", "vs one-shot"],
+        [
+            [
+                name,
+                f"{timing * 1e3:.1f}",
+                f"{(timing - python) * 1e3:.1f}",
+                f"{timing / fastest:.2f}x",
+            ]
+            for name, timing in timings.items()
+        ],
+    )
+
+
+async def LoadConnection(address: str, lines: list, pipeline: int, latencies: list):
+    """
+    This function sends lines to the server over one connection, keeping up to pipeline
+    of them waiting for an answer, and times how long each answer takes.
+    Parameters:
+        address (str): The server's "host:port", or the path of its Unix socket.
+        lines (list): The expressions to send.
+        pipeline (int): The most requests waiting for an answer at once.
+        latencies (list): Gets the time each request took, in seconds.
+
+    Returns:
+        None
+    """
+
+    if "/" in address:
+        reader, writer = await asyncio.open_unix_connection(address)
+    else:
+        reader, writer = await asyncio.open_connection(*main.ParseAddress(address))
+    sent = collections.deque()
+    window = asyncio.Semaphore(pipeline)
+
+    async def Send():
+        for line in lines:
+            await window.acquire()
+            sent.append(time.perf_counter())
+            writer.write(line.encode() + b"\n")
+            await writer.drain()
+        writer.write_eof()
+
+    sender = asyncio.create_task(Send())
+    for _ in lines:
+        if not await reader.readline():
+            raise ConnectionError(
+                "The server closed the connection before answering everything."
+            )
+        latencies.append(time.perf_counter() - sent.popleft())
+        window.release()
+    await sender
+    writer.close()
+
+
+async def GenerateLoad(
+    address: str, lines: list, connections: int, pipeline: int
+) -> tuple:
+    """
+    This function splits the lines between several connections and sends them all at
+    once.
+    Parameters:
+        address (str): The server's "host:port", or the path of its Unix socket.
+        lines (list): The expressions to send.
+        connections (int): How many connections to send them over.
+        pipeline (int): The most requests waiting for an answer at once on each
+        connection.
+
+    Returns:
+        tuple: How long it took in seconds, and every request's latency sorted.
+    """
+
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            LoadConnection(address, lines[index::connections], pipeline, latencies)
+            for index in range(connections)
+        )
+    )
+    return time.perf_counter() - start, sorted(latencies)
+
+
+def StartServer(workers: int) -> tuple:
+    """
+    This function starts a server on a free port in a new process.
+    Parameters:
+        workers (int): Passed on to --workers.
+
+    Returns:
+        tuple: The process, and the address it is listening on.
+    """
+
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "main",
+            "--serve",
+            "127.0.0.1:0",
+            "--workers",
+            str(workers),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(main.__file__)),
+    )
+    line = process.stdout.readline()
+    if not line.startswith("Listening on "):
+        process.kill()
+        raise RuntimeError("The server didn't start.")
+    return process, line[len("Listening on ") :].strip()
+
+
+def BenchLoad(args):
+    """
+    This function puts the server under load from many pipelining connections and
+    reports its throughput and latency.
+    Parameters:
+        args (argparse.Namespace): The command line options, uses args.number requests
+        in total, args.connections, args.pipeline, and args.address to load an already
+        running server instead of starting one for each number of workers.
+
+    Returns:
+        None
+    """
+
+    # Every expression is sent twice, so about half the requests are answered from the
+    # cache
+    lines = [
+        GenerateExpression(8, 1, "+-*/^", seed=index % max(1, args.number // 2))
+        for index in range(args.number)
+    ]
+    servers = (
+        [(args.address, None)]
+        if args.address
+        else [(None, 1), (None, os.cpu_count() or 1)]
+    )
+    rows = []
+    for address, workers in dict.fromkeys(servers):
+        for pipeline in sorted({1, args.pipeline}):
+            process = None
+            if address is None:
+                process, address = StartServer(workers)
+            try:
+                seconds, latencies = asyncio.run(
+                    GenerateLoad(address, lines, args.connections, pipeline)
+                )
+            finally:
+                if process is not None:
+                    process.terminate()
+                    process.wait()
+                    address = None
+            rows.append(
+                [
+                    workers or "-",
+                    args.connections,
+                    pipeline,
+                    f"{len(latencies) / seconds:.0f}",
+                    *(
+                        f"{latencies[int(share * (len(latencies) - 1))] * 1e3:.2f}"
+                        for share in (0.5, 0.99, 1)
+                    ),
+                ]
+            )
+    PrintTable(
+        [
+            "workers",
+            "connections",
+            "pipeline",
+            "requests/s",
+            "p50 ms",
+            "p99 ms",
+            "max ms",
+        ],
+        rows,
+    )
+
+
+BENCHMARKS = {
+    "backends": BenchBackends,
+    "engines": BenchEngines,
+    "load": BenchLoad,
+    "memory": BenchMemory,
+    "optimizer": BenchOptimizer,
+    "startup": BenchStartup,
+    "stream": BenchStream,
+    "suite": BenchSuite,
+}
+
+
+def Main(argv: list = None):
+    """
+    This function runs the benchmark named on the command line.
+    Parameters:
+        argv (list): The command line arguments. Defaults to sys.argv.
+
+    Returns:
+        None
+    """
+
+    parser = argparse.ArgumentParser(description="Calculator benchmarks.")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument(
+        "--number", type=int, default=2000, help="evaluations per timing"
+    )
+    parser.add_argument(
+        "--against",
+        metavar="FILE",
+        help="an older main.py for the startup benchmark to compare with",
+    )
+    parser.add_argument(
+        "--address",
+        metavar="HOST:PORT",
+        help="a running server for the load benchmark, or its Unix socket, instead of "
+        "starting one",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=16,
+        help="connections the load benchmark opens",
+    )
+    parser.add_argument(
+        "--pipeline",
+        type=int,
+        default=16,
+        help="requests the load benchmark keeps waiting on each connection",
+    )
+    parser.add_argument(
+        "--output", metavar="FILE", help="write the suite's results to FILE as JSON"
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="FILE",
+        help="fail if the suite is slower than the results saved in FILE",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="how much slower than the baseline counts as a regression, 0.25 is 25%%",
+    )
+    args = parser.parse_args(argv)
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    Main()
@@ -1,7 +1,23 @@
+from array import array
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from decimal import Decimal, InvalidOperation, getcontext, localcontext
 from enum import Enum
+from fractions import Fraction
+from functools import partial
+from types import BuiltinFunctionType, FunctionType
+from itertools import repeat
+from typing import NamedTuple
+import _thread  # Just for locks, threading takes a lot longer to import
+import atexit
+import io
 import math
-
-DEBUG = False  # Set to True to enable debug prints
+import operator
+import os
+import string
+import struct
+import sys
+import time
 
 
 class Operation(Enum):
@@ -14,12 +30,251 @@ class Operation(Enum):
     LOGARITHM = "log_"  # Using a placeholder for logarithm operation
 
 
+class Engine(Enum):
+    AST = "ast"  # Tokenize once, parse into a tree, then evaluate the tree
+    STACK = "stack"  # Shunting-yard to postfix, then run it on an explicit stack
+    # Shunting-yard to postfix, then turn it into one Python function per node
+    CLOSURE = "closure"
+    # Shunting-yard to postfix, then pack it into flat arrays of numbers
+    BYTECODE = "bytecode"
+    LEGACY = "legacy"  # Find one operator, rewrite the string, repeat
+
+
+class Backend(Enum):
+    FLOAT = "float"  # Fast, about 16 significant digits
+    EXACT = "exact"  # Whole numbers as ints, everything else rational as a Fraction
+    DECIMAL = "decimal"  # Decimal numbers rounded to DECIMAL_PRECISION digits
+
+
+ENGINE = Engine.STACK  # The engine EvaluateExpression uses when none is given
+BACKEND = Backend.FLOAT  # The kind of numbers evaluated with when none is given
+DECIMAL_PRECISION = 28  # Significant digits kept by the decimal backend
+# Reject powers and products bigger than this many bits, None for no limit
+MAX_RESULT_BITS = 1 << 20
+# The longest expression Calculate accepts, in characters
+MAX_EXPRESSION_LENGTH = 1 << 20
+MAX_NESTING_DEPTH = 1000  # How deeply parentheses can nest
+MAX_OPERATIONS = 1 << 17  # The most operators one expression can have
+MAX_SECONDS = None  # How long one expression can take to calculate, None for no limit
+OPTIMIZE = False  # Optimize expressions before evaluating them, see Optimizer
+CACHE_SIZE = 1024  # How many expressions Calculate remembers, 0 turns the cache off
+# How many logarithm results are remembered before starting over
+LOGARITHM_CACHE_SIZE = 4096
+BATCH_BUFFER_SIZE = 1 << 16  # Bytes buffered when reading and writing batch files
+BATCH_CHUNK_SIZE = 4096  # Lines sent to a worker process at a time
+# Characters read at a time when streaming one huge expression
+STREAM_CHUNK_SIZE = 1 << 16
+INSTRUMENT = None  # The Instrument collecting metrics, None turns instrumentation off
+SERVER_MAX_IN_FLIGHT = 64  # Requests per connection the server works on at once
+SERVER_LINE_LIMIT = 1 << 20  # The longest request line the server accepts, in bytes
+
+
+class Instrument:
+    """
+    Collects counters and timings while it is installed as INSTRUMENT: parsing,
+    validating, evaluating, every kind of operation and the expression cache. It can
+    also trace every step an expression is worked out in. Nothing is collected while
+    INSTRUMENT is None, and the operations are only wrapped while one is installed, so
+    that costs nothing at all. A Calculator can have an instrument of its own instead.
+    Counting is locked, so threads sharing an instrument don't lose counts.
+    """
+
+    __slots__ = ("counts", "seconds", "trace", "lock")
+
+    def __init__(self, trace=None):
+        """
+        This function creates an instrument.
+        Parameters:
+            trace: A function called with a line of text for every step, like print.
+            None for no trace.
+
+        Returns:
+            None
+        """
+
+        self.counts = {}  # How many times each thing happened, by name
+        self.seconds = {}  # The total time each timed thing took, by name
+        self.trace = trace
+        self.lock = _thread.allocate_lock()
+
+    def count(self, name: str, amount: int = 1):
+        """
+        This function adds to a counter.
+        Parameters:
+            name (str): The counter, like "cache hit".
+            amount (int): How much to add.
+
+        Returns:
+            None
+        """
+
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def timed(self, name: str, function, *args):
+        """
+        This function calls a function, counting and timing it as name even if it
+        raises.
+        Parameters:
+            name (str): What to count and time it as, like "parse".
+            function: The function to call.
+            *args: The arguments to call it with.
+
+        Returns:
+            Whatever the function returns.
+        """
+
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+                self.counts[name] = self.counts.get(name, 0) + 1
+
+    def step(self, text: str):
+        """
+        This function adds a step to the trace, if there is one.
+        Parameters:
+            text (str): The step, like "rewrite 2+12".
+
+        Returns:
+            None
+        """
+
+        if self.trace is not None:
+            self.trace(text)
+
+    def wrap(self, apply):
+        """
+        This function wraps a backend's apply function so every operation is counted,
+        timed and traced by its kind.
+        Parameters:
+            apply: The function that applies an operation.
+
+        Returns:
+            function: The wrapped apply function.
+        """
+
+        counts = self.counts
+        seconds = self.seconds
+        trace = self.trace
+        lock = self.lock
+        clock = time.perf_counter
+
+        def InstrumentedApply(operation, left, right):
+            name = OPERATION_METRICS[operation]
+            start = clock()
+            try:
+                result = apply(operation, left, right)
+            finally:
+                elapsed = clock() - start
+                with lock:
+                    seconds[name] = seconds.get(name, 0.0) + elapsed
+                    counts[name] = counts.get(name, 0) + 1
+            if trace is not None:
+                if operation is Operation.LOGARITHM:
+                    trace(
+                        f"log_{FormatNumber(left)}({FormatNumber(right)}) = "
+                        f"{FormatNumber(result)}"
+                    )
+                else:
+                    trace(
+                        f"{FormatNumber(left)} {operation.value} {FormatNumber(right)}"
+                        f" = {FormatNumber(result)}"
+                    )
+            return result
+
+        return InstrumentedApply
+
+    def metrics(self) -> dict:
+        """
+        This function reports everything collected so far.
+        Parameters:
+            None
+
+        Returns:
+            dict: For each name, how many times it happened and, if it was timed,
+            the total and average time in seconds.
+        """
+
+        with self.lock:
+            counts = dict(self.counts)
+            seconds = dict(self.seconds)
+        report = {}
+        for name in sorted(counts):
+            count = counts[name]
+            report[name] = {"count": count}
+            if name in seconds:
+                report[name]["seconds"] = seconds[name]
+                report[name]["average"] = seconds[name] / count
+        return report
+
+    def dump(self, stream=None):
+        """
+        This function writes the metrics as JSON, along with the expression cache's
+        stats.
+        Parameters:
+            stream: Where to write them. Defaults to sys.stderr.
+
+        Returns:
+            None
+        """
+
+        import json
+
+        stream = stream or sys.stderr
+        json.dump({"metrics": self.metrics(), "cache": CACHE.stats()}, stream, indent=1)
+        stream.write("\n")
+
+    def reset(self):
+        """
+        This function forgets everything collected so far.
+        Parameters:
+            None
+
+        Returns:
+            None
+        """
+
+        with self.lock:
+            self.counts.clear()
+            self.seconds.clear()
+
+
+# The metric name for each kind of operation
+OPERATION_METRICS = {
+    operation: f"operation {operation.name.lower()}" for operation in Operation
+}
+
+
+def Timed(instrument: Instrument, name: str, function, *args):
+    """
+    This function calls a function, timing it as name when there is an instrument.
+    Parameters:
+        instrument (Instrument): The instrument to time it with, usually INSTRUMENT.
+        None to just call it.
+        name (str): What to time it as, like "parse".
+        function: The function to call.
+        *args: The arguments to call it with.
+
+    Returns:
+        Whatever the function returns.
+    """
+
+    if instrument is None:
+        return function(*args)
+    return instrument.timed(name, function, *args)
+
+
 def GeneralSyntax(toCalculate: str):
     """
     This function checks the general syntax of the expression toCalculate.
-    It ensures that:
-    1. There are an equal number of opening and closing parentheses.
-    2. There are no invalid characters in the expression.
+    The Lexer does the checking while it tokenizes, in one pass that stops at the first
+    mistake and says where it is and what was expected there. It ensures that:
+    1. Every opening parenthesis has a closing one, and the other way around.
+    2. There are no invalid characters or variables in the expression.
     3. There are no consecutive operators.
     4. There are no invalid sequences like a number followed by an opening parenthesis or a closing parenthesis followed by a number (with the exception of logorithms).
 
@@ -31,50 +286,7 @@ def GeneralSyntax(toCalculate: str):
     """
 
     # o7
-    # We want to check if there are an equal number of opening and closing parentheses
-    if DEBUG:
-        print("in GeneralSyntax, toCalculate: ", toCalculate)
-        # o7
-    openParens = toCalculate.count("(")
-    closeParens = toCalculate.count(")")
-    if openParens != closeParens:
-        raise ValueError("Mismatched parentheses. Please check your expression.")
-    # Check for valid characters (digits, operators, parentheses)
-    validChars = set("0123456789+-*/%^().log_")
-    for char in toCalculate:
-        if char not in validChars:
-            raise ValueError(f"Invalid character '{char}' in expression.")
-    # Check for consecutive operators or invalid sequences
-    for i in range(len(toCalculate) - 1):
-        if (
-            toCalculate[i] in "+-*/%^"
-            and toCalculate[i + 1] in "+-*/%^"
-            and not (toCalculate[i] == "-" and i == 0)  # Allow leading negative sign
-        ):
-            raise ValueError(
-                "Consecutive operators found. Please check your expression."
-            )
-    # We also do not want to allow an opening parenthesis directly after a number,
-    # Or closing parenthesis directly before a number
-    # With the exception of a logarithm, which will be checked here as well
-    # For example, "2(3+4)" or "(3+4)2" are not valid expression
-    for i in range(len(toCalculate) - 1):
-        if (
-            toCalculate[i].isdigit()
-            and toCalculate[i + 1] == "("
-            and Operation.LOGARITHM.value not in toCalculate[i + 1 : i + 4]
-        ):
-            raise ValueError(
-                "Invalid syntax: opening parenthesis cannot follow a number."
-            )
-        if (
-            toCalculate[i] == ")"
-            and toCalculate[i + 1].isdigit()
-            and Operation.LOGARITHM.value not in toCalculate[i - 3 : i + 1]
-        ):
-            raise ValueError(
-                "Invalid syntax: closing parenthesis cannot precede a number."
-            )
+    Timed(INSTRUMENT, "validate", Tokenize, toCalculate, float, 0, False)
 
 
 def Add(expression: str) -> str:
@@ -87,18 +299,9 @@ def Add(expression: str) -> str:
         str: The result of the addition as a string.
     """
 
-    if DEBUG:
-        print("in add, expression: ", expression)
     # Expecting expression like "a+b"
-    parts = expression.split(Operation.ADD.value)
-    if len(parts) != 2:
-        raise ValueError("Addition requires exactly two operands.")
-    try:
-        a = float(parts[0].strip())
-        b = float(parts[1].strip())
-    except ValueError:
-        raise ValueError("Operands must be numbers.")
-    return str(a + b)
+    a, b = SplitOperands(expression, Operation.ADD)
+    return FormatNumber(LegacyApply(Operation.ADD, a, b))
 
 
 def Subtract(expression: str) -> str:
@@ -111,18 +314,9 @@ def Subtract(expression: str) -> str:
         str: The result of the subtraction as a string.
     """
 
-    if DEBUG:
-        print("in subtract, expression: ", expression)
     # Expecting expression like "a-b"
-    parts = expression.split(Operation.SUBTRACT.value)
-    if len(parts) != 2:
-        raise ValueError("Subtraction requires exactly two operands.")
-    try:
-        a = float(parts[0].strip())
-        b = float(parts[1].strip())
-    except ValueError:
-        raise ValueError("Operands must be numbers.")
-    return str(a - b)
+    a, b = SplitOperands(expression, Operation.SUBTRACT)
+    return FormatNumber(LegacyApply(Operation.SUBTRACT, a, b))
 
 
 def Multiply(expression: str) -> str:
@@ -135,18 +329,9 @@ def Multiply(expression: str) -> str:
         str: The result of the multiplication as a string.
     """
 
-    if DEBUG:
-        print("in multiply, expression: ", expression)
     # Expecting expression like "a*b"
-    parts = expression.split(Operation.MULTIPLY.value)
-    if len(parts) != 2:
-        raise ValueError("Multiplication requires exactly two operands.")
-    try:
-        a = float(parts[0].strip())
-        b = float(parts[1].strip())
-    except ValueError:
-        raise ValueError("Operands must be numbers.")
-    return str(a * b)
+    a, b = SplitOperands(expression, Operation.MULTIPLY)
+    return FormatNumber(LegacyApply(Operation.MULTIPLY, a, b))
 
 
 def Divide(expression: str) -> str:
@@ -159,21 +344,10 @@ def Divide(expression: str) -> str:
         str: The result of the division as a string.
     """
 
-    if DEBUG:
-        print("in divide, expression: ", expression)
     # Expecting expression like "a/b"
 
-    parts = expression.split(Operation.DIVIDE.value)
-    if len(parts) != 2:
-        raise ValueError("Division requires exactly two operands.")
-    try:
-        a = float(parts[0].strip())
-        b = float(parts[1].strip())
-    except ValueError:
-        raise ValueError("Operands must be numbers.")
-    if b == 0:
-        raise ValueError("Cannot divide by zero.")
-    return str(a / b)
+    a, b = SplitOperands(expression, Operation.DIVIDE)
+    return FormatNumber(LegacyApply(Operation.DIVIDE, a, b))
 
 
 def Mod(expression: str) -> str:
@@ -186,21 +360,10 @@ def Mod(expression: str) -> str:
         str: The result of the modulo as a string.
     """
 
-    if DEBUG:
-        print("in mod, expression: ", expression)
     # Expecting expression like "a%b"
 
-    parts = expression.split(Operation.MOD.value)
-    if len(parts) != 2:
-        raise ValueError("Modulus requires exactly two operands.")
-    try:
-        a = float(parts[0].strip())
-        b = float(parts[1].strip())
-    except ValueError:
-        raise ValueError("Operands must be numbers.")
-    if b == 0:
-        raise ValueError("Cannot perform modulus by zero.")
-    return str(a % b)
+    a, b = SplitOperands(expression, Operation.MOD)
+    return FormatNumber(LegacyApply(Operation.MOD, a, b))
 
 
 def Exponent(expression: str) -> str:
@@ -213,19 +376,9 @@ def Exponent(expression: str) -> str:
         str: The result of the exponentiation as a string.
     """
 
-    if DEBUG:
-        print("in exponent, expression: ", expression)
     # Expecting expression like "a^b"
-    # Print("in exponent, expression: ", expression)
-    parts = expression.split(Operation.EXPONENT.value)
-    if len(parts) != 2:
-        raise ValueError("Exponentiation requires exactly two operands.")
-    try:
-        a = float(parts[0].strip())
-        b = float(parts[1].strip())
-    except ValueError:
-        raise ValueError("Operands must be numbers.")
-    return str(a**b)
+    a, b = SplitOperands(expression, Operation.EXPONENT)
+    return FormatNumber(LegacyApply(Operation.EXPONENT, a, b))
 
 
 def Logarithm(expression: str) -> str:
@@ -239,21 +392,107 @@ def Logarithm(expression: str) -> str:
     """
 
     # expecting "base,argument"
-    if DEBUG:
-        print("in logarithm, expression: ", expression)
     parts = expression.split(",")
     if len(parts) != 2:
         raise ValueError("Logarithm requires exactly two operands: base and argument.")
     try:
-        base = EvaluateExpression(parts[0].strip())  # Ensure base is a valid expression
-        arg = EvaluateExpression(parts[1].strip())
+        base = RewriteExpression(parts[0].strip())  # Ensure base is a valid expression
+        arg = RewriteExpression(parts[1].strip())
         # Ensure argument is a valid expression
         base = float(base)
         arg = float(arg)
     except ValueError as e:
         raise ValueError("Invalid operands for logarithm: " + str(e))
 
-    return str(math.log(arg, base))
+    return FormatNumber(LegacyApply(Operation.LOGARITHM, base, arg))
+
+
+def LegacyApply(operation: Operation, left: float, right: float) -> float:
+    """
+    This function applies an operation for the string based functions above,
+    through the installed Instrument if there is one so it is counted like any other.
+    Parameters:
+        operation (Operation): The operation to apply.
+        left (float): The left operand.
+        right (float): The right operand.
+
+    Returns:
+        float: The result of the operation.
+    """
+
+    if INSTRUMENT is None:
+        return ApplyOperation(operation, left, right)
+    return INSTRUMENT.wrap(ApplyOperation)(operation, left, right)
+
+
+# What each operation is called in error messages
+OPERATION_NAMES = {
+    Operation.ADD: "Addition",
+    Operation.SUBTRACT: "Subtraction",
+    Operation.MULTIPLY: "Multiplication",
+    Operation.DIVIDE: "Division",
+    Operation.MOD: "Modulus",
+    Operation.EXPONENT: "Exponentiation",
+}
+
+
+def SplitOperands(expression: str, operation: Operation) -> tuple:
+    """
+    This function reads the two numbers of a single operation expression like "a+b".
+    A minus sign at the start of either number is part of the number, so "-5--3" works.
+    Parameters:
+        expression (str): The expression, in the format "a+b", "a-b" etc.
+        operation (Operation): The operation joining the two numbers.
+
+    Returns:
+        tuple: The left and right operands as floats.
+    """
+
+    symbol = operation.value
+    # The operator is the first symbol that comes right after a digit or a decimal point
+    position = expression.find(symbol, 1)
+    while position != -1 and expression[position - 1] not in NUMBER_CHARS:
+        position = expression.find(symbol, position + 1)
+    if position == -1:
+        raise ValueError(f"{OPERATION_NAMES[operation]} requires exactly two operands.")
+    right = expression[position + 1 :].strip()
+    try:
+        a = float(expression[:position].strip())
+        b = float(right)
+    except ValueError:
+        if symbol in right[1:]:
+            raise ValueError(
+                f"{OPERATION_NAMES[operation]} requires exactly two operands."
+            )
+        raise ValueError("Operands must be numbers.")
+    return a, b
+
+
+def FormatNumber(value) -> str:
+    """
+    This function turns a number into text, once, when it is output.
+    It never uses exponent notation like 1e-07, so the text can always be read back in
+    by the string based functions.
+    Parameters:
+        value: The number to format.
+
+    Returns:
+        str: The number as text, like "5.0", "0.0000001", "1024" or "1/3".
+    """
+
+    if value.__class__ is Decimal:
+        return format(value, "f")
+    if value.__class__ is not float:
+        # Ints and Fractions are exact already, like "1024" or "1/3"
+        return str(value)
+    text = repr(value)
+    if "e" not in text:
+        return text
+    # Decimal writes out the same shortest digits without the exponent
+    text = format(Decimal(text), "f")
+    if "." not in text:
+        text += ".0"
+    return text
 
 
 def FindStartAndEnd(expresion: str, operator: str):
@@ -267,8 +506,6 @@ def FindStartAndEnd(expresion: str, operator: str):
         tuple: The start and end indices of the left and right operands as a tuple (start, end).
     """
 
-    if DEBUG:
-        print("in findStartAndEnd, expresion: ", expresion, ", operator: ", operator)
     operatorPos = expresion.rfind(operator)
     # Find the start of the left operand
     start = operatorPos - 1
@@ -297,279 +534,5650 @@ def FindStartAndEnd(expresion: str, operator: str):
     return start, end
 
 
-def FindLogarithmDetails(toCalculate: str):
+def ReplaceLogarithms(toCalculate: str) -> str:
     """
-    This function finds the details of the logarithm operation in the expression.
+    This function replaces every logarithm in the expression with its value, in one
+    pass. Logarithms inside another logarithm's base or argument are worked out first.
     Parameters:
-        expression (str): The mathematical expression to evaluate, expected to be in the format
+        toCalculate (str): The mathematical expression, with logarithms written as
         "log_base(argument)" or "log_(base)(argument)".
 
     Returns:
-        tuple: A tuple containing the start index of the logarithm, the base expression, the argument expression, and the end index of the argument.
+        str: The expression with no logarithms left in it.
     """
 
-    # Find the last occurrence of "log_"
-    start = toCalculate.rfind(Operation.LOGARITHM.value)
-    if start == -1:
-        raise ValueError("No logarithm found in expression.")
-
-    # Find where the base starts (immediately after "log_")
-    baseStart = start + len(Operation.LOGARITHM.value)
+    marker = Operation.LOGARITHM.value
+    length = len(toCalculate)
+    pieces = []  # The text of whatever we are inside of so far
+    # The logarithms we are inside of, as (base, pieces of the outside, depth of the
+    # outside). The base is None while we are still inside a base like log_(...)
+    logarithms = []
+    depth = 0  # Plain parentheses open inside the current base or argument
+    position = 0
+    copiedUpTo = 0
+    while position < length:
+        if not logarithms:
+            # Outside of logarithms only the next "log_" matters
+            position = toCalculate.find(marker, position)
+            if position == -1:
+                break
+        char = toCalculate[position]
+        if char == "l" and toCalculate.startswith(marker, position):
+            pieces.append(toCalculate[copiedUpTo:position])
+            baseStart = position + len(marker)
+            if baseStart < length and toCalculate[baseStart] == "(":
+                # Case 1: base is wrapped in parentheses, e.g. log_((9*2)+(4/2))(10)
+                logarithms.append((None, pieces, depth))
+                position = baseStart + 1
+            else:
+                # Case 2: base is a number, e.g. log_2(16)
+                baseEnd = baseStart
+                while baseEnd < length and toCalculate[baseEnd] in NUMBER_CHARS:
+                    baseEnd += 1
+                if baseEnd >= length or toCalculate[baseEnd] != "(":
+                    raise ValueError(
+                        "Invalid syntax for logarithm argument. Use log_base(argument)."
+                    )
+                logarithms.append((toCalculate[baseStart:baseEnd], pieces, depth))
+                position = baseEnd + 1
+            pieces = []
+            depth = 0
+            copiedUpTo = position
+        elif char == "(":
+            depth += 1
+            position += 1
+        elif char == ")" and depth:
+            depth -= 1
+            position += 1
+        elif char == ")":
+            # This closes the base or argument we are in
+            pieces.append(toCalculate[copiedUpTo:position])
+            inside = "".join(pieces)
+            base, pieces, depth = logarithms.pop()
+            position += 1
+            if base is None:
+                # Argument must be immediately after base's ')'
+                if position >= length or toCalculate[position] != "(":
+                    raise ValueError(
+                        "Invalid syntax for logarithm argument. Use "
+                        "log_(base)(argument)."
+                    )
+                logarithms.append((inside, pieces, depth))
+                pieces = []
+                depth = 0
+                position += 1
+            else:
+                pieces.append(Logarithm(base + "," + inside))
+            copiedUpTo = position
+        else:
+            position += 1
 
-    # Case 1: base is wrapped in parentheses, e.g. log_((9*2)+(4/2))(10)
-    if toCalculate[baseStart] == "(":
-        # Find the matching ')' for the base
-        parenCount = 1
-        baseEnd = baseStart + 1
-        while baseEnd < len(toCalculate) and parenCount > 0:
-            if toCalculate[baseEnd] == "(":
-                parenCount += 1
-            elif toCalculate[baseEnd] == ")":
-                parenCount -= 1
-            baseEnd += 1
-        if parenCount != 0:
+    if logarithms:
+        if logarithms[-1][0] is None:
             raise ValueError("Mismatched parentheses in logarithm base.")
-        baseExpr = toCalculate[baseStart + 1 : baseEnd - 1]
-        # Argument must be immediately after base's ')'
-        if baseEnd >= len(toCalculate) or toCalculate[baseEnd] != "(":
-            raise ValueError(
-                "Invalid syntax for logarithm argument. Use log_(base)(argument)."
-            )
-        argOpen = baseEnd
-    else:
-        # Case 2: base is a number, e.g. log_2(16)
-        baseEnd = baseStart
-        while baseEnd < len(toCalculate) and (
-            toCalculate[baseEnd].isdigit() or toCalculate[baseEnd] == "."
-        ):
-            baseEnd += 1
-        baseExpr = toCalculate[baseStart:baseEnd]
-        if baseEnd >= len(toCalculate) or toCalculate[baseEnd] != "(":
-            raise ValueError(
-                "Invalid syntax for logarithm argument. Use log_base(argument)."
-            )
-        argOpen = baseEnd
-
-    # Now, find the matching ')' for the argument
-    parenCount = 1
-    argEnd = argOpen + 1
-    while argEnd < len(toCalculate) and parenCount > 0:
-        if toCalculate[argEnd] == "(":
-            parenCount += 1
-        elif toCalculate[argEnd] == ")":
-            parenCount -= 1
-        argEnd += 1
-    if parenCount != 0:
         raise ValueError("Mismatched parentheses in logarithm argument.")
+    pieces.append(toCalculate[copiedUpTo:])
+    return "".join(pieces)
 
-    argExpr = toCalculate[argOpen + 1 : argEnd - 1]
-    return start, baseExpr, argExpr, argEnd
 
+class TokenKind(Enum):
+    NUMBER = "number"
+    VARIABLE = "variable"
+    OPERATOR = "operator"
+    LOGARITHM = "log_"
+    OPEN_PAREN = "("
+    CLOSE_PAREN = ")"
+    END = "end of expression"
 
-def TestCases():
+
+class Token(NamedTuple):
+    kind: TokenKind
+    # The value for numbers, the name for variables, an Operation for operators, None
+    # otherwise
+    value: object
+    position: int  # Index of the token's first character in the expression
+
+
+# Every single character operator, so the lexer can look them up in one step
+OPERATOR_SYMBOLS = {
+    operation.value: operation
+    for operation in Operation
+    if operation is not Operation.LOGARITHM
+}
+
+# How tightly each binary operator binds, higher binds tighter
+BINARY_PRECEDENCE = {
+    Operation.ADD: 1,
+    Operation.SUBTRACT: 1,
+    Operation.MULTIPLY: 2,
+    Operation.DIVIDE: 2,
+    Operation.MOD: 2,
+    Operation.EXPONENT: 3,
+}
+RIGHT_ASSOCIATIVE = {Operation.EXPONENT}  # 2^3^2 is 2^(3^2)
+
+NUMBER_CHARS = set("0123456789.")
+NAME_START_CHARS = set(string.ascii_letters)
+NAME_CHARS = NAME_START_CHARS | set(string.digits) | {"_"}
+SPACE_CHARS = set(string.whitespace)
+
+
+class NumberNode:
+    """
+    A number in the expression tree.
     """
-    This function tests the basic functionality of the calculator.
-    Parameters:
-        None
 
-    Returns:
-        None
+    __slots__ = ("value",)
+
+    def __init__(self, value: float):
+        """
+        This function creates a number node.
+        Parameters:
+            value (float): The value of the number.
+
+        Returns:
+            None
+        """
+
+        self.value = value
+
+
+class VariableNode:
+    """
+    A named variable in the expression tree, its value is given when the tree is
+    evaluated.
     """
 
-    # Regular basic cases
+    __slots__ = ("name",)
 
-    assert Add("2+3") == "5.0"
-    assert Subtract("5-3") == "2.0"
-    assert Multiply("2*3") == "6.0"
-    assert Divide("6/3") == "2.0"
-    assert Mod("5%2") == "1.0"
-    assert Exponent("2^3") == "8.0"
-    assert Logarithm("2,8") == "3.0"
+    def __init__(self, name: str):
+        """
+        This function creates a variable node.
+        Parameters:
+            name (str): The name of the variable.
 
-    # Basic edge cases
-    try:
-        Divide("5/0")
-    except ValueError as e:
-        assert str(e) == "Cannot divide by zero."
+        Returns:
+            None
+        """
 
-    try:
-        Mod("5%0")
-    except ValueError as e:
-        assert str(e) == "Cannot perform modulus by zero."
+        self.name = name
 
-    # More complex cases
-    assert EvaluateExpression("2+3*4") == "14.0"
-    assert EvaluateExpression("10-2^3") == "2.0"
-    assert EvaluateExpression("log_10(100)") == "2.0"
-    assert EvaluateExpression("2*(3+4)") == "14.0"
-    assert EvaluateExpression("2^3*4") == "32.0"
-    assert EvaluateExpression("(2^2^(2+1))") == "256.0"
-    # 2^2^(2+1) is 2^2^2 = 2^8 = 256
-    assert EvaluateExpression("log_2(16)/2") == "2.0"
-    assert EvaluateExpression("log_2(8)+1") == "4.0"
-    assert EvaluateExpression("(47)*(2/47)+2") == "4.0"
 
-    print("MY STUFF WORKS????")
+class BinaryNode:
+    """
+    An operation on two operands in the expression tree.
+    For logarithms the left operand is the base and the right operand is the argument.
+    """
 
+    __slots__ = ("operation", "left", "right")
 
-def EvaluateExpression(toCalculate: str) -> str:
+    def __init__(self, operation: Operation, left, right):
+        """
+        This function creates an operation node.
+        Parameters:
+            operation (Operation): The operation to perform.
+            left: The node of the left operand.
+            right: The node of the right operand.
+
+        Returns:
+            None
+        """
+
+        self.operation = operation
+        self.left = left
+        self.right = right
+
+
+class LexerState(Enum):
+    # What the lexer expects next, worded for error messages
+    OPERAND = "a number, a variable, '(', '-' or log_"
+    # Right after an operator or a sign
+    SIGNED_OPERAND = "a number, a variable, '(' or log_"
+    OPERATOR = "an operator, ')' or the end of the expression"
+    LOG_BASE = "a number, a variable or '(' for the logarithm base"
+    LOG_ARGUMENT = "'(' for the logarithm argument"
+
+
+def SyntaxProblem(problem: str, state: LexerState) -> ValueError:
     """
-    This function evaluates a mathematical expression.
+    This function makes the error for a syntax mistake, saying what should have been
+    there instead.
     Parameters:
-        toCalculate (str): The mathematical expression to evaluate, expected to be in the format
-        "a+b", "a-b", "a*b", "a/b", "a%b", "a^b", or "log_b(a)".
-        or a chain of the above operations.
+        problem (str): What is wrong and where.
+        state (LexerState): What the lexer expected at that point.
 
     Returns:
-        str: The result of the evaluation as a string.
+        ValueError: The error to raise.
     """
 
-    # I want to see if the expression is fully evaluated at this point,
-    # So i will itterate through each character starting from the 2nd postion (since the first is always a digit or a - for negative numbers)
-    # If it's a digit or decimal, we keep going
-    # If it's an operator, we will break out of the loop and continue with the logic below
-    # But what if the user inputs something of length 1?
-    if len(toCalculate) == 1:
-        if toCalculate[0].isdigit():
-            # If the input is a single digit, we can return the expression as is
-            return toCalculate
-        else:
-            # Length is 1 but it is not a digit
-            return "\nYou fool.\nYou absolute buffoon.\nYour mother was a hamster and your father smelt of elderberry.\nGet you and your galoping coconuts out of here."
-
-    # Range(1, len(toCalculate)) is used to skip the first character
-    for i in range(1, len(toCalculate)):
-        if toCalculate[i].isdigit() or toCalculate[i] == ".":
-            if i == len(toCalculate) - 1:
-                # If we are at the last character and it's a digit or decimal, we can assume the expression is fully evaluated
-                # So we can return the expression as is
-                return toCalculate
-            # If we are not at the last character, we continue to the next character
-            continue
-        else:
-            # If we hit a non-digit, non-decimal, non-negative sign, we break out of the loop
-            # This means that the expression is not fully evaluated yet
-            break
-    if DEBUG:
-        print("in evaluateExpression, toCalculate: ", toCalculate)
-
-    # Since a given input will only be one operation,
-    # We can use a switch case to determine the operation
-    match True:
-
-        # I want to do it in order of PEMDAS, so I will handle parentheses first
-        # If there an opening parenthasis, that is not part of a logarithm, we will handle it first
-        case _ if (
-            "(" in toCalculate
-            and ")" in toCalculate
-            and Operation.LOGARITHM.value not in toCalculate
-        ):
-            # Handle innermost parentheses first
-
-            # Finds the last opening parenthasis
-            start = toCalculate.rfind("(")
-            # Finds the first closing parenthasis after the opening parenthasis
-            end = toCalculate.find(")", start)
-            if start == -1 or end == -1:
-                raise ValueError("Mismatched parentheses.")
-            innerExpression = toCalculate[start + 1 : end]
-            innerResult = EvaluateExpression(innerExpression)  # Recursive call
-
-            # 3 parts in the return value:
-            # 1. The part of the string before the parentheses
-            # 2. The result of the inner expression
-            # 3. The part of the string after the parentheses
-            # Replace the inner expression with its result
-            # After evaluating the inner expression, we call evaluateExpression again
-            # To handle any remaining operations in the rest of the expression
-            return EvaluateExpression(
-                toCalculate[:start] + str(innerResult) + toCalculate[end + 1 :]
-            )
+    return ValueError(f"{problem}, expected {state.value}.")
+
+
+def TooManyOperations(maxOperations: int, position: int) -> ValueError:
+    """
+    This function makes the error for an expression with more operators than its budget
+    allows.
+    Parameters:
+        maxOperations (int): The most operators allowed.
+        position (int): Where the first one too many is.
+
+    Returns:
+        ValueError: The error to raise.
+    """
+
+    return ValueError(
+        f"Too many operations: more than {maxOperations} at position {position}."
+    )
+
+
+class Lexer:
+    """
+    Splits an expression into tokens and checks its syntax in the same single pass,
+    stopping at the first mistake with its position and what was expected there.
+    The text can be read in pieces, so a stream is checked as it comes in.
+    A budget limits how deeply parentheses nest and how many operators there are.
+    """
+
+    __slots__ = (
+        "number",
+        "variables",
+        "offset",
+        "state",
+        "groups",
+        "previous",
+        "operations",
+        "maxDepth",
+        "maxOperations",
+    )
+
+    def __init__(
+        self,
+        number=float,
+        variables: bool = True,
+        offset: int = 0,
+        budget: "Budget" = None,
+    ):
+        """
+        This function creates a lexer.
+        Parameters:
+            number: The function that turns the text of a number into a value, float by
+            default.
+            variables (bool): False to reject variable names, for the legacy engine.
+            offset (int): The position of the first character read, for when the text is
+            a piece of a longer expression.
+            budget (Budget): The nesting and operator limits, None for no limits.
+
+        Returns:
+            None
+        """
+
+        self.number = number
+        self.variables = variables
+        self.offset = offset
+        self.state = LexerState.OPERAND
+        # The position of each open parenthesis, and whether it holds a logarithm base
+        self.groups = []
+        self.previous = None  # The last token read
+        self.operations = 0  # Operators and logarithms read so far
+        self.maxDepth = math.inf
+        self.maxOperations = math.inf
+        if budget is not None:
+            self.maxDepth = budget.maxDepth or math.inf
+            self.maxOperations = budget.maxOperations or math.inf
+
+    def read(self, text: str) -> list:
+        """
+        This function tokenizes and checks the next piece of the expression.
+        Parameters:
+            text (str): The piece. It must not end in the middle of a token.
+
+        Returns:
+            list: The tokens of the piece, without an END token.
+        """
+
+        tokens = []
+        append = tokens.append
+        number = self.number
+        offset = self.offset
+        state = self.state
+        groups = self.groups
+        previous = self.previous
+        operations = self.operations
+        maxOperations = self.maxOperations
+        OPERAND = LexerState.OPERAND
+        SIGNED_OPERAND = LexerState.SIGNED_OPERAND
+        OPERATOR = LexerState.OPERATOR
+        LOG_BASE = LexerState.LOG_BASE
+        LOG_ARGUMENT = LexerState.LOG_ARGUMENT
+        length = len(text)
+        i = 0
+        while i < length:
+            char = text[i]
+            if char in SPACE_CHARS:
+                i += 1
+                continue
+            position = i + offset
+            if char in NUMBER_CHARS or char in NAME_START_CHARS:
+                if char in NUMBER_CHARS:
+                    # Read the whole number in one go
+                    start = i
+                    while i < length and text[i] in NUMBER_CHARS:
+                        i += 1
+                    value = text[start:i]
+                    try:
+                        token = Token(TokenKind.NUMBER, number(value), position)
+                    except (ValueError, ArithmeticError):
+                        raise ValueError(
+                            f"Invalid number '{value}' at position {position}."
+                        )
+                elif text.startswith(Operation.LOGARITHM.value, i):
+                    i += len(Operation.LOGARITHM.value)
+                    if state is not OPERAND and state is not SIGNED_OPERAND:
+                        raise SyntaxProblem(
+                            f"Invalid syntax: unexpected 'log_' at position {position}",
+                            state,
+                        )
+                    append(Token(TokenKind.LOGARITHM, None, position))
+                    operations += 1
+                    if operations > maxOperations:
+                        raise TooManyOperations(maxOperations, position)
+                    state = LOG_BASE
+                    continue
+                else:
+                    # A variable name, letters first then letters, digits or underscores
+                    if not self.variables:
+                        raise ValueError(
+                            f"Invalid character '{char}' at position {position}."
+                        )
+                    start = i
+                    while i < length and text[i] in NAME_CHARS:
+                        i += 1
+                    token = Token(TokenKind.VARIABLE, text[start:i], position)
+                # A number or a variable
+                if state is OPERATOR:
+                    if (
+                        token.kind is TokenKind.NUMBER
+                        and previous.kind is TokenKind.CLOSE_PAREN
+                    ):
+                        raise SyntaxProblem(
+                            "Invalid syntax: closing parenthesis cannot precede "
+                            f"the number at position {position}",
+                            state,
+                        )
+                    raise SyntaxProblem(
+                        f"Invalid syntax: unexpected {DescribeToken(token)}", state
+                    )
+                if state is LOG_ARGUMENT:
+                    raise SyntaxProblem(
+                        f"Invalid syntax for logarithm argument at position {position}",
+                        state,
+                    )
+                state = LOG_ARGUMENT if state is LOG_BASE else OPERATOR
+            elif char in OPERATOR_SYMBOLS:
+                token = Token(TokenKind.OPERATOR, OPERATOR_SYMBOLS[char], position)
+                i += 1
+                operations += 1
+                if operations > maxOperations:
+                    raise TooManyOperations(maxOperations, position)
+                if state is OPERATOR or (state is OPERAND and char == "-"):
+                    state = SIGNED_OPERAND
+                elif previous is not None and previous.kind is TokenKind.OPERATOR:
+                    raise SyntaxProblem(
+                        f"Consecutive operators found at position {position}", state
+                    )
+                else:
+                    raise SyntaxProblem(
+                        f"Invalid syntax: unexpected {DescribeToken(token)}", state
+                    )
+            elif char == "(":
+                token = Token(TokenKind.OPEN_PAREN, None, position)
+                i += 1
+                if state is OPERATOR:
+                    raise SyntaxProblem(
+                        f"Invalid syntax: opening parenthesis at position {position} "
+                        "cannot follow a number",
+                        state,
+                    )
+                groups.append((position, state is LOG_BASE))
+                if len(groups) > self.maxDepth:
+                    raise ValueError(
+                        f"Too deeply nested: more than {self.maxDepth} levels of "
+                        f"parentheses at position {position}."
+                    )
+                state = OPERAND
+            elif char == ")":
+                token = Token(TokenKind.CLOSE_PAREN, None, position)
+                i += 1
+                if state is not OPERATOR:
+                    raise SyntaxProblem(
+                        f"Invalid syntax: unexpected ')' at position {position}", state
+                    )
+                if not groups:
+                    raise ValueError(
+                        f"Mismatched parentheses: ')' at position {position} has no "
+                        "matching '('."
+                    )
+                state = LOG_ARGUMENT if groups.pop()[1] else OPERATOR
+            else:
+                raise SyntaxProblem(
+                    f"Invalid character '{char}' at position {position}", state
+                )
+            append(token)
+            previous = token
+        self.offset = offset + length
+        self.state = state
+        self.previous = previous
+        self.operations = operations
+        return tokens
+
+    def end(self) -> Token:
+        """
+        This function checks that the expression read so far is complete.
+        Parameters:
+            None
+
+        Returns:
+            Token: The END token.
+        """
 
-        case _ if Operation.LOGARITHM.value in toCalculate:
-            # The logic for logarithm is a bit (AAAAAAAAAAAAAAAAAAAAAA) more complex,
-            # So i will be placing it an entirely sepreate method
-            # Which will be called FindLogarithmDetails(toCalculate)
-
-            start, arg1, arg2, argEnd = FindLogarithmDetails(toCalculate)
-
-            logResult = Logarithm(arg1 + "," + arg2)
-            newExpr = toCalculate[:start] + logResult + toCalculate[argEnd:]
-            return EvaluateExpression(newExpr)
-
-        case _ if Operation.EXPONENT.value in toCalculate:
-            start, end = FindStartAndEnd(toCalculate, Operation.EXPONENT.value)
-            expResult = Exponent(toCalculate[start:end])
-            newExpr = toCalculate[:start] + expResult + toCalculate[end:]
-            return EvaluateExpression(newExpr)
-
-        case _ if Operation.MULTIPLY.value in toCalculate:
-            start, end = FindStartAndEnd(toCalculate, Operation.MULTIPLY.value)
-            mulResult = Multiply(toCalculate[start:end])
-            newExpr = toCalculate[:start] + mulResult + toCalculate[end:]
-            return EvaluateExpression(newExpr)
-
-        case _ if Operation.DIVIDE.value in toCalculate:
-            start, end = FindStartAndEnd(toCalculate, Operation.DIVIDE.value)
-            divResult = Divide(toCalculate[start:end])
-            newExpr = toCalculate[:start] + divResult + toCalculate[end:]
-            return EvaluateExpression(newExpr)
-
-        case _ if Operation.MOD.value in toCalculate:
-            start, end = FindStartAndEnd(toCalculate, Operation.MOD.value)
-            modResult = Mod(toCalculate[start:end])
-            newExpr = toCalculate[:start] + modResult + toCalculate[end:]
-            return EvaluateExpression(newExpr)
-
-        case _ if Operation.ADD.value in toCalculate:
-            start, end = FindStartAndEnd(toCalculate, Operation.ADD.value)
-            addResult = Add(toCalculate[start:end])
-            newExpr = toCalculate[:start] + addResult + toCalculate[end:]
-            return EvaluateExpression(newExpr)
-
-        case _ if Operation.SUBTRACT.value in toCalculate:
-            start, end = FindStartAndEnd(toCalculate, Operation.SUBTRACT.value)
-            subResult = Subtract(toCalculate[start:end])
-            newExpr = toCalculate[:start] + subResult + toCalculate[end:]
-            return EvaluateExpression(newExpr)
-
-        case _:
+        if self.state is not LexerState.OPERATOR:
+            raise SyntaxProblem(
+                f"Invalid syntax: expression ends at position {self.offset}", self.state
+            )
+        if self.groups:
             raise ValueError(
-                "Invalid operation. Please use +, -, *, /, %, ^, or log_b(a)."
+                f"Mismatched parentheses: '(' at position {self.groups[-1][0]} "
+                "is never closed, expected ')'."
             )
+        return Token(TokenKind.END, None, self.offset)
 
 
-def main():
+def Tokenize(
+    toCalculate: str,
+    number=float,
+    offset: int = 0,
+    variables: bool = True,
+    budget: "Budget" = None,
+) -> list:
     """
-    This function serves as the main entry point for the calculator program.
-    It prompts the user for a mathematical expression, and then validates, evaluates, and prints it.
+    This function splits an expression into tokens in a single pass, checking its syntax
+    as it goes.
     Parameters:
-        None
+        toCalculate (str): The mathematical expression to tokenize.
+        number: The function that turns the text of a number into a value, float by
+        default.
+        offset (int): Added to every token's position, for when toCalculate is a piece
+        of a longer expression.
+        variables (bool): False to reject variable names.
+        budget (Budget): The nesting and operator limits, None for no limits.
 
     Returns:
-        None
+        list: The tokens of the expression, always ending with an END token.
     """
 
-    # Uncomment the line below to run test cases
-    TestCases()
+    lexer = Lexer(number, variables, offset, budget)
+    tokens = lexer.read(toCalculate)
+    tokens.append(lexer.end())
+    return tokens
+
+
+# Characters that always end a token, so a piece of a stream can be cut right after them
+TOKEN_ENDS = [*OPERATOR_SYMBOLS, "(", ")", " "]
+# Line breaks and tabs in a stream are read as spaces
+STREAM_WHITESPACE = str.maketrans("\n\r\t", "   ")
+
+
+def TokenizeStream(chunks, number=float, budget: "Budget" = None):
+    """
+    This function tokenizes an expression that arrives in pieces, like a file read a
+    chunk at a time. A token cut in two at the end of a piece is held back until the
+    rest of it arrives, so only about one piece is ever kept in memory.
+    Parameters:
+        chunks: An iterable of pieces of the expression's text.
+        number: The function that turns the text of a number into a value, float by
+        default.
+        budget (Budget): The nesting and operator limits, None for no limits.
+
+    Returns:
+        generator: The tokens of the expression, ending with an END token.
+    """
+
+    lexer = Lexer(number, budget=budget)
+    pending = ""  # The end of the last piece, which might be half a token
+    for chunk in chunks:
+        text = pending + chunk.translate(STREAM_WHITESPACE)
+        cut = max(text.rfind(end) for end in TOKEN_ENDS) + 1
+        if cut == 0:
+            pending = text  # One very long token, keep reading
+            continue
+        yield from lexer.read(text[:cut])
+        pending = text[cut:]
+    yield from lexer.read(pending)
+    yield lexer.end()
+
+
+def ReadChunks(stream, chunkSize: int):
+    """
+    This function reads a stream a chunk at a time.
+    Parameters:
+        stream: A text stream, like an open file or sys.stdin.
+        chunkSize (int): How many characters to read at a time.
+
+    Returns:
+        generator: The chunks, until the stream runs out.
+    """
 
-    print("Welcome to le calculator! (honhon baguette)")
     while True:
-        toCalculate = input("Enter an expression (or 'quit' to exit): ")
-        if toCalculate.lower() == "quit":
-            # using lower() so i don't need to care about casing for the input so my enum will work
+        chunk = stream.read(chunkSize)
+        if not chunk:
+            return
+        yield chunk
 
-            print("quiter :/")
-            break
+
+def DescribeToken(token: Token) -> str:
+    """
+    This function describes a token for error messages.
+    Parameters:
+        token (Token): The token to describe.
+
+    Returns:
+        str: A short description of the token and where it is.
+    """
+
+    if token.kind is TokenKind.END:
+        return "end of expression"
+    if token.kind is TokenKind.OPERATOR:
+        return f"'{token.value.value}' at position {token.position}"
+    if token.kind is TokenKind.NUMBER:
+        return f"number at position {token.position}"
+    if token.kind is TokenKind.VARIABLE:
+        return f"variable '{token.value}' at position {token.position}"
+    return f"'{token.kind.value}' at position {token.position}"
+
+
+def ParseTree(toCalculate: str, number=float, budget: "Budget" = None):
+    """
+    This function tokenizes and parses an expression into an expression tree.
+    The tree is put together from the postfix items of the shunting-yard with a stack of
+    nodes, so long chains and deep nesting never recurse.
+    Parameters:
+        toCalculate (str): The mathematical expression to parse.
+        number: The function that turns the text of a number into a value, float by
+        default.
+        budget (Budget): The nesting and operator limits, None for no limits.
+
+    Returns:
+        NumberNode, VariableNode or BinaryNode: The root of the expression tree.
+    """
+
+    nodes = []
+    push = nodes.append
+    pop = nodes.pop
+    for item in PostfixItems(Tokenize(toCalculate, number, budget=budget), number):
+        itemClass = item.__class__
+        if itemClass is Operation:
+            right = pop()
+            nodes[-1] = BinaryNode(item, nodes[-1], right)
+        elif itemClass is str:
+            push(VariableNode(item))
+        else:
+            push(NumberNode(item))
+    return nodes[0]
+
+
+def LookUpVariable(name: str, bindings: dict) -> float:
+    """
+    This function finds the value of a variable.
+    Parameters:
+        name (str): The name of the variable.
+        bindings (dict): The value of every variable, by name. May be None.
+
+    Returns:
+        float: The value of the variable.
+    """
+
+    if bindings is None or name not in bindings:
+        raise ValueError(f"No value given for variable '{name}'.")
+    return bindings[name]
+
+
+def ApplyOperation(operation: Operation, left: float, right: float) -> float:
+    """
+    This function applies one operation to two numbers.
+    Parameters:
+        operation (Operation): The operation to apply.
+        left (float): The left operand, or the base for logarithms.
+        right (float): The right operand, or the argument for logarithms.
+
+    Returns:
+        float: The result of the operation.
+    """
+
+    match operation:
+        case Operation.ADD:
+            return CheckFloatSize(left + right, left, right)
+        case Operation.SUBTRACT:
+            return CheckFloatSize(left - right, left, right)
+        case Operation.MULTIPLY:
+            return CheckFloatSize(left * right, left, right)
+        case Operation.DIVIDE:
+            if right == 0:
+                raise ValueError("Cannot divide by zero.")
+            return CheckFloatSize(left / right, left, right)
+        case Operation.MOD:
+            if right == 0:
+                raise ValueError("Cannot perform modulus by zero.")
+            return left % right
+        case Operation.EXPONENT:
+            if left == 0 and right < 0:
+                raise ValueError("Cannot raise zero to a negative power.")
+            try:
+                result = left**right
+            except OverflowError:
+                # Floats top out a little under 2^1024
+                raise ValueError(
+                    f"Result would be larger than {FLOAT_BITS} bits."
+                ) from None
+            if result.__class__ is complex:
+                raise ValueError(
+                    "Cannot raise a negative number to a fractional power."
+                )
+            return result
+        case Operation.LOGARITHM:
+            return LogarithmOf(left, right)
+
+
+def CheckFloatSize(result: float, left: float, right: float) -> float:
+    """
+    This function stops a float result that went past the largest float. Unlike **,
+    adding, multiplying and dividing don't raise OverflowError, they just give inf.
+    Parameters:
+        result (float): The result of the operation.
+        left (float): The left operand.
+        right (float): The right operand.
+
+    Returns:
+        float: The result, if it isn't inf made out of finite operands.
+    """
+
+    # inf - inf and nan - nan are nan, which is truthy, anything finite gives 0
+    if result - result and math.isfinite(left) and math.isfinite(right):
+        raise ValueError(f"Result would be larger than {FLOAT_BITS} bits.")
+    return result
+
+
+# Bases that have their own, more accurate, log function. log_10(1000) is exactly 3 this
+# way
+SPECIAL_LOGARITHMS = {2: math.log2, 10: math.log10, math.e: math.log}
+# Logarithm results by (base, argument). Every Calculator and thread shares it, since a
+# logarithm is the same whatever settings it was found with. Changes are made under the
+# lock
+LOGARITHM_CACHE = {}
+LOGARITHM_LOCK = _thread.allocate_lock()
+
+
+def LogarithmOf(base, argument) -> float:
+    """
+    This function calculates the logarithm of argument with the given base, remembering
+    results so expressions that take the same logarithm many times only calculate it
+    once.
+    Parameters:
+        base: The base of the logarithm, an int, float or Fraction.
+        argument: The number to take the logarithm of.
+
+    Returns:
+        float: The logarithm.
+    """
+
+    special = SPECIAL_LOGARITHMS.get(base)
+    if special is not None:
+        return special(argument)
+    key = (base, argument)
+    result = LOGARITHM_CACHE.get(key)
+    if result is not None:
+        return result
+    if base == 1:
+        raise ValueError("Logarithm base cannot be 1.")
+    result = WholeLogarithm(base, argument)
+    if result is None:
+        result = math.log(argument, base)
+    with LOGARITHM_LOCK:
+        if len(LOGARITHM_CACHE) >= LOGARITHM_CACHE_SIZE:
+            LOGARITHM_CACHE.clear()
+        LOGARITHM_CACHE[key] = result
+    return result
+
+
+def WholeLogarithm(base, argument):
+    """
+    This function finds logarithms that come out whole, like log_5(125), without
+    floating point error. math.log(125, 5) gives 3.0000000000000004.
+    Parameters:
+        base: The base of the logarithm.
+        argument: The number to take the logarithm of.
+
+    Returns:
+        float: The whole logarithm, or None if the logarithm isn't whole or the numbers
+        aren't.
+    """
+
+    if base.__class__ is float:
+        if not base.is_integer():
+            return None
+        base = int(base)
+    if argument.__class__ is float:
+        if not argument.is_integer():
+            return None
+        argument = int(argument)
+    if base.__class__ is not int or argument.__class__ is not int:
+        return None
+    if base < 2 or argument < 1:
+        return None
+
+    if base & (base - 1) == 0:
+        # Powers of two can be read off the number of bits
+        if argument & (argument - 1):
+            return None
+        power, leftover = divmod(argument.bit_length() - 1, base.bit_length() - 1)
+        return float(power) if leftover == 0 else None
+    power = 0
+    while argument % base == 0:
+        CheckDeadline()
+        argument //= base
+        power += 1
+    return float(power) if argument == 1 else None
+
+
+def ParseExactNumber(text: str):
+    """
+    This function reads a number exactly: whole numbers become ints, anything else a
+    Fraction.
+    Parameters:
+        text (str): The number as written, like "12" or "0.1".
+
+    Returns:
+        int or Fraction: The exact value of the number.
+    """
+
+    if "." not in text:
+        return int(text)
+    return Simplify(Fraction(text))
+
+
+def Simplify(value):
+    """
+    This function turns a whole Fraction back into an int, so the int fast path keeps
+    being used.
+    Parameters:
+        value (int or Fraction): The value to simplify.
+
+    Returns:
+        int or Fraction: The same value, as an int if it is whole.
+    """
+
+    if value.__class__ is Fraction and value.denominator == 1:
+        return value.numerator
+    return value
+
+
+def IntegerRoot(value: int, degree: int):
+    """
+    This function finds an exact whole root of a whole number, without touching floats.
+    Parameters:
+        value (int): The number to take the root of, at least 0.
+        degree (int): Which root to take, at least 1.
+
+    Returns:
+        int: The root if it is a whole number, otherwise None.
+    """
+
+    if value < 2:
+        return value
+    if degree >= value.bit_length():
+        # The root would be between 1 and 2, like for 2^0.00000000000000000001
+        return None
+    # Newton's method on integers, starting from a power of two above the root
+    root = 1 << -(-value.bit_length() // degree)
+    while True:
+        CheckDeadline()
+        nextRoot = ((degree - 1) * root + value // root ** (degree - 1)) // degree
+        if nextRoot >= root:
+            break
+        root = nextRoot
+    return root if root**degree == value else None
+
+
+def ApplyExactOperation(operation: Operation, left, right):
+    """
+    This function applies one operation exactly, on ints and Fractions.
+    Results are kept as ints whenever they are whole. Only answers that can't be written
+    as a fraction at all, like 2^0.5 or most logarithms, fall back to floats.
+    Parameters:
+        operation (Operation): The operation to apply.
+        left (int or Fraction): The left operand, or the base for logarithms.
+        right (int or Fraction): The right operand, or the argument for logarithms.
+
+    Returns:
+        int, Fraction or float: The result of the operation.
+    """
+
+    match operation:
+        case Operation.ADD:
+            return left + right
+        case Operation.SUBTRACT:
+            return left - right
+        case Operation.MULTIPLY:
+            return left * right
+        case Operation.DIVIDE:
+            if right == 0:
+                raise ValueError("Cannot divide by zero.")
+            if left.__class__ is int and right.__class__ is int:
+                quotient, remainder = divmod(left, right)
+                if remainder == 0:
+                    return quotient
+                return Fraction(left, right)
+            if left.__class__ is float or right.__class__ is float:
+                return left / right  # Already not exact, like log_2(3)/3
+            return Simplify(Fraction(left) / right)
+        case Operation.MOD:
+            if right == 0:
+                raise ValueError("Cannot perform modulus by zero.")
+            return Simplify(left % right)
+        case Operation.EXPONENT:
+            return ExactPower(left, right)
+        case Operation.LOGARITHM:
+            return ApplyOperation(operation, left, right)
+
+
+def ExactPower(base, exponent):
+    """
+    This function raises base to the power of exponent, exactly whenever the answer is
+    rational.
+    Parameters:
+        base (int or Fraction): The number to raise.
+        exponent (int or Fraction): The power to raise it to.
+
+    Returns:
+        int, Fraction or float: The result of the exponentiation.
+    """
+
+    if exponent.__class__ is int:
+        if exponent >= 0:
+            return base**exponent
+        if base == 0:
+            raise ValueError("Cannot raise zero to a negative power.")
+        return Simplify(Fraction(base) ** exponent)
+
+    # A fractional power p/q is exact if the q-th root of the base is rational
+    if exponent.__class__ is Fraction and base >= 0:
+        base = Fraction(base)
+        numeratorRoot = IntegerRoot(base.numerator, exponent.denominator)
+        denominatorRoot = IntegerRoot(base.denominator, exponent.denominator)
+        if numeratorRoot is not None and denominatorRoot is not None:
+            return ExactPower(
+                Simplify(Fraction(numeratorRoot, denominatorRoot)), exponent.numerator
+            )
+    return ApplyOperation(Operation.EXPONENT, float(base), float(exponent))
+
+
+def ApplyDecimalOperation(
+    operation: Operation, left: Decimal, right: Decimal
+) -> Decimal:
+    """
+    This function applies one operation on Decimals, rounding to the precision of the
+    current decimal context.
+    Parameters:
+        operation (Operation): The operation to apply.
+        left (Decimal): The left operand, or the base for logarithms.
+        right (Decimal): The right operand, or the argument for logarithms.
+
+    Returns:
+        Decimal: The result of the operation.
+    """
+
+    try:
+        match operation:
+            case Operation.ADD:
+                return left + right
+            case Operation.SUBTRACT:
+                return left - right
+            case Operation.MULTIPLY:
+                return left * right
+            case Operation.DIVIDE:
+                if right == 0:
+                    raise ValueError("Cannot divide by zero.")
+                return left / right
+            case Operation.MOD:
+                if right == 0:
+                    raise ValueError("Cannot perform modulus by zero.")
+                # Decimal's % keeps the sign of the left side, floats keep the sign of
+                # the right side
+                try:
+                    remainder = left % right
+                except InvalidOperation:
+                    raise ValueError(
+                        "Modulus needs more digits than the decimal precision."
+                    )
+                if remainder and (remainder < 0) != (right < 0):
+                    remainder += right
+                return remainder
+            case Operation.EXPONENT:
+                if left == 0 and right < 0:
+                    raise ValueError("Cannot raise zero to a negative power.")
+                if left < 0 and right != right.to_integral_value():
+                    raise ValueError(
+                        "Cannot raise a negative number to a fractional power."
+                    )
+                return left**right
+            case Operation.LOGARITHM:
+                if left == 1:
+                    raise ValueError("Logarithm base cannot be 1.")
+                if left <= 0 or right <= 0:
+                    raise ValueError("math domain error")
+                # Whole numbers that fit in the precision are exact, so log_2(8) can be
+                # exactly 3
+                digits = getcontext().prec
+                if (
+                    left.adjusted() < digits
+                    and right.adjusted() < digits
+                    and left == left.to_integral_value()
+                    and right == right.to_integral_value()
+                ):
+                    whole = WholeLogarithm(int(left), int(right))
+                    if whole is not None:
+                        return Decimal(int(whole))
+                if left == 10:
+                    return right.log10()
+                return right.ln() / left.ln()
+    except InvalidOperation:
+        raise ValueError("math domain error")
+
+
+def ToDecimal(value) -> Decimal:
+    """
+    This function turns a variable's value into a Decimal, using the shortest text of
+    floats so 0.1 stays 0.1.
+    Parameters:
+        value: An int, float, Decimal or number text.
+
+    Returns:
+        Decimal: The value as a Decimal.
+    """
+
+    if value.__class__ is float:
+        return Decimal(repr(value))
+    return Decimal(value)
+
+
+def ToExact(value):
+    """
+    This function turns a variable's value into an int or a Fraction.
+    Parameters:
+        value: An int, float, Fraction, Decimal or number text.
+
+    Returns:
+        int or Fraction: The value, exactly.
+    """
+
+    if value.__class__ is int:
+        return value
+    if value.__class__ is str:
+        return ParseExactNumber(value)
+    return Simplify(Fraction(value))
+
+
+# How each backend reads numbers from the expression
+BACKEND_NUMBERS = {
+    Backend.FLOAT: float,
+    Backend.EXACT: ParseExactNumber,
+    Backend.DECIMAL: Decimal,
+}
+
+# How each backend applies operations
+BACKEND_OPERATIONS = {
+    Backend.FLOAT: ApplyOperation,
+    Backend.EXACT: ApplyExactOperation,
+    Backend.DECIMAL: ApplyDecimalOperation,
+}
+
+# How each backend reads variable values
+BACKEND_VALUES = {
+    Backend.FLOAT: float,
+    Backend.EXACT: ToExact,
+    Backend.DECIMAL: ToDecimal,
+}
+
+LOG2_OF_10 = math.log2(10)
+FLOAT_BITS = 1024  # Floats overflow past about this many bits
+
+
+def MagnitudeBits(value) -> float:
+    """
+    This function estimates how many bits it takes to write a number down.
+    For Fractions that is the bigger of the numerator and the denominator.
+    Parameters:
+        value: An int, float, Fraction or Decimal.
+
+    Returns:
+        float: About log2 of the number's size, 0 for numbers between -1 and 1.
+    """
+
+    valueClass = value.__class__
+    if valueClass is Fraction:
+        return max(MagnitudeBits(value.numerator), MagnitudeBits(value.denominator))
+    if valueClass is Decimal:
+        if not value.is_finite():
+            return math.inf
+        return max(value.adjusted() + 1, 0) * LOG2_OF_10
+    value = abs(value)
+    if value <= 1:
+        return 0.0
+    return math.log2(value)  # Works on ints of any size
+
+
+def CheckResultSize(operation: Operation, left, right, maxBits: int):
+    """
+    This function refuses powers and products that would come out bigger than maxBits
+    bits, before any time is spent calculating them.
+    Parameters:
+        operation (Operation): The operation about to be applied.
+        left: The left operand.
+        right: The right operand.
+        maxBits (int): The biggest result allowed, in bits.
+
+    Returns:
+        None
+    """
+
+    if operation is Operation.EXPONENT:
+        try:
+            predicted = abs(float(right)) * MagnitudeBits(left)
+        except OverflowError:
+            predicted = math.inf
+    elif operation is Operation.MULTIPLY:
+        predicted = MagnitudeBits(left) + MagnitudeBits(right)
+    else:
+        return
+    if predicted > maxBits:
+        raise ValueError(f"Result would be larger than {maxBits} bits.")
+
+
+def LimitResultSize(apply, maxBits: int):
+    """
+    This function wraps a backend's apply function so it checks result sizes first.
+    Parameters:
+        apply: The backend's function for applying a single operation.
+        maxBits (int): The biggest result allowed, in bits.
+
+    Returns:
+        function: An apply function that raises ValueError for results that would be too
+        big.
+    """
+
+    def LimitedApply(operation: Operation, left, right):
+        """
+        This function applies one operation if its result won't be too big.
+        Parameters:
+            operation (Operation): The operation to apply.
+            left: The left operand.
+            right: The right operand.
+
+        Returns:
+            The result of the operation.
+        """
+
+        if operation is Operation.EXPONENT or operation is Operation.MULTIPLY:
+            CheckResultSize(operation, left, right, maxBits)
+        return apply(operation, left, right)
+
+    return LimitedApply
+
+
+class Budget(NamedTuple):
+    # Limits for one expression, so a pathological one fails fast instead of stalling
+    # its worker. None or 0 turns a limit off. Result sizes have their own limit,
+    # maxBits. In characters, checked before anything else
+    maxLength: int = MAX_EXPRESSION_LENGTH
+    maxDepth: int = MAX_NESTING_DEPTH  # Checked while tokenizing
+    maxOperations: int = MAX_OPERATIONS  # Checked while tokenizing
+    maxSeconds: float = MAX_SECONDS  # Checked before every operation
+
+
+BUDGET = Budget()  # Used by every Calculate call that doesn't bring its own
+# When the expression being calculated has to be done by, as (time.perf_counter(),
+# seconds allowed). A context variable so threads and tasks each have their own, even
+# when sharing compiled closures
+DEADLINE = ContextVar("DEADLINE", default=None)
+
+
+def LimitTime(apply):
+    """
+    This function wraps a backend's apply function so it stops once DEADLINE has passed.
+    Parameters:
+        apply: The backend's function for applying a single operation.
+
+    Returns:
+        function: An apply function that raises ValueError when there is no time left.
+    """
+
+    getDeadline = DEADLINE.get
+    clock = time.perf_counter
+
+    def TimedApply(operation: Operation, left, right):
+        """
+        This function applies one operation if the expression still has time left.
+        Parameters:
+            operation (Operation): The operation to apply.
+            left: The left operand.
+            right: The right operand.
+
+        Returns:
+            The result of the operation.
+        """
+
+        deadline = getDeadline()
+        if deadline is not None and clock() > deadline[0]:
+            raise ValueError(f"Took longer than {deadline[1]} seconds.")
+        return apply(operation, left, right)
+
+    return TimedApply
+
+
+def CheckDeadline():
+    """
+    This function stops a calculation once DEADLINE has passed. LimitTime only checks
+    between operations, so loops that can run for a long time inside one operation call
+    this as they go.
+    Parameters:
+        None
+
+    Returns:
+        None
+    """
+
+    deadline = DEADLINE.get()
+    if deadline is not None and time.perf_counter() > deadline[0]:
+        raise ValueError(f"Took longer than {deadline[1]} seconds.")
+
+
+def CheckLength(toCalculate: str, budget: Budget):
+    """
+    This function refuses expressions longer than the budget allows.
+    Parameters:
+        toCalculate (str): The expression.
+        budget (Budget): The budget.
+
+    Returns:
+        None
+    """
+
+    if budget.maxLength and len(toCalculate) > budget.maxLength:
+        raise ValueError(
+            f"Expression is too long: {len(toCalculate)} characters, "
+            f"more than {budget.maxLength}."
+        )
+
+
+def EvaluateTree(
+    node, bindings: dict = None, apply=ApplyOperation, shared: dict = None
+):
+    """
+    This function evaluates an expression tree, using explicit stacks instead of
+    recursion.
+    Parameters:
+        node (NumberNode, VariableNode, BinaryNode or SharedNode): The root of the tree
+        to evaluate.
+        bindings (dict): The value of every variable in the tree, by name.
+        apply: The function that applies an operation, ApplyOperation for floats.
+        shared (dict): The values of the SharedNodes evaluated so far, by id.
+        Needed for optimized trees.
+
+    Returns:
+        The value of the tree, a float unless another backend's apply is given.
+    """
+
+    values = []
+    push = values.append
+    pop = values.pop
+    # Nodes still to evaluate, and operations to apply once their operands are done
+    toVisit = [node]
+    visit = toVisit.append
+    while toVisit:
+        node = toVisit.pop()
+        nodeClass = node.__class__
+        if nodeClass is NumberNode:
+            push(node.value)
+        elif nodeClass is VariableNode:
+            push(LookUpVariable(node.name, bindings))
+        elif nodeClass is BinaryNode:
+            left = node.left
+            if (
+                node.operation is Operation.MOD
+                and left.__class__ is BinaryNode
+                and left.operation is Operation.EXPONENT
+            ):
+                # a^b%m is done in one step, see ApplyModularPower
+                visit(Instruction.MODULAR_POWER)
+                visit(node.right)
+                visit(left.right)
+                visit(left.left)
+            else:
+                visit(node.operation)
+                visit(node.right)
+                visit(left)
+        elif nodeClass is Operation:
+            right = pop()
+            values[-1] = apply(node, values[-1], right)
+        elif nodeClass is Instruction:
+            modulus = pop()
+            exponent = pop()
+            values[-1] = ApplyModularPower(apply, values[-1], exponent, modulus)
+        elif nodeClass is SharedNode:
+            key = id(node)
+            if key in shared:
+                push(shared[key])
+            else:
+                visit(key)  # Saves the value once it is worked out
+                visit(node.node)
+        else:
+            shared[node] = values[-1]
+    return values[0]
+
+
+class Instruction(Enum):
+    MODULAR_POWER = "^%"  # a^b%m fused into one step, takes three values off the stack
+
+
+def ApplyModularPower(apply, base, exponent, modulus):
+    """
+    This function calculates base^exponent%modulus. For whole numbers it uses three
+    argument pow, which never builds the full power, so 3^1000000%7 is instant.
+    Parameters:
+        apply: The backend's function for applying a single operation, used for
+        everything else.
+        base: The number to raise.
+        exponent: The power to raise it to.
+        modulus: The number to take the remainder by.
+
+    Returns:
+        The value of base^exponent%modulus.
+    """
+
+    baseClass = base.__class__
+    if baseClass is int and exponent.__class__ is int and modulus.__class__ is int:
+        if exponent >= 0:
+            if modulus == 0:
+                raise ValueError("Cannot perform modulus by zero.")
+            return pow(base, exponent, modulus)
+    elif (
+        baseClass is Decimal
+        and exponent.__class__ is Decimal
+        and modulus.__class__ is Decimal
+        and exponent >= 0
+        and IsWhole(base)
+        and IsWhole(exponent)
+        and IsWhole(modulus)
+    ):
+        if modulus == 0:
+            raise ValueError("Cannot perform modulus by zero.")
+        return Decimal(pow(int(base), int(exponent), int(modulus)))
+    elif (
+        baseClass is float
+        and exponent.__class__ is float
+        and modulus.__class__ is float
+        and exponent >= 0
+        and base.is_integer()
+        and exponent.is_integer()
+        and modulus.is_integer()
+    ):
+        # Also exact, where the full power would overflow or lose its last digits
+        if modulus == 0:
+            raise ValueError("Cannot perform modulus by zero.")
+        return float(pow(int(base), int(exponent), int(modulus)))
+    return apply(Operation.MOD, apply(Operation.EXPONENT, base, exponent), modulus)
+
+
+def IsWhole(value: Decimal) -> bool:
+    """
+    This function checks if a Decimal is a finite whole number.
+    Parameters:
+        value (Decimal): The number to check.
+
+    Returns:
+        bool: True if the number is whole.
+    """
+
+    return value.is_finite() and value == value.to_integral_value()
+
+
+def FuseModularPowers(program: list) -> list:
+    """
+    This function finds a^b%m in a postfix program and replaces the power and the
+    modulus with one MODULAR_POWER instruction.
+    Parameters:
+        program (list): A postfix program made by ToPostfix.
+
+    Returns:
+        list: The program with every a^b%m fused.
+    """
+
+    # For every value on the stack, the index of the last item that made it
+    lastItems = []
+    dropped = set()
+    fused = set()
+    for index, item in enumerate(program):
+        if item.__class__ is Operation:
+            lastItems.pop()
+            leftLast = lastItems[-1]
+            if item is Operation.MOD and program[leftLast] is Operation.EXPONENT:
+                dropped.add(leftLast)
+                fused.add(index)
+            lastItems[-1] = index
+        else:
+            lastItems.append(index)
+    if not fused:
+        return program
+    return [
+        Instruction.MODULAR_POWER if index in fused else item
+        for index, item in enumerate(program)
+        if index not in dropped
+    ]
+
+
+# Markers the shunting-yard keeps on its operator stack next to real operations
+OPEN_GROUP = "("
+LOG_BASE = "log_ base"  # Inside a logarithm, waiting for the base to finish
+LOG_ARGUMENT = "log_ argument"  # Inside a logarithm, waiting for the argument to finish
+NEGATE = "negate"  # A negative sign in front of a group or logarithm
+
+# Precedence of everything that can sit on the operator stack,
+# markers that only a closing parenthesis may remove get 0
+STACK_PRECEDENCE = {
+    **BINARY_PRECEDENCE,
+    NEGATE: 4,
+    OPEN_GROUP: 0,
+    LOG_BASE: 0,
+    LOG_ARGUMENT: 0,
+}
+
+
+def ToPostfix(toCalculate: str, number=float, budget: "Budget" = None) -> list:
+    """
+    This function converts an expression to postfix (reverse polish) order using the
+    shunting-yard algorithm. It uses explicit stacks, so nesting depth is only limited
+    by memory.
+    Parameters:
+        toCalculate (str): The mathematical expression to convert.
+        number: The function that turns the text of a number into a value, float by
+        default.
+        budget (Budget): The nesting and operator limits, None for no limits.
+
+    Returns:
+        list: The postfix program, where numbers are pushed, variable names are looked
+        up and pushed, Operations are applied to the two values on top of the stack, and
+        Instruction.MODULAR_POWER to the three values on top of the stack.
+    """
+
+    return FuseModularPowers(
+        list(PostfixItems(Tokenize(toCalculate, number, budget=budget), number))
+    )
+
+
+def PostfixItems(tokens, number=float):
+    """
+    This function is the shunting-yard behind ToPostfix. It reads the tokens one at a
+    time and gives out each postfix item as soon as it is known, so it works on a stream
+    of tokens too, only ever holding on to the operators of the groups it is inside of.
+    Parameters:
+        tokens: An iterable of tokens, ending with an END token.
+        number: The function that turns the text of a number into a value, float by
+        default.
+
+    Returns:
+        generator: The postfix items, without a^b%m fused.
+    """
+
+    tokens = iter(tokens)
+    negativeOne = -number("1")
+    operators = []
+    expectOperand = True
+    previous = None
+    token = next(tokens)
+    upcoming = next(tokens, None)
+    while True:
+        kind = token.kind
+        operandDone = False
+
+        if kind is TokenKind.NUMBER or kind is TokenKind.VARIABLE:
+            if not expectOperand:
+                if kind is TokenKind.NUMBER and previous.kind is TokenKind.CLOSE_PAREN:
+                    raise ValueError(
+                        "Invalid syntax: closing parenthesis cannot precede a number."
+                    )
+                raise ValueError(f"Invalid syntax: unexpected {DescribeToken(token)}.")
+            yield token.value
+            operandDone = True
+
+        elif kind is TokenKind.OPERATOR:
+            operation = token.value
+            if not expectOperand:
+                # Pop everything that binds tighter, or as tight for left associative
+                # operators
+                precedence = BINARY_PRECEDENCE[operation]
+                rightAssociative = operation in RIGHT_ASSOCIATIVE
+                while operators:
+                    topPrecedence = STACK_PRECEDENCE[operators[-1]]
+                    if topPrecedence < precedence or (
+                        topPrecedence == precedence and rightAssociative
+                    ):
+                        break
+                    top = operators.pop()
+                    yield Operation.MULTIPLY if top is NEGATE else top
+                operators.append(operation)
+                expectOperand = True
+            elif operation is Operation.SUBTRACT and (
+                previous is None or previous.kind is not TokenKind.OPERATOR
+            ):
+                # A negative sign, folded straight into the number when there is one
+                if upcoming.kind is TokenKind.NUMBER:
+                    token = upcoming
+                    upcoming = next(tokens, None)
+                    yield -token.value
+                    operandDone = True
+                else:
+                    yield negativeOne
+                    operators.append(NEGATE)
+            else:
+                raise ValueError(
+                    "Consecutive operators found. Please check your expression."
+                )
+
+        elif kind is TokenKind.OPEN_PAREN:
+            if not expectOperand:
+                raise ValueError(
+                    "Invalid syntax: opening parenthesis cannot follow a number."
+                )
+            operators.append(OPEN_GROUP)
+
+        elif kind is TokenKind.CLOSE_PAREN:
+            if expectOperand:
+                raise ValueError(
+                    f"Invalid syntax: expected a number before {DescribeToken(token)}."
+                )
+            # Markers have precedence 0, so this stops at the group's opening
+            # parenthesis
+            while operators and STACK_PRECEDENCE[operators[-1]]:
+                top = operators.pop()
+                yield Operation.MULTIPLY if top is NEGATE else top
+            if not operators or operators[-1] is not OPEN_GROUP:
+                raise ValueError(
+                    "Mismatched parentheses. Please check your expression."
+                )
+            operators.pop()
+            operandDone = True
+
+        elif kind is TokenKind.LOGARITHM:
+            if not expectOperand:
+                raise ValueError(f"Invalid syntax: unexpected {DescribeToken(token)}.")
+            nextKind = upcoming.kind
+            if (
+                nextKind is not TokenKind.NUMBER
+                and nextKind is not TokenKind.VARIABLE
+                and nextKind is not TokenKind.OPEN_PAREN
+            ):
+                raise ValueError(
+                    "Invalid syntax for logarithm base. Use log_base(argument) or "
+                    "log_(base)(argument)."
+                )
+            operators.append(LOG_BASE)
+
+        else:
+            # End of the expression
+            if expectOperand:
+                raise ValueError(
+                    "Invalid syntax: expression ends before its last operand."
+                )
+            while operators:
+                top = operators.pop()
+                if top is OPEN_GROUP:
+                    raise ValueError(
+                        "Mismatched parentheses. Please check your expression."
+                    )
+                yield Operation.MULTIPLY if top is NEGATE else top
+            return
+
+        if operandDone:
+            expectOperand = False
+            # A finished operand might be the base or the argument of a logarithm
+            while operators:
+                top = operators[-1]
+                if top is LOG_BASE:
+                    operators[-1] = LOG_ARGUMENT
+                    if upcoming.kind is not TokenKind.OPEN_PAREN:
+                        raise ValueError(
+                            "Invalid syntax for logarithm argument. Use "
+                            "log_base(argument)."
+                        )
+                    expectOperand = True
+                    break
+                if top is not LOG_ARGUMENT:
+                    break
+                operators.pop()
+                yield Operation.LOGARITHM
+        previous = token
+        token = upcoming
+        upcoming = next(tokens, None)
+
+
+def EvaluatePostfix(program: list, bindings: dict = None, apply=ApplyOperation):
+    """
+    This function runs a postfix program on an explicit value stack.
+    Parameters:
+        program (list): The postfix program made by ToPostfix.
+        bindings (dict): The value of every variable in the program, by name.
+        apply: The function that applies an operation, ApplyOperation for floats.
+
+    Returns:
+        The value of the expression, a float unless another backend's apply is given.
+    """
+
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    saved = {}  # Values kept for Reuse items, by slot
+    for item in program:
+        itemClass = item.__class__
+        if itemClass is Operation:
+            right = pop()
+            stack[-1] = apply(item, stack[-1], right)
+        elif itemClass is str:
+            push(LookUpVariable(item, bindings))
+        elif itemClass is Instruction:
+            modulus = pop()
+            exponent = pop()
+            stack[-1] = ApplyModularPower(apply, stack[-1], exponent, modulus)
+        elif itemClass is Reuse:
+            if item.save:
+                saved[item.slot] = stack[-1]
+            else:
+                push(saved[item.slot])
+        else:
+            push(item)
+    return stack[0]
+
+
+class SharedNode:
+    """
+    A part of an optimized tree that is used in more than one place, it is only
+    evaluated once.
+    """
+
+    __slots__ = ("node",)
+
+    def __init__(self, node):
+        """
+        This function creates a shared node.
+        Parameters:
+            node (BinaryNode): The shared part of the tree.
+
+        Returns:
+            None
+        """
+
+        self.node = node
+
+
+class Reuse:
+    """
+    A postfix item that saves the value on top of the stack, or pushes a saved value
+    again, so a part of the expression that repeats is only calculated once.
+    """
+
+    __slots__ = ("slot", "save")
+
+    def __init__(self, slot: int, save: bool):
+        """
+        This function creates a reuse item.
+        Parameters:
+            slot (int): Which saved value this is.
+            save (bool): True to save the top of the stack, False to push the saved
+            value.
+
+        Returns:
+            None
+        """
+
+        self.slot = slot
+        self.save = save
+
+
+class Optimizer:
+    """
+    Turns a postfix program into an optimized tree. Constant parts are calculated ahead
+    of time, things like x*1 are simplified, and parts that repeat become the same node.
+    """
+
+    __slots__ = ("apply", "backend", "nodes", "floats")
+
+    def __init__(self, apply=ApplyOperation, backend: Backend = Backend.FLOAT):
+        """
+        This function creates an optimizer.
+        Parameters:
+            apply: The function used to calculate constant parts, ApplyOperation for
+            floats.
+            backend (Backend): The backend the numbers in the program belong to.
+
+        Returns:
+            None
+        """
+
+        self.apply = apply
+        self.backend = backend
+        # Every distinct part of the expression, so repeats share one node
+        self.nodes = {}
+        # The ids of nodes that can come out as floats with the exact backend,
+        # 0+x turns -0.0 into 0.0 so it isn't just x
+        self.floats = set()
+
+    def number(self, value):
+        """
+        This function makes the node for a number.
+        Parameters:
+            value: The number.
+
+        Returns:
+            NumberNode: The node, the same one for every copy of the number.
+        """
+
+        # The class is part of the key since 2 and 2.0 are equal. Zeros and Decimals go
+        # by their text, since 0.0 and -0.0 are equal too, and so are Decimal("1") and
+        # Decimal("1.0")
+        valueClass = value.__class__
+        key = (
+            (valueClass, value) if value and valueClass is not Decimal else repr(value)
+        )
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = NumberNode(value)
+            if value.__class__ is float:
+                self.floats.add(id(node))
+        return node
+
+    def variable(self, name: str):
+        """
+        This function makes the node for a variable.
+        Parameters:
+            name (str): The variable's name.
+
+        Returns:
+            VariableNode: The node, the same one for every use of the variable.
+        """
+
+        key = (VariableNode, name)
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = VariableNode(name)
+        return node
+
+    def operation(self, operation: Operation, left, right, fold: bool = True):
+        """
+        This function makes the node for an operation, calculating it right away if both
+        sides are numbers.
+        Parameters:
+            operation (Operation): The operation.
+            left: The node of the left operand.
+            right: The node of the right operand.
+            fold (bool): False to never calculate it ahead of time.
+
+        Returns:
+            The node for the operation, which is just a NumberNode if it was calculated.
+        """
+
+        key = (operation.value, id(left), id(right), fold)  # Hashing Enums is slow
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = self.simplify(operation, left, right, fold)
+        return node
+
+    def simplify(self, operation: Operation, left, right, fold: bool):
+        """
+        This function makes a new node for an operation, see Optimizer.operation.
+        Parameters:
+            operation (Operation): The operation.
+            left: The node of the left operand.
+            right: The node of the right operand.
+            fold (bool): False to never calculate it ahead of time.
+
+        Returns:
+            The node for the operation.
+        """
+
+        leftIsNumber = left.__class__ is NumberNode
+        rightIsNumber = right.__class__ is NumberNode
+        if fold and leftIsNumber and rightIsNumber:
+            try:
+                return self.number(self.apply(operation, left.value, right.value))
+            except (ArithmeticError, ValueError):
+                # Left for the evaluation to raise, like it would without optimizing
+                pass
+        if rightIsNumber and self.can_simplify(left, right.value):
+            value = right.value
+            if value == 1 and operation in ONE_IDENTITIES:
+                return left  # x*1, x/1, x^1
+            if value == 0 and (
+                operation is Operation.SUBTRACT
+                or (operation is Operation.ADD and self.backend is Backend.EXACT)
+            ):
+                # x-0, and x+0 when there is no -0.0 for it to turn into 0.0
+                return left
+        if leftIsNumber and self.can_simplify(right, left.value):
+            value = left.value
+            if value == 1 and operation is Operation.MULTIPLY:
+                return right  # 1*x
+            if (
+                value == 0
+                and operation is Operation.ADD
+                and self.backend is Backend.EXACT
+            ):
+                return right  # 0+x
+
+        node = BinaryNode(operation, left, right)
+        floats = self.floats
+        if (
+            operation is Operation.LOGARITHM
+            or operation is Operation.EXPONENT
+            or id(left) in floats
+            or id(right) in floats
+        ):
+            floats.add(id(node))
+        return node
+
+    def can_simplify(self, node, constant) -> bool:
+        """
+        This function checks if an identity like x*1 really gives back x, exactly.
+        Parameters:
+            node: The node of the x side.
+            constant: The number on the other side.
+
+        Returns:
+            bool: True if the operation can be replaced with the node.
+        """
+
+        if self.backend is Backend.FLOAT:
+            return True
+        if self.backend is Backend.EXACT:
+            # A float 1.0 would turn x into a float, and a float -0.0 plus 0 becomes 0.0
+            return constant.__class__ is int and id(node) not in self.floats
+        return False  # Decimals are rounded by every operation, so x*1 isn't always x
+
+    def modular_power(self, base, exponent, modulus):
+        """
+        This function makes the nodes for base^exponent%modulus, without ever
+        calculating the full power ahead of time.
+        Parameters:
+            base: The node of the number to raise.
+            exponent: The node of the power.
+            modulus: The node of the number to take the remainder by.
+
+        Returns:
+            The node for the whole calculation.
+        """
+
+        if (
+            base.__class__ is NumberNode
+            and exponent.__class__ is NumberNode
+            and modulus.__class__ is NumberNode
+        ):
+            try:
+                return self.number(
+                    ApplyModularPower(
+                        self.apply, base.value, exponent.value, modulus.value
+                    )
+                )
+            except (ArithmeticError, ValueError):
+                pass
+        power = self.operation(Operation.EXPONENT, base, exponent, fold=False)
+        return self.operation(Operation.MOD, power, modulus, fold=False)
+
+    def optimize(self, program: list):
+        """
+        This function optimizes a postfix program.
+        Parameters:
+            program (list): A postfix program, made by ToPostfix or TreeToPostfix.
+
+        Returns:
+            The root of the optimized tree. Parts used more than once are wrapped in a
+            SharedNode.
+        """
+
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        for item in program:
+            itemClass = item.__class__
+            if itemClass is Operation:
+                right = pop()
+                stack[-1] = self.operation(item, stack[-1], right)
+            elif itemClass is str:
+                push(self.variable(item))
+            elif itemClass is Instruction:
+                modulus = pop()
+                exponent = pop()
+                stack[-1] = self.modular_power(stack[-1], exponent, modulus)
+            else:
+                push(self.number(item))
+        root = stack[0]
+
+        # Count how many places use each operation node
+        uses = {id(root): 1}
+        toVisit = [root]
+        while toVisit:
+            node = toVisit.pop()
+            if node.__class__ is not BinaryNode:
+                continue
+            for child in (node.left, node.right):
+                childId = id(child)
+                if childId in uses:
+                    uses[childId] += 1
+                else:
+                    uses[childId] = 1
+                    toVisit.append(child)
+
+        # Wrap the ones used more than once, so they are only evaluated once
+        shared = {}
+        for node in self.nodes.values():
+            if node.__class__ is BinaryNode and uses.get(id(node), 0) > 1:
+                shared[id(node)] = SharedNode(node)
+        if shared:
+            for node in self.nodes.values():
+                if node.__class__ is BinaryNode:
+                    node.left = shared.get(id(node.left), node.left)
+                    node.right = shared.get(id(node.right), node.right)
+            root = shared.get(id(root), root)
+        return root
+
+
+# Operations that do nothing when the right side is 1
+ONE_IDENTITIES = {Operation.MULTIPLY, Operation.DIVIDE, Operation.EXPONENT}
+
+
+def TreeToPostfix(root) -> list:
+    """
+    This function turns a tree, optimized or not, back into a postfix program.
+    Parts of the tree wrapped in a SharedNode are calculated once and then reused.
+    Parameters:
+        root: The root of the tree.
+
+    Returns:
+        list: The postfix program, which EvaluatePostfix can run.
+    """
+
+    program = []
+    emit = program.append
+    slots = {}  # The slot of every SharedNode already in the program, by id
+    # Nodes still to turn into items, and items to emit once their operands are done
+    toVisit = [root]
+    push = toVisit.append
+    while toVisit:
+        node = toVisit.pop()
+        nodeClass = node.__class__
+        if nodeClass is NumberNode:
+            emit(node.value)
+        elif nodeClass is VariableNode:
+            emit(node.name)
+        elif nodeClass is BinaryNode:
+            left = node.left
+            if (
+                node.operation is Operation.MOD
+                and left.__class__ is BinaryNode
+                and left.operation is Operation.EXPONENT
+            ):
+                push(Instruction.MODULAR_POWER)
+                push(node.right)
+                push(left.right)
+                push(left.left)
+            else:
+                push(node.operation)
+                push(node.right)
+                push(left)
+        elif nodeClass is SharedNode:
+            slot = slots.get(id(node))
+            if slot is None:
+                slot = slots[id(node)] = len(slots)
+                push(Reuse(slot, True))
+                push(node.node)
+            else:
+                emit(Reuse(slot, False))
+        else:
+            emit(node)  # An Operation, Instruction or Reuse whose operands are done
+    return program
+
+
+def FormatProgram(program: list) -> str:
+    """
+    This function writes a postfix program out as text, with parentheses around every
+    operation. Values that are reused are written once as "#slot = ..." and then
+    referred to as "#slot".
+    Parameters:
+        program (list): The postfix program.
+
+    Returns:
+        str: The program as text, one line per reused value and the whole expression
+        last.
+    """
+
+    lines = []
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    for item in program:
+        itemClass = item.__class__
+        if itemClass is Operation:
+            right = pop()
+            if item is Operation.LOGARITHM:
+                stack[-1] = f"log_({stack[-1]})({right})"
+            else:
+                stack[-1] = f"({stack[-1]}{item.value}{right})"
+        elif itemClass is str:
+            push(item)
+        elif itemClass is Instruction:
+            modulus = pop()
+            exponent = pop()
+            stack[-1] = f"({stack[-1]}^{exponent}%{modulus})"
+        elif itemClass is Reuse:
+            if item.save:
+                lines.append(f"#{item.slot} = {stack[-1]}")
+                stack[-1] = f"#{item.slot}"
+            else:
+                push(f"#{item.slot}")
+        else:
+            push(FormatNumber(item))
+    lines.append(stack[0])
+    return "\n".join(lines)
+
+
+# Float operations that can't fail, other than going past the largest float, so the
+# closure engine can call them directly and only check the result with CheckFloatSize
+DIRECT_OPERATIONS = {
+    Operation.ADD: operator.add,
+    Operation.SUBTRACT: operator.sub,
+    Operation.MULTIPLY: operator.mul,
+}
+# Float operations that can only fail when the right side is zero
+DIVISIONS = {
+    Operation.DIVIDE: operator.truediv,
+    Operation.MOD: operator.mod,
+}
+
+
+# Runs of operations longer than this, like 1+2+3+..., are worked out in one loop
+# instead of one function inside the next
+CLOSURE_CHAIN_LENGTH = 8
+# Functions nested deeper than this would get too close to Python's recursion limit when
+# called
+CLOSURE_MAX_HEIGHT = 200
+
+
+def BuildClosure(program: list, apply=ApplyOperation):
+    """
+    This function turns a postfix program into nested Python functions, one for every
+    part of the expression, with its operation and operands already bound. Evaluating is
+    then just calling the outermost function, with no loop over items, no checking what
+    kind of item is next and no stack. Long runs of operations become one loop, see
+    ChainClosure, and expressions that would still nest deeper than CLOSURE_MAX_HEIGHT
+    are run on the stack machine instead.
+    Parameters:
+        program (list): A postfix program, made by ToPostfix or TreeToPostfix.
+        apply: The function that applies an operation, ApplyOperation for floats.
+
+    Returns:
+        function: Takes the variable bindings and a dict for reused values, returns the
+        value.
+    """
+
+    # Numbers stay NumberNodes while building, so operations can have them built in
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    # How deeply the functions of each part nest, and the run of operations each part is
+    # the result of so far, if it can still be made longer
+    heights = []
+    chains = []
+    for item in program:
+        itemClass = item.__class__
+        if itemClass is Operation:
+            right = pop()
+            rightHeight = heights.pop()
+            chains.pop()
+            chain = chains[-1]
+            if chain is None:
+                chain = chains[-1] = [stack[-1], []]
+            steps = chain[1]
+            steps.append((OperationFunction(item, right, apply), AsClosure(right)))
+            if len(steps) <= CLOSURE_CHAIN_LENGTH:
+                stack[-1] = OperationClosure(item, stack[-1], right, apply)
+                heights[-1] = max(heights[-1], rightHeight) + 1
+            elif len(steps) == CLOSURE_CHAIN_LENGTH + 1:
+                # Later steps are added to the same list, so the run only needs one
+                # function
+                stack[-1] = ChainClosure(chain[0], steps)
+                heights[-1] = max(heights[-1], rightHeight)
+            else:
+                heights[-1] = max(heights[-1], rightHeight + 1)
+        elif itemClass is str:
+            push(VariableClosure(item))
+            heights.append(1)
+            chains.append(None)
+        elif itemClass is Instruction:
+            modulus = AsClosure(pop())
+            exponent = AsClosure(pop())
+            stack[-1] = ModularPowerClosure(
+                AsClosure(stack[-1]), exponent, modulus, apply
+            )
+            heights[-1] = max(heights.pop(), heights.pop(), heights[-1]) + 1
+            del chains[-2:]
+            chains[-1] = None
+        elif itemClass is Reuse:
+            if item.save:
+                stack[-1] = SaveClosure(item.slot, AsClosure(stack[-1]))
+                heights[-1] += 1
+                chains[-1] = None
+            else:
+                push(LoadClosure(item.slot))
+                heights.append(1)
+                chains.append(None)
+        else:
+            push(NumberNode(item))
+            heights.append(1)
+            chains.append(None)
+    if heights[0] > CLOSURE_MAX_HEIGHT:
+        return PostfixClosure(program, apply)
+    return AsClosure(stack[0])
+
+
+def AsClosure(part):
+    """
+    This function makes sure a part of the expression being built is a function.
+    Parameters:
+        part: A function made by BuildClosure, or a NumberNode.
+
+    Returns:
+        function: The part as a function.
+    """
+
+    if part.__class__ is not NumberNode:
+        return part
+    value = part.value
+
+    def Constant(bindings, saved):
+        return value
+
+    return Constant
+
+
+def VariableClosure(name: str):
+    """
+    This function makes the function for a variable.
+    Parameters:
+        name (str): The name of the variable.
+
+    Returns:
+        function: Looks the variable up in the bindings.
+    """
+
+    def Variable(bindings, saved):
+        try:
+            return bindings[name]
+        except (KeyError, TypeError):
+            return LookUpVariable(name, bindings)  # Raises the usual error
+
+    return Variable
+
+
+def OperationFunction(operation: Operation, right, apply):
+    """
+    This function picks the function that calculates an operation in a closure. Float
+    operations that can't fail are called directly, everything else goes through apply
+    so errors are exactly the same as the other engines.
+    Parameters:
+        operation (Operation): The operation.
+        right: The function or NumberNode of the right operand.
+        apply: The function that applies an operation, ApplyOperation for floats.
+
+    Returns:
+        function: Takes the left and right values, returns the result.
+    """
+
+    function = None
+    if apply is ApplyOperation:
+        function = DIRECT_OPERATIONS.get(operation)
+        if function is None and right.__class__ is NumberNode and right.value != 0:
+            function = DIVISIONS.get(operation)
+    if function is None:
+        function = partial(apply, operation)
+    return function
+
+
+def OperationClosure(operation: Operation, left, right, apply):
+    """
+    This function makes the function for an operation, see OperationFunction.
+    Parameters:
+        operation (Operation): The operation.
+        left: The function or NumberNode of the left operand.
+        right: The function or NumberNode of the right operand.
+        apply: The function that applies an operation, ApplyOperation for floats.
+
+    Returns:
+        function: Calculates the operation.
+    """
+
+    leftIsNumber = left.__class__ is NumberNode
+    rightIsNumber = right.__class__ is NumberNode
+    function = OperationFunction(operation, right, apply)
+    # Functions called directly skip ApplyOperation, so they check for inf themselves
+    direct = function.__class__ is not partial
+
+    if leftIsNumber and not rightIsNumber:
+        leftValue = left.value
+
+        def ConstantLeft(bindings, saved):
+            rightValue = right(bindings, saved)
+            result = function(leftValue, rightValue)
+            if direct and result - result:
+                CheckFloatSize(result, leftValue, rightValue)
+            return result
+
+        return ConstantLeft
+    if rightIsNumber and not leftIsNumber:
+        rightValue = right.value
+
+        def ConstantRight(bindings, saved):
+            leftValue = left(bindings, saved)
+            result = function(leftValue, rightValue)
+            if direct and result - result:
+                CheckFloatSize(result, leftValue, rightValue)
+            return result
+
+        return ConstantRight
+    left = AsClosure(left)
+    right = AsClosure(right)
+
+    def Both(bindings, saved):
+        leftValue = left(bindings, saved)
+        rightValue = right(bindings, saved)
+        result = function(leftValue, rightValue)
+        if direct and result - result:
+            CheckFloatSize(result, leftValue, rightValue)
+        return result
+
+    return Both
+
+
+def ChainClosure(first, steps: list):
+    """
+    This function makes the function for a run of operations, like 1+2*x-3, where each
+    one's left operand is the one before it. They are worked out in one loop, so a long
+    run doesn't nest.
+    Parameters:
+        first: The function or NumberNode of the left operand of the first operation.
+        steps (list): The function of every operation, see OperationFunction, and the
+        function of its right operand. BuildClosure keeps adding to it while the run
+        goes on.
+
+    Returns:
+        function: Calculates the whole run.
+    """
+
+    first = AsClosure(first)
+
+    def Chain(bindings, saved):
+        value = first(bindings, saved)
+        for function, right in steps:
+            rightValue = right(bindings, saved)
+            result = function(value, rightValue)
+            if result - result and function.__class__ is not partial:
+                # A direct function went past the largest float, see OperationClosure
+                CheckFloatSize(result, value, rightValue)
+            value = result
+        return value
+
+    return Chain
+
+
+def PostfixClosure(program: list, apply):
+    """
+    This function makes a function that runs a postfix program on the stack machine, for
+    expressions that nest too deeply for a closure.
+    Parameters:
+        program (list): A postfix program, made by ToPostfix or TreeToPostfix.
+        apply: The function that applies an operation, ApplyOperation for floats.
+
+    Returns:
+        function: Runs the program with EvaluatePostfix.
+    """
+
+    def Postfix(bindings, saved):
+        return EvaluatePostfix(program, bindings, apply)
+
+    return Postfix
+
+
+def ModularPowerClosure(base, exponent, modulus, apply):
+    """
+    This function makes the function for base^exponent%modulus, see ApplyModularPower.
+    Parameters:
+        base: The function of the number to raise.
+        exponent: The function of the power.
+        modulus: The function of the number to take the remainder by.
+        apply: The function that applies an operation, ApplyOperation for floats.
+
+    Returns:
+        function: Calculates the modular power.
+    """
+
+    def ModularPower(bindings, saved):
+        return ApplyModularPower(
+            apply,
+            base(bindings, saved),
+            exponent(bindings, saved),
+            modulus(bindings, saved),
+        )
+
+    return ModularPower
+
+
+def SaveClosure(slot: int, part):
+    """
+    This function makes the function for a part of the expression that is used again
+    later.
+    Parameters:
+        slot (int): Where the value is kept.
+        part: The function of the part.
+
+    Returns:
+        function: Calculates the part and keeps its value.
+    """
+
+    def Save(bindings, saved):
+        value = saved[slot] = part(bindings, saved)
+        return value
+
+    return Save
+
+
+def LoadClosure(slot: int):
+    """
+    This function makes the function for a part of the expression that was already
+    calculated.
+    Parameters:
+        slot (int): Where the value is kept.
+
+    Returns:
+        function: Gives back the kept value.
+    """
+
+    def Load(bindings, saved):
+        return saved[slot]
+
+    return Load
+
+
+# Opcodes for Bytecode. Every Operation is its own opcode, its place in the Operation
+# enum
+OPCODE_OPERATIONS = tuple(Operation)
+OPERATION_OPCODES = {
+    operation: code for code, operation in enumerate(OPCODE_OPERATIONS)
+}
+CODE_CONSTANT = len(OPCODE_OPERATIONS)  # Followed by the index of the constant
+CODE_VARIABLE = CODE_CONSTANT + 1  # Followed by the index of the variable's name
+CODE_MODULAR_POWER = CODE_CONSTANT + 2
+CODE_SAVE = CODE_CONSTANT + 3  # Followed by the slot to save the top of the stack in
+CODE_LOAD = CODE_CONSTANT + 4  # Followed by the slot to push again
+
+
+class Bytecode:
+    """
+    A compiled expression packed into flat arrays, a lot smaller than a tree or list of
+    objects when many compiled expressions are kept around.
+    """
+
+    __slots__ = ("code", "constants", "names")
+
+    def __init__(self, code: array, constants, names: tuple):
+        """
+        This function creates a bytecode expression.
+        Parameters:
+            code (array): The opcodes, each push, save and load followed by its index.
+            constants: The numbers the expression uses, an array("d") for floats, else a
+            tuple.
+            names (tuple): The names of the variables the expression uses.
+
+        Returns:
+            None
+        """
+
+        self.code = code
+        self.constants = constants
+        self.names = names
+
+
+def ToBytecode(program: list) -> Bytecode:
+    """
+    This function packs a postfix program into bytecode.
+    Parameters:
+        program (list): A postfix program, made by ToPostfix or TreeToPostfix.
+
+    Returns:
+        Bytecode: The packed program.
+    """
+
+    code = []
+    emit = code.append
+    constants = {}  # Index of every constant, each is only stored once
+    names = {}
+    for item in program:
+        itemClass = item.__class__
+        if itemClass is Operation:
+            emit(OPERATION_OPCODES[item])
+        elif itemClass is str:
+            emit(CODE_VARIABLE)
+            emit(names.setdefault(item, len(names)))
+        elif itemClass is Instruction:
+            emit(CODE_MODULAR_POWER)
+        elif itemClass is Reuse:
+            emit(CODE_SAVE if item.save else CODE_LOAD)
+            emit(item.slot)
+        else:
+            # Same keys as Optimizer.number, so 2 and 2.0 or 0.0 and -0.0 aren't mixed
+            # up
+            key = (itemClass, item) if item and itemClass is not Decimal else repr(item)
+            emit(CODE_CONSTANT)
+            emit(constants.setdefault(key, (len(constants), item))[0])
+
+    # The smallest array type that fits every opcode and index
+    largest = max(code)
+    typeCode = "B" if largest < 1 << 8 else "H" if largest < 1 << 16 else "I"
+    values = [value for _, value in constants.values()]
+    if all(value.__class__ is float for value in values):
+        values = array("d", values)
+    else:
+        values = tuple(values)
+    return Bytecode(array(typeCode, code), values, tuple(names))
+
+
+def EvaluateBytecode(bytecode: Bytecode, bindings: dict = None, apply=ApplyOperation):
+    """
+    This function runs bytecode on an explicit value stack.
+    Parameters:
+        bytecode (Bytecode): The bytecode made by ToBytecode.
+        bindings (dict): The value of every variable in the expression, by name.
+        apply: The function that applies an operation, ApplyOperation for floats.
+
+    Returns:
+        The value of the expression, a float unless another backend's apply is given.
+    """
+
+    constants = bytecode.constants
+    names = bytecode.names
+    operations = OPCODE_OPERATIONS
+    # Locals are a lot faster to look up than globals in the loop below
+    constant = CODE_CONSTANT
+    variable = CODE_VARIABLE
+    modularPower = CODE_MODULAR_POWER
+    save = CODE_SAVE
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    saved = {}
+    codes = iter(bytecode.code)
+    following = codes.__next__  # The index after a push, save or load
+    for opcode in codes:
+        if opcode < constant:
+            right = pop()
+            stack[-1] = apply(operations[opcode], stack[-1], right)
+        elif opcode == constant:
+            push(constants[following()])
+        elif opcode == variable:
+            name = names[following()]
+            if bindings is None or name not in bindings:
+                LookUpVariable(name, bindings)  # Raises the usual error
+            push(bindings[name])
+        elif opcode == modularPower:
+            modulus = pop()
+            exponent = pop()
+            stack[-1] = ApplyModularPower(apply, stack[-1], exponent, modulus)
+        elif opcode == save:
+            saved[following()] = stack[-1]
+        else:
+            push(saved[following()])
+    return stack[0]
+
+
+def CompiledSize(compiled) -> int:
+    """
+    This function measures how many bytes a compiled expression takes up, counting
+    everything it holds on to except things every expression shares, like the Operation
+    members.
+    Parameters:
+        compiled: A compiled expression of any engine.
+
+    Returns:
+        int: The size in bytes.
+    """
+
+    total = 0
+    seen = set()
+    toVisit = [compiled]
+    while toVisit:
+        value = toVisit.pop()
+        valueClass = value.__class__
+        if (
+            id(value) in seen
+            or value is None
+            or isinstance(value, Enum)
+            or valueClass in SHARED_CLASSES
+            or (valueClass is tuple and not value)  # There is only one empty tuple
+        ):
+            continue
+        if valueClass is FunctionType and value.__closure__ is None:
+            continue  # A module level function, not part of the expression
+        seen.add(id(value))
+        total += sys.getsizeof(value)
+        if valueClass is list or valueClass is tuple:
+            toVisit.extend(value)
+        elif valueClass is FunctionType:
+            for cell in value.__closure__:
+                total += sys.getsizeof(cell)
+                toVisit.append(cell.cell_contents)
+            total += sys.getsizeof(value.__closure__)
+        elif valueClass is partial:
+            toVisit.extend(value.args)
+        else:
+            for name in getattr(valueClass, "__slots__", ()):
+                toVisit.append(getattr(value, name))
+    return total
+
+
+# Things compiled expressions point to that aren't theirs
+SHARED_CLASSES = {bool, BuiltinFunctionType}
+
+
+def TestCases():
+    """
+    This function tests the basic functionality of the calculator.
+    Parameters:
+        None
+
+    Returns:
+        None
+    """
+
+    # Regular basic cases
+
+    assert Add("2+3") == "5.0"
+    assert Subtract("5-3") == "2.0"
+    assert Multiply("2*3") == "6.0"
+    assert Divide("6/3") == "2.0"
+    assert Mod("5%2") == "1.0"
+    assert Exponent("2^3") == "8.0"
+    assert Logarithm("2,8") == "3.0"
+
+    # Basic edge cases
+    try:
+        Divide("5/0")
+    except ValueError as e:
+        assert str(e) == "Cannot divide by zero."
+
+    try:
+        Mod("5%0")
+    except ValueError as e:
+        assert str(e) == "Cannot perform modulus by zero."
+
+    # Numbers keep their sign and never come out in exponent notation
+    assert Subtract("-5-3") == "-8.0"
+    assert Multiply("-2*-3") == "6.0"
+    assert Divide("1/10000000") == "0.0000001"
+    assert EvaluateExpression("1/10000000+1", Engine.LEGACY) == "1.0000001"
+    assert EvaluateExpression("10^20") == "100000000000000000000.0"
+
+    # The exact backend keeps whole numbers as ints and everything else as fractions
+    assert EvaluateExpression("2^200", backend=Backend.EXACT) == str(2**200)
+    assert EvaluateExpression("1/3+1/6", backend=Backend.EXACT) == "1/2"
+    assert EvaluateExpression("0.1+0.2", backend=Backend.EXACT) == "3/10"
+    assert EvaluateExpression("(4/9)^(3/2)", backend=Backend.EXACT) == "8/27"
+    assert EvaluateExpression("7%(0-3)", backend=Backend.EXACT) == "-2"
+    # Once a part comes out as a float, dividing it stays a float instead of faking a
+    # fraction
+    assert EvaluateExpression(
+        "log_2(3)/3", backend=Backend.EXACT
+    ) == EvaluateExpression("log_2(3)/3")
+    # Roots too high to be whole fall back to floats right away, instead of searching
+    # for one
+    assert (
+        EvaluateExpression("2^0.00000000000000000001", backend=Backend.EXACT) == "1.0"
+    )
+    # And the decimal backend rounds to the precision it is given
+    assert EvaluateExpression("0.1+0.2", backend=Backend.DECIMAL) == "0.3"
+    assert EvaluateExpression("1/3", backend=Backend.DECIMAL, precision=5) == "0.33333"
+    assert EvaluateExpression("7%(0-3)", backend=Backend.DECIMAL) == "-2"
+
+    # More complex cases
+    assert EvaluateExpression("2+3*4") == "14.0"
+    assert EvaluateExpression("10-2^3") == "2.0"
+    assert EvaluateExpression("log_10(100)") == "2.0"
+    assert EvaluateExpression("2*(3+4)") == "14.0"
+    assert EvaluateExpression("2^3*4") == "32.0"
+    assert EvaluateExpression("(2^2^(2+1))") == "256.0"
+    # 2^2^(2+1) is 2^2^2 = 2^8 = 256
+    assert EvaluateExpression("log_2(16)/2") == "2.0"
+    assert EvaluateExpression("log_2(8)+1") == "4.0"
+    assert EvaluateExpression("(47)*(2/47)+2") == "4.0"
+
+    # All engines should agree on the cases above
+    for expression in ["2+3*4", "10-2^3", "log_(1+1)(8)*(3+4)", "-2^2", "(-3)*2"]:
+        for engine in Engine:
+            assert EvaluateExpression(expression) == EvaluateExpression(
+                expression, engine
+            )
+
+    # The stack engine has no recursion, so deep nesting is fine
+    assert EvaluateExpression("(" * 5000 + "1+1" + ")" * 5000) == "2.0"
+    assert EvaluateExpression("log_2(2^(" * 3000 + "1" + "))" * 3000) == "1.0"
+    # And neither does the tree engine, for long chains or deep nesting
+    assert EvaluateExpression("+".join(["1"] * 3000), Engine.AST) == "3000.0"
+    assert EvaluateExpression("1+(" * 999 + "1" + ")" * 999, Engine.AST) == "1000.0"
+
+    # The tree engine groups left to right like normal math
+    assert EvaluateExpression("10-2-3") == "5.0"
+    assert EvaluateExpression("8/4*2") == "4.0"
+    try:
+        EvaluateExpression("2(3+4)")
+        assert False, "2(3+4) should raise"
+    except ValueError as e:
+        assert str(e) == (
+            "Invalid syntax: opening parenthesis at position 1 cannot follow a number, "
+            "expected an operator, ')' or the end of the expression."
+        )
+
+    # The cache answers repeats and evicts the least recently used expression
+    cache = ExpressionCache(2)
+    assert Calculate("2 + 3", cache=cache) == "5.0"
+    assert Calculate("2+3", cache=cache) == "5.0"
+    assert Calculate("4*4", cache=cache) == "16.0"
+    assert Calculate("1-1", cache=cache) == "0.0"
+    assert cache.stats() == {
+        "hits": 1,
+        "diskHits": 0,
+        "misses": 3,
+        "evictions": 1,
+        "size": 2,
+        "maxSize": 2,
+    }
+    # Spaces between two numbers keep them apart, even when the joined expression is
+    # cached
+    assert Calculate("1234+1") == "1235.0"
+    for expression, position in [("12 34 + 1", 3), ("1 2", 2)]:
+        for engine in Engine:
+            try:
+                Calculate(expression, engine)
+                assert False, (engine, expression)
+            except ValueError as e:
+                assert str(e).startswith(
+                    f"Invalid syntax: unexpected number at position {position},"
+                ), str(e)
+
+    # Batch mode answers every line in order, errors included
+    import json
+
+    output = io.StringIO()
+    RunBatch(io.StringIO("1+1\n5/0\n\n log_2(8) \n"), output)
+    assert output.getvalue() == (
+        "2.0\nError: Cannot divide by zero.\nError: Input cannot be empty.\n3.0\n"
+    )
+    output = io.StringIO()
+    RunBatch(io.StringIO("   (1+2))\n1 + 2 + #\n"), output)
+    assert output.getvalue() == (
+        "Error: Mismatched parentheses: ')' at position 8 has no matching '('.\n"
+        "Error: Invalid character '#' at position 8, expected a number, a variable, "
+        "'(' or log_.\n"
+    )
+    output = io.StringIO()
+    RunBatch(io.StringIO("5/0\n"), output, "jsonl")
+    assert json.loads(output.getvalue()) == {
+        "lineNumber": 1,
+        "expression": "5/0",
+        "result": None,
+        "error": "Cannot divide by zero.",
+    }
+
+    # Parallel batches keep the input order and per line line numbers
+    output = io.StringIO()
+    lines = "".join(f"{i}*2\n" if i % 3 else "1/0\n" for i in range(50))
+    RunParallelBatch(io.StringIO(lines), output, "jsonl", workers=2, chunkSize=7)
+    expected = io.StringIO()
+    RunBatch(io.StringIO(lines), expected, "jsonl")
+    assert output.getvalue() == expected.getvalue()
+
+    # Expressions with variables compile once and evaluate many times
+    for engine in [Engine.STACK, Engine.AST, Engine.CLOSURE, Engine.BYTECODE]:
+        compiled = Compile("x^2+3*x-log_b(y)", engine)
+        assert compiled.variables == ("x", "b", "y")
+        assert compiled.evaluate({"x": 2, "b": 2}, y=8) == 7.0
+        assert compiled.evaluate(x=-1, b=10, y=100) == -4.0
+        try:
+            compiled.evaluate(x=1)
+            assert False, "a missing variable should raise"
+        except ValueError as e:
+            assert str(e) == "No value given for variable 'b'."
+
+    # Columns are evaluated a whole column at a time, with bad rows marked instead of
+    # raising
+    compiled = Compile("x/y+log_2(x)")
+    output = array("d", bytes(8 * 3))
+    result = compiled.evaluate_columns(
+        {"x": array("d", [4, 8, 16]), "y": array("d", [2, 0, 4])}, output
+    )
+    assert result.values is output
+    assert output[0] == 4.0 and output[2] == 8.0 and math.isnan(output[1])
+    assert result.errors == bytearray([0, 1, 0])
+    assert result.messages == {1: "Cannot divide by zero."}
+    # Other kinds of numbers are converted, bytes included, instead of read as packed
+    # doubles
+    assert Compile("x+1").evaluate_columns({"x": bytes([1, 2])}).values == array(
+        "d", [2, 3]
+    )
+
+    # a^b%m is done in one step with exact numbers, without working out a^b first
+    for engine in [Engine.STACK, Engine.AST]:
+        assert EvaluateExpression("3^1000000%7", engine, Backend.EXACT) == str(
+            pow(3, 1000000, 7)
+        )
+        assert EvaluateExpression("2^(-1)%3", engine, Backend.EXACT) == "1/2"
+        assert EvaluateExpression("3^200%7", engine, Backend.DECIMAL) == str(
+            pow(3, 200, 7)
+        )
+        assert EvaluateExpression("2^10%1000", engine) == "24.0"
+        assert EvaluateExpression("3^1000000%7", engine) == "4.0"
+        assert EvaluateExpression("(0-3)^3%(0-5)", engine) == "-2.0"
+        compiled = Compile("x^y%z", engine, Backend.EXACT)
+        assert compiled.evaluate(x=7, y=123456, z=13) == pow(7, 123456, 13)
+        try:
+            EvaluateExpression("2^3%0", engine, Backend.EXACT)
+            assert False, "2^3%0 should raise"
+        except ValueError as e:
+            assert str(e) == "Cannot perform modulus by zero."
+    assert Compile("x^2%5").evaluate_columns({"x": array("d", [3, 4])}).values == (
+        array("d", [4.0, 1.0])
+    )
+    # Columns use the same fused power as evaluate, where the full power would lose
+    # digits
+    for expression in ["x^40%7", "x^1000%7", "2^x%7", "x^2%0"]:
+        compiled = Compile(expression)
+        result = compiled.evaluate_columns({"x": array("d", [3, 0.5])})
+        for row, x in enumerate([3, 0.5]):
+            try:
+                assert result.values[row] == compiled.evaluate(x=x), (expression, x)
+            except ValueError as e:
+                assert result.errors[row] and result.messages[row] == str(e)
+
+    # Powers and products that would be too big are refused before they are worked out
+    try:
+        EvaluateExpression("2^100000", backend=Backend.EXACT, maxBits=1000)
+        assert False, "2^100000 should raise"
+    except ValueError as e:
+        assert str(e) == "Result would be larger than 1000 bits."
+    assert EvaluateExpression("2^999", backend=Backend.EXACT, maxBits=1000) == str(
+        2**999
+    )
+    assert EvaluateExpression("2^100000%3", backend=Backend.EXACT, maxBits=1000) == "1"
+
+    # Logarithms that come out whole are exact, in every engine
+    for engine in Engine:
+        assert EvaluateExpression("log_5(125)", engine) == "3.0"
+        assert EvaluateExpression("log_10(1000)", engine) == "3.0"
+        assert EvaluateExpression("log_(2^10)(2^30)", engine) == "3.0"
+    assert EvaluateExpression("log_3(3^500)", backend=Backend.EXACT) == "500.0"
+    for expression, answer in [
+        ("log_2(8)", "3"),
+        ("log_5(125)", "3"),
+        ("log_4(2)", "0.5"),
+    ]:
+        assert EvaluateExpression(expression, backend=Backend.DECIMAL) == answer
+    assert ReplaceLogarithms("1+log_2(log_(2)(16))*log_3(9)") == "1+2.0*2.0"
+
+    # The optimizer folds constants, drops things like x*1 and only calculates repeats
+    # once
+    assert DumpOptimized("(2+3)*x*1+0-log_2(8)^1") == "(((5.0*x)+0.0)-3.0)"
+    assert DumpOptimized("(x*y+1)/(x*y+1)+log_(x)(y)*log_(x)(y)") == (
+        "#0 = ((x*y)+1.0)\n#1 = log_(x)(y)\n((#0/#0)+(#1*#1))"
+    )
+    assert DumpOptimized("x+0-x^1", Backend.EXACT) == "(x-x)"
+    assert DumpOptimized("3^1000000%7+x", Backend.EXACT) == "(4+x)"
+    for engine in [Engine.STACK, Engine.AST]:
+        compiled = Compile("(x*y+1)^2/(x*y+1)-1", engine, optimize=True)
+        assert compiled.evaluate(x=2, y=0.5) == 1.0
+        compiled = Compile("x+1/0", engine, optimize=True)
+        try:
+            compiled.evaluate(x=2)
+            assert False, "x+1/0 should raise"
+        except ValueError as e:
+            # Raised when evaluated, like before
+            assert str(e) == "Cannot divide by zero."
+        assert EvaluateExpression("log_2(8)*(1+2)^2", engine, optimize=True) == "27.0"
+
+    # The closure engine gives the same answers and the same errors as the others
+    for backend in Backend:
+        for optimize in [False, True]:
+            compiled = Compile(
+                "(x+1)*(x+1)/y-x%3", Engine.CLOSURE, backend, optimize=optimize
+            )
+            assert compiled.evaluate(x=4, y=5) == Compile(
+                "(x+1)*(x+1)/y-x%3", Engine.STACK, backend
+            ).evaluate(x=4, y=5)
+            try:
+                compiled.evaluate(x=4, y=0)
+                assert False, "dividing by y=0 should raise"
+            except ValueError as e:
+                assert str(e) == "Cannot divide by zero."
+    assert EvaluateExpression("2^3%5-log_10(100)/4", Engine.CLOSURE) == "2.5"
+    # Long runs of operations are one loop, and deep nesting falls back to the stack
+    # machine
+    flatSum = "+".join(["1"] * 3000)
+    assert Calculate(flatSum, Engine.CLOSURE) == "3000.0"
+    assert Compile(flatSum, Engine.CLOSURE).evaluate() == 3000.0
+    assert Compile("-".join(["x"] * 3000), Engine.CLOSURE).evaluate(x=1) == -2998.0
+    assert Calculate("1+(" * 999 + "1" + ")" * 999, Engine.CLOSURE) == "1000.0"
+
+    # Bytecode packs an expression into flat arrays, a lot smaller than a tree
+    bytecode = CompileExpression("(x+1.5)*(x+1.5)-y/2", Engine.BYTECODE)
+    assert list(bytecode.constants) == [1.5, 2.0] and bytecode.names == ("x", "y")
+    assert bytecode.code.typecode == "B"
+    assert RunCompiled(bytecode, Engine.BYTECODE, {"x": 0.5, "y": 3}) == 2.5
+    longExpression = "+".join(f"({i}*x-{i + 1}/y)" for i in range(1, 21))
+    assert CompiledSize(CompileExpression(longExpression, Engine.BYTECODE)) * 5 < (
+        CompiledSize(CompileExpression(longExpression, Engine.AST))
+    )
+    assert (
+        EvaluateExpression("3^200%7-log_2(8)", Engine.BYTECODE, Backend.EXACT) == "-1.0"
+    )
+    cache = ExpressionCache()
+    assert Calculate("1+2*3", Engine.BYTECODE, cache) == "7.0"
+    assert cache.memory()["bytes"] == CompiledSize(
+        next(iter(cache.entries.values()))[0]
+    )
+    try:
+        EvaluateExpression("2^10000", Engine.CLOSURE, Backend.EXACT, maxBits=100)
+        assert False, "2^10000 should raise"
+    except ValueError as e:
+        assert str(e) == "Result would be larger than 100 bits."
+    assert (
+        EvaluateExpression("(" * 5000 + "1" + "+1)" * 5000, optimize=True) == "5001.0"
+    )
+    assert list(
+        Compile("(x+1)*(x+1)", optimize=True)
+        .evaluate_columns({"x": array("d", [1, 2])})
+        .values
+    ) == [4.0, 9.0]
+    try:
+        ReplaceLogarithms("log_(2(8)")
+        assert False, "log_(2(8) should raise"
+    except ValueError as e:
+        assert str(e) == "Mismatched parentheses in logarithm base."
+
+    # Streaming reads one huge expression a chunk at a time, even when a chunk splits a
+    # token
+    assert (
+        EvaluateStream(io.StringIO("+".join(["1"] * 100000)), chunkSize=4096)
+        == "100000.0"
+    )
+    for expression in ["log_2(1024)*123.25-7", "2^3%5\n+(4 /\t8)"]:
+        for chunkSize in [1, 2, 3, 7]:
+            assert EvaluateStream(io.StringIO(expression), chunkSize=chunkSize) == (
+                EvaluateExpression(expression.replace("\n", " ").replace("\t", " "))
+            )
+    assert EvaluateStream(io.StringIO("0.1+0.2"), Backend.DECIMAL, chunkSize=2) == "0.3"
+    try:
+        EvaluateStream(io.StringIO("1+2+3+1..2"), chunkSize=3)
+        assert False, "1+2+3+1..2 should raise"
+    except ValueError as e:
+        assert str(e) == "Invalid number '1..2' at position 6."
+    # The budget limits streams as well
+    for expression, message in [
+        (
+            "((((1))))",
+            "Too deeply nested: more than 3 levels of parentheses at position 3.",
+        ),
+        ("1+2+3+4+5+6", "Too many operations: more than 4 at position 9."),
+    ]:
+        try:
+            EvaluateStream(
+                io.StringIO(expression),
+                chunkSize=2,
+                budget=Budget(maxDepth=3, maxOperations=4),
+            )
+            assert False, expression
+        except ValueError as e:
+            assert str(e) == message, str(e)
+
+    # Syntax is checked while tokenizing, stopping at the first mistake with where it is
+    for expression, message in [
+        (
+            "2+*3",
+            "Consecutive operators found at position 2, expected a number, a variable, "
+            "'(' or log_.",
+        ),
+        ("(1+2))*3", "Mismatched parentheses: ')' at position 5 has no matching '('."),
+        (
+            "((1+2)*3",
+            "Mismatched parentheses: '(' at position 0 is never closed, expected ')'.",
+        ),
+        (
+            "log_2+8",
+            "Invalid syntax: unexpected '+' at position 5, expected '(' for the "
+            "logarithm argument.",
+        ),
+        (
+            "3+#",
+            "Invalid character '#' at position 2, expected a number, a variable, '(' "
+            "or log_.",
+        ),
+        (
+            "1+2-",
+            "Invalid syntax: expression ends at position 4, expected a number, a "
+            "variable, '(' or log_.",
+        ),
+        # Positions count the spaces too, they are where the mistake is in what was
+        # typed
+        (
+            "1 +  * 2",
+            "Consecutive operators found at position 5, expected a number, a variable, "
+            "'(' or log_.",
+        ),
+        ("   (1+2))", "Mismatched parentheses: ')' at position 8 has no matching '('."),
+        (
+            "1 + 2 + #",
+            "Invalid character '#' at position 8, expected a number, a variable, '(' "
+            "or log_.",
+        ),
+    ]:
+        try:
+            Calculate(expression)
+            assert False, expression
+        except ValueError as e:
+            assert str(e) == message, str(e)
+    try:
+        GeneralSyntax("1+lo")
+        assert False, "1+lo should raise"
+    except ValueError as e:
+        assert str(e) == "Invalid character 'l' at position 2."
+    GeneralSyntax("-log_(1+1)(8)*(3+4)")
+
+    # An installed Instrument counts and times everything, and can trace every step
+    global INSTRUMENT
+    previous = INSTRUMENT
+    steps = []
+    INSTRUMENT = Instrument(steps.append)
+    try:
+        cache = ExpressionCache()
+        assert (
+            Calculate("2+3*4", cache=cache) == Calculate("2+3*4", cache=cache) == "14.0"
+        )
+        assert steps == [
+            "expression 2+3*4",
+            "3.0 * 4.0 = 12.0",
+            "2.0 + 12.0 = 14.0",
+            "expression 2+3*4",
+        ]
+        assert Calculate("1+2", Engine.LEGACY) == "3.0"
+        metrics = INSTRUMENT.metrics()
+        assert metrics["cache hit"]["count"] == metrics["cache miss"]["count"] == 1
+        assert (
+            metrics["operation add"]["count"] == 2 and metrics["validate"]["count"] == 1
+        )
+        assert metrics["parse"]["seconds"] > 0
+    finally:
+        INSTRUMENT = previous
+
+    # One-shot mode evaluates a single expression from the command line and exits
+    output = io.StringIO()
+    stdout, sys.stdout = sys.stdout, output
+    try:
+        main(["2^10-24"])
+    finally:
+        sys.stdout = stdout
+    assert output.getvalue() == "1000.0\n"
+    # Streaming reports errors the same way, on stderr with exit code 1
+    errors = io.StringIO()
+    stdin, sys.stdin = sys.stdin, io.StringIO("1/0")
+    stderr, sys.stderr = sys.stderr, errors
+    try:
+        main(["--stream", "-"])
+        assert False, "1/0 should exit"
+    except SystemExit as e:
+        assert e.code == 1
+    finally:
+        sys.stdin = stdin
+        sys.stderr = stderr
+    assert errors.getvalue() == "Error: Cannot divide by zero.\n"
+
+    # The server answers pipelined lines in order, even with only a couple in flight at
+    # once
+    import asyncio
+
+    async def AskServer(lines):
+        server = CalculatorServer({}, maxInFlight=2)
+        ready = asyncio.get_running_loop().create_future()
+        serving = asyncio.create_task(
+            server.serve("127.0.0.1", 0, ready=ready.set_result)
+        )
+        reader, writer = await asyncio.open_connection(*ParseAddress(await ready))
+        writer.write("".join(line + "\n" for line in lines).encode())
+        writer.write_eof()
+        answer = await reader.read()
+        writer.close()
+        serving.cancel()
+        return answer.decode().splitlines(), server.cache.stats()["hits"]
+
+    answers, hits = asyncio.run(AskServer(["1+2", "2^10", "1/0", "1 + 2"] * 5))
+    assert answers == ["3.0", "1024.0", "Error: Cannot divide by zero.", "3.0"] * 5
+    assert hits > 0
+
+    # Budgets stop pathological expressions before they can stall a worker
+    budget = Budget(maxLength=20, maxDepth=3, maxOperations=4)
+    for expression, options, message in [
+        (
+            "1+" * 10 + "1",
+            {"budget": budget},
+            "Expression is too long: 21 characters, more than 20.",
+        ),
+        (
+            "((((1))))",
+            {"budget": budget},
+            "Too deeply nested: more than 3 levels of parentheses at position 3.",
+        ),
+        (
+            "1+2+3+4+5+6",
+            {"budget": budget},
+            "Too many operations: more than 4 at position 9.",
+        ),
+        (
+            "9^9^9",
+            {"backend": Backend.EXACT},
+            "Result would be larger than 1048576 bits.",
+        ),
+        ("9^9^9", {}, "Result would be larger than 1024 bits."),
+        (
+            "10^400",
+            {"engine": Engine.CLOSURE},
+            "Result would be larger than 1024 bits.",
+        ),
+    ]:
+        try:
+            Calculate(expression, **options)
+            assert False, expression
+        except ValueError as e:
+            assert str(e) == message, str(e)
+    # Multiplying, adding and dividing give inf instead of raising, which every engine
+    # catches
+    for engine in Engine:
+        for expression in ["10^308*10", "10^308+10^308", "1/(10^308*10)", "10^308/0.1"]:
+            try:
+                Calculate(expression, engine=engine)
+                assert False, (engine, expression)
+            except ValueError as e:
+                assert str(e) == "Result would be larger than 1024 bits.", str(e)
+    # Including a long closure chain
+    try:
+        Compile("x+" * 9 + "x", Engine.CLOSURE).evaluate(x=1e308)
+        assert False, "x+x+... should go past the largest float"
+    except ValueError as e:
+        assert str(e) == "Result would be larger than 1024 bits.", str(e)
+    result = Compile("x*10").evaluate_columns({"x": array("d", [1e308, 1])})
+    assert list(result.errors) == [1, 0] and result.values[1] == 10
+    assert result.messages == {0: "Result would be larger than 1024 bits."}
+    # A deadline that has already passed stops the very first operation
+    timeLimit = Budget(maxSeconds=5)
+    compiled = CompileExpression("1+2", Engine.STACK, Backend.FLOAT, budget=timeLimit)
+    deadline = DEADLINE.set((time.perf_counter() - 1, 5))
+    try:
+        RunCompiled(compiled, Engine.STACK, budget=timeLimit)
+        assert False, "an expired deadline should stop it"
+    except ValueError as e:
+        assert str(e) == "Took longer than 5 seconds."
+    finally:
+        DEADLINE.reset(deadline)
+    # Long searches inside a single operation check it as they go too
+    deadline = DEADLINE.set((time.perf_counter() - 1, 5))
+    try:
+        IntegerRoot(3**5000 + 1, 4999)
+        assert False, "a root search past its deadline should stop"
+    except ValueError as e:
+        assert str(e) == "Took longer than 5 seconds."
+    finally:
+        DEADLINE.reset(deadline)
+    assert (
+        Calculate(
+            "2^0.00000000000000000001",
+            backend=Backend.EXACT,
+            budget=Budget(maxSeconds=1),
+        )
+        == "1.0"
+    )
+    assert Calculate("(((1+2)))*3", budget=budget) == "9.0"
+    assert Calculate("(((((1)))))", budget=Budget(maxDepth=None)) == "1.0"
+    # Every engine handles anything the default depth limit lets through
+    depth = MAX_NESTING_DEPTH - 1
+    for engine in Engine:
+        assert Calculate("1+(" * depth + "1" + ")" * depth, engine) == f"{depth + 1}.0"
+        assert Calculate("(" * depth + "2^2" + ")" * depth, engine) == "4.0"
+
+    # Calculators keep their own settings, cache and metrics, and can be shared between
+    # threads
+    from concurrent.futures import ThreadPoolExecutor
+
+    exact = Calculator(backend=Backend.EXACT, metrics=True)
+    decimal = Calculator(backend=Backend.DECIMAL, precision=5, cacheSize=0)
+    assert exact.evaluate("1/3+1/6") == "1/2" and decimal.evaluate("1/3") == "0.33333"
+    assert exact.evaluate_many(["2^10", "1/0", "2^10"]) == [
+        LineResult(1, "2^10", "1024", None),
+        LineResult(2, "1/0", None, "Cannot divide by zero."),
+        LineResult(3, "2^10", "1024", None),
+    ]
+    expressions = [f"{n}^2-{n}" for n in range(200)] * 5
+    with ThreadPoolExecutor(4) as pool:
+        answers = list(pool.map(exact.evaluate, expressions))
+    assert answers == [str(n * n - n) for n in range(200)] * 5
+    metrics = exact.metrics()
+    # Two threads can both miss on the same expression, so this goes by the misses.
+    # Every miss has one power except 1/3+1/6 and 1/0
+    assert (
+        metrics["metrics"]["operation exponent"]["count"]
+        == metrics["cache"]["misses"] - 2
+    )
+    assert metrics["cache"]["hits"] + metrics["cache"]["misses"] == 1003
+    assert (
+        decimal.metrics()["metrics"] == {} and decimal.metrics()["cache"]["size"] == 0
+    )
+    try:
+        Calculator(Engine.LEGACY)
+        assert False
+    except ValueError:
+        pass
+
+    # An on-disk cache warmed from a corpus answers later runs, but only with the same
+    # settings and only from the same version of the calculator
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cache")
+        assert WarmDiskCache(path, io.StringIO("1+2\n2^10\n1/0\n")) == 2
+        assert WarmDiskCache(path, io.StringIO("2^10\n3*3\n")) == 3
+        disk = DiskCache(path)
+        cache = ExpressionCache(16, disk)
+        assert [Calculate(e, cache=cache) for e in ("1 + 2", "3*3", "4*4")] == [
+            "3.0",
+            "9.0",
+            "16.0",
+        ]
+        assert cache.stats()["diskHits"] == 2 and cache.stats()["misses"] == 1
+        assert Calculator(diskCache=path).evaluate_many(["2^10"])[0].result == "1024.0"
+        exact = ExpressionCache(16, disk)
+        assert Calculate("2^10", backend=Backend.EXACT, cache=exact) == "1024"
+        assert exact.stats()["diskHits"] == 0
+        disk.close()
+        assert (
+            len(DiskCache(path)) == 3 and len(DiskCache(path, b"an older version")) == 0
+        )
+        assert DiskCache(os.path.join(directory, "missing")).get(("anything",)) is None
+        # A file cut short partway through its results just misses the ones that were
+        # cut off
+        with open(path, "r+b") as stream:
+            stream.truncate(os.path.getsize(path) - 4)
+        disk = DiskCache(path)
+        cache = ExpressionCache(16, disk)
+        assert [Calculate(e, cache=cache) for e in ("1+2", "2^10", "3*3")] == [
+            "3.0",
+            "1024.0",
+            "9.0",
+        ]
+        assert len(disk) == 2 and cache.stats()["diskHits"] == 2
+        disk.close()
+
+    print("MY STUFF WORKS????")
+
+
+def CompileExpression(
+    toCalculate: str,
+    engine: Engine,
+    backend: Backend = Backend.FLOAT,
+    optimize: bool = False,
+    precision: int = None,
+    maxBits: int = None,
+    budget: Budget = None,
+    instrument: Instrument = None,
+):
+    """
+    This function turns an expression into the form the given engine runs.
+    Parameters:
+        toCalculate (str): The mathematical expression to compile.
+        engine (Engine): The engine to compile for, Engine.AST, Engine.STACK or
+        Engine.CLOSURE.
+        backend (Backend): The kind of numbers the expression's numbers are read as.
+        optimize (bool): True to run the Optimizer on it, see Optimizer.
+        precision (int): Significant digits for the decimal backend, used when
+        optimizing.
+        maxBits (int): The biggest power or product allowed, used when optimizing
+        and by the closure engine.
+        budget (Budget): The nesting, operator and time limits, None for no limits.
+        instrument (Instrument): Counts the operations done while optimizing and by the
+        closure engine, None to not count them.
+
+    Returns:
+        The compiled expression: a postfix program for Engine.STACK, a tree for
+        Engine.AST, a function for Engine.CLOSURE and Bytecode for Engine.BYTECODE.
+    """
+
+    number = BACKEND_NUMBERS[backend]
+    if engine is Engine.STACK or engine is Engine.CLOSURE or engine is Engine.BYTECODE:
+        compiled = ToPostfix(toCalculate, number, budget)
+    elif engine is Engine.AST:
+        compiled = ParseTree(toCalculate, number, budget)
+        if not optimize:
+            return compiled
+        compiled = TreeToPostfix(compiled)
+    else:
+        raise ValueError(f"The {engine.value} engine has no compiled form.")
+
+    if optimize:
+        optimizer = Optimizer(
+            BackendApply(backend, maxBits, budget, instrument), backend
+        )
+        if backend is Backend.DECIMAL:
+            # Constant parts have to be rounded the same way they would be when
+            # evaluated
+            with localcontext(prec=precision or DECIMAL_PRECISION):
+                root = optimizer.optimize(compiled)
+        else:
+            root = optimizer.optimize(compiled)
+        if engine is Engine.AST:
+            return root
+        compiled = TreeToPostfix(root)
+    if engine is Engine.CLOSURE:
+        return BuildClosure(
+            compiled, BackendApply(backend, maxBits, budget, instrument)
+        )
+    if engine is Engine.BYTECODE:
+        return ToBytecode(compiled)
+    return compiled
+
+
+def BackendApply(
+    backend: Backend,
+    maxBits: int = None,
+    budget: Budget = None,
+    instrument: Instrument = None,
+):
+    """
+    This function picks the function that applies operations for a backend.
+    Parameters:
+        backend (Backend): The backend.
+        maxBits (int): The biggest power or product allowed, in bits. Defaults to
+        MAX_RESULT_BITS.
+        budget (Budget): Checked for a time limit, None for no limit.
+        instrument (Instrument): Counts every operation, None to not count them.
+
+    Returns:
+        function: The backend's apply function, limited to maxBits if there is a limit,
+        stopped at the DEADLINE if the budget has a time limit,
+        and counted by the instrument if there is one.
+    """
+
+    apply = BACKEND_OPERATIONS[backend]
+    maxBits = maxBits or MAX_RESULT_BITS
+    # Floats overflow long before 1024 bits anyway, so checking them first would only
+    # slow them down
+    if maxBits is not None and (backend is not Backend.FLOAT or maxBits < FLOAT_BITS):
+        apply = LimitResultSize(apply, maxBits)
+    if budget is not None and budget.maxSeconds:
+        apply = LimitTime(apply)
+    if instrument is not None:
+        apply = instrument.wrap(apply)
+    return apply
+
+
+def RunCompiled(
+    compiled,
+    engine: Engine,
+    bindings: dict = None,
+    backend: Backend = Backend.FLOAT,
+    precision: int = None,
+    maxBits: int = None,
+    budget: Budget = None,
+    instrument: Instrument = None,
+):
+    """
+    This function evaluates an expression compiled by CompileExpression.
+    Parameters:
+        compiled: The compiled expression.
+        engine (Engine): The engine it was compiled for.
+        bindings (dict): The value of every variable in the expression, by name.
+        backend (Backend): The backend it was compiled for.
+        precision (int): Significant digits for the decimal backend. Defaults to
+        DECIMAL_PRECISION.
+        maxBits (int): The biggest power or product allowed, in bits. Defaults to
+        MAX_RESULT_BITS.
+        budget (Budget): Checked for a time limit, None for no limit.
+        instrument (Instrument): Counts every operation, None to not count them.
+        The closure engine uses the budget and instrument it was compiled with.
+
+    Returns:
+        The value of the expression, a float, int, Fraction or Decimal depending on the
+        backend.
+    """
+
+    if engine is Engine.CLOSURE:
+        # The backend's operations were built into the function when it was compiled
+        if backend is Backend.DECIMAL:
+            with localcontext(prec=precision or DECIMAL_PRECISION):
+                return +compiled(bindings, {})
+        return compiled(bindings, {})
+    apply = BackendApply(backend, maxBits, budget, instrument)
+    if backend is Backend.DECIMAL:
+        with localcontext(prec=precision or DECIMAL_PRECISION):
+            if engine is Engine.STACK:
+                return +EvaluatePostfix(compiled, bindings, apply)
+            if engine is Engine.BYTECODE:
+                return +EvaluateBytecode(compiled, bindings, apply)
+            return +EvaluateTree(compiled, bindings, apply, {})
+    if engine is Engine.STACK:
+        return EvaluatePostfix(compiled, bindings, apply)
+    if engine is Engine.BYTECODE:
+        return EvaluateBytecode(compiled, bindings, apply)
+    return EvaluateTree(compiled, bindings, apply, {})
+
+
+def DumpOptimized(
+    toCalculate: str,
+    backend: Backend = None,
+    precision: int = None,
+    maxBits: int = None,
+) -> str:
+    """
+    This function shows what the Optimizer makes of an expression.
+    Parameters:
+        toCalculate (str): The mathematical expression.
+        backend (Backend): The kind of numbers to optimize with. Defaults to the module
+        level BACKEND.
+        precision (int): Significant digits for the decimal backend. Defaults to
+        DECIMAL_PRECISION.
+        maxBits (int): The biggest power or product allowed, in bits. Defaults to
+        MAX_RESULT_BITS.
+
+    Returns:
+        str: The optimized expression, see FormatProgram.
+    """
+
+    program = CompileExpression(
+        toCalculate,
+        Engine.STACK,
+        backend or BACKEND,
+        True,
+        precision,
+        maxBits,
+        None,
+        INSTRUMENT,
+    )
+    return FormatProgram(program)
+
+
+def FindVariables(toCalculate: str) -> tuple:
+    """
+    This function lists the variables of an expression.
+    Parameters:
+        toCalculate (str): The mathematical expression.
+
+    Returns:
+        tuple: The variable names, in order of first appearance.
+    """
+
+    names = {}
+    for token in Tokenize(toCalculate):
+        if token.kind is TokenKind.VARIABLE:
+            names[token.value] = None
+    return tuple(names)
+
+
+class CompiledExpression:
+    """
+    An expression that was parsed once and can be evaluated many times
+    with different values for its variables.
+    """
+
+    __slots__ = (
+        "expression",
+        "engine",
+        "backend",
+        "precision",
+        "maxBits",
+        "optimize",
+        "compiled",
+        "variables",
+    )
+
+    def __init__(
+        self,
+        toCalculate: str,
+        engine: Engine = None,
+        backend: Backend = None,
+        precision: int = None,
+        maxBits: int = None,
+        optimize: bool = None,
+    ):
+        """
+        This function compiles an expression.
+        Parameters:
+            toCalculate (str): The mathematical expression, which may use variables like
+            "x^2+3*x".
+            engine (Engine): The engine to compile for. Defaults to the module level
+            ENGINE.
+            backend (Backend): The kind of numbers to evaluate with. Defaults to the
+            module level BACKEND.
+            precision (int): Significant digits for the decimal backend. Defaults to
+            DECIMAL_PRECISION.
+            maxBits (int): The biggest power or product allowed, in bits. Defaults to
+            MAX_RESULT_BITS.
+            optimize (bool): True to optimize the expression first. Defaults to
+            OPTIMIZE.
+
+        Returns:
+            None
+        """
+
+        self.expression = toCalculate
+        self.engine = engine or ENGINE
+        self.backend = backend or BACKEND
+        self.precision = precision
+        self.maxBits = maxBits
+        self.optimize = OPTIMIZE if optimize is None else optimize
+        self.compiled = Timed(
+            INSTRUMENT,
+            "parse",
+            CompileExpression,
+            self.expression,
+            self.engine,
+            self.backend,
+            self.optimize,
+            precision,
+            maxBits,
+            None,
+            INSTRUMENT,
+        )
+        self.variables = FindVariables(self.expression)
+
+    def evaluate_columns(self, columns: dict, output=None):
+        """
+        This function evaluates the expression for every row of a set of columns.
+        Parameters:
+            columns (dict): A buffer of doubles for each variable, by name.
+            output: A writable buffer of doubles to put the results in.
+
+        Returns:
+            ColumnResult: The results and which rows failed, see EvaluateColumns.
+        """
+
+        return EvaluateColumns(self, columns, output)
+
+    def evaluate(self, bindings: dict = None, **namedBindings) -> float:
+        """
+        This function evaluates the expression for one set of variable values.
+        Parameters:
+            bindings (dict): The value of each variable, by name.
+            **namedBindings: More variable values, as keyword arguments.
+
+        Returns:
+            The value of the expression, a float unless another backend was chosen.
+        """
+
+        if namedBindings:
+            bindings = {**(bindings or {}), **namedBindings}
+        toValue = BACKEND_VALUES[self.backend]
+        values = {}
+        for name in self.variables:
+            if bindings is None or name not in bindings:
+                raise ValueError(f"No value given for variable '{name}'.")
+            values[name] = toValue(bindings[name])
+        return RunCompiled(
+            self.compiled,
+            self.engine,
+            values,
+            self.backend,
+            self.precision,
+            self.maxBits,
+            None,
+            INSTRUMENT,
+        )
+
+
+def Compile(
+    toCalculate: str,
+    engine: Engine = None,
+    backend: Backend = None,
+    precision: int = None,
+    maxBits: int = None,
+    optimize: bool = None,
+) -> CompiledExpression:
+    """
+    This function compiles an expression once so it can be evaluated many times.
+    Parameters:
+        toCalculate (str): The mathematical expression, which may use variables like
+        "x^2+3*x".
+        engine (Engine): The engine to compile for. Defaults to the module level ENGINE.
+        backend (Backend): The kind of numbers to evaluate with. Defaults to the module
+        level BACKEND.
+        precision (int): Significant digits for the decimal backend. Defaults to
+        DECIMAL_PRECISION.
+        maxBits (int): The biggest power or product allowed, in bits. Defaults to
+        MAX_RESULT_BITS.
+        optimize (bool): True to optimize the expression first. Defaults to OPTIMIZE.
+
+    Returns:
+        CompiledExpression: The compiled expression.
+    """
+
+    return CompiledExpression(
+        toCalculate, engine, backend, precision, maxBits, optimize
+    )
+
+
+class ColumnResult(NamedTuple):
+    values: object  # The output buffer, failed rows hold NaN
+    errors: bytearray  # 1 for every row that failed, 0 otherwise
+    messages: dict  # The first error message of each failed row, by row index
+
+
+# The whole column versions of the operations. They raise on any bad row,
+# in which case the column is redone one row at a time to find out which rows failed
+COLUMN_OPERATIONS = {
+    Operation.ADD: operator.add,
+    Operation.SUBTRACT: operator.sub,
+    Operation.MULTIPLY: operator.mul,
+    Operation.DIVIDE: operator.truediv,
+    Operation.MOD: operator.mod,
+    Operation.EXPONENT: math.pow,  # Raises where ** would give a complex number
+    Operation.LOGARITHM: LogarithmOf,
+}
+
+
+def AsDoubles(buffer):
+    """
+    This function gives a view of a buffer as doubles, without copying it if it already
+    holds doubles.
+    Parameters:
+        buffer: Any object supporting the buffer protocol, like array.array("d") or a
+        memoryview.
+
+    Returns:
+        memoryview or array: The buffer's values as doubles.
+    """
+
+    view = memoryview(buffer)
+    if view.format == "d":
+        return view
+    # Other number formats, like array("i") or bytes, have to be converted one number at
+    # a time
+    try:
+        return array("d", view.tolist())
+    except TypeError:
+        raise ValueError(
+            f"Columns must hold numbers, not '{view.format}' items."
+        ) from None
+
+
+def ApplyToColumns(
+    operation: Operation, left, right, length: int, errors: bytearray, messages: dict
+):
+    """
+    This function applies an operation to every row of two columns.
+    Parameters:
+        operation (Operation): The operation to apply.
+        left: A column, or a float used for every row.
+        right: A column, or a float used for every row.
+        length (int): The number of rows.
+        errors (bytearray): The error mask, failed rows are marked in it.
+        messages (dict): The first error message of each failed row, filled in here.
+
+    Returns:
+        array: The resulting column.
+    """
+
+    leftValues = repeat(left) if left.__class__ is float else left
+    rightValues = repeat(right) if right.__class__ is float else right
+    try:
+        if (
+            operation is Operation.LOGARITHM
+            and left.__class__ is float
+            and left in SPECIAL_LOGARITHMS
+        ):
+            # A constant base like log_2(x) can skip LogarithmOf for every row
+            return array("d", map(SPECIAL_LOGARITHMS[left], rightValues))
+        values = array("d", map(COLUMN_OPERATIONS[operation], leftValues, rightValues))
+    except (ArithmeticError, ValueError):
+        pass
+    else:
+        total = sum(values)
+        if total - total:
+            # Some row is inf or nan, which is fine if it came from an earlier failed
+            # row, but not if a row went past the largest float, see CheckFloatSize
+            for row, value in enumerate(values):
+                a = left if left.__class__ is float else left[row]
+                b = right if right.__class__ is float else right[row]
+                if value - value and math.isfinite(a) and math.isfinite(b):
+                    values[row] = math.nan
+                    errors[row] = 1
+                    messages.setdefault(
+                        row, f"Result would be larger than {FLOAT_BITS} bits."
+                    )
+        return values
+
+    # Some row failed, so go row by row with the scalar operation to find which
+    result = array("d", bytes(8 * length))
+    row = 0
+    for a, b in zip(leftValues, rightValues):
+        try:
+            result[row] = ApplyOperation(operation, a, b)
+        except (ArithmeticError, ValueError) as e:
+            result[row] = math.nan
+            errors[row] = 1
+            messages.setdefault(row, str(e))
+        row += 1
+    return result
+
+
+def ApplyColumnOperation(
+    operation: Operation, left, right, length: int, errors: bytearray, messages: dict
+):
+    """
+    This function applies one operation where either side can be a constant or a column.
+    Parameters:
+        operation (Operation): The operation to apply.
+        left: A float or a buffer of doubles.
+        right: A float or a buffer of doubles.
+        length (int): How many rows there are.
+        errors (bytearray): The error mask, rows that fail get marked with 1.
+        messages (dict): The first error message for each failed row.
+
+    Returns:
+        A float if both sides are constants, otherwise an array("d") with one result per
+        row.
+    """
+
+    if left.__class__ is not float or right.__class__ is not float:
+        return ApplyToColumns(operation, left, right, length, errors, messages)
+    # Both sides are constants, so this is one calculation, not one per row
+    try:
+        return ApplyOperation(operation, left, right)
+    except (ArithmeticError, ValueError) as e:
+        for row in range(length):
+            errors[row] = 1
+            messages.setdefault(row, str(e))
+        return math.nan
+
+
+def ApplyColumnModularPower(
+    base, exponent, modulus, length: int, errors: bytearray, messages: dict
+):
+    """
+    This function calculates base^exponent%modulus where any of them can be a constant
+    or a column, with ApplyModularPower for every row, so rows give exactly what
+    evaluate gives.
+    Parameters:
+        base: A float or a buffer of doubles.
+        exponent: A float or a buffer of doubles.
+        modulus: A float or a buffer of doubles.
+        length (int): How many rows there are.
+        errors (bytearray): The error mask, rows that fail get marked with 1.
+        messages (dict): The first error message for each failed row.
+
+    Returns:
+        A float if all three are constants, otherwise an array("d") with one result per
+        row.
+    """
+
+    if (
+        base.__class__ is float
+        and exponent.__class__ is float
+        and modulus.__class__ is float
+    ):
+        try:
+            return ApplyModularPower(ApplyOperation, base, exponent, modulus)
+        except (ArithmeticError, ValueError) as e:
+            for row in range(length):
+                errors[row] = 1
+                messages.setdefault(row, str(e))
+            return math.nan
+
+    # There is no whole column version of pow(a, b, m), so this goes row by row
+    result = array("d", bytes(8 * length))
+    bases = repeat(base) if base.__class__ is float else base
+    exponents = repeat(exponent) if exponent.__class__ is float else exponent
+    moduli = repeat(modulus) if modulus.__class__ is float else modulus
+    row = 0
+    for a, b, m in zip(bases, exponents, moduli):
+        try:
+            result[row] = ApplyModularPower(ApplyOperation, a, b, m)
+        except (ArithmeticError, ValueError) as e:
+            result[row] = math.nan
+            errors[row] = 1
+            messages.setdefault(row, str(e))
+        row += 1
+    return result
+
+
+def EvaluateColumns(
+    compiled: CompiledExpression, columns: dict, output=None
+) -> ColumnResult:
+    """
+    This function evaluates a compiled expression for every row of a set of columns at
+    once. Each operation runs over a whole column, so the per row work happens in C
+    instead of in the postfix loop. Rows that fail, like a division by zero, are marked
+    in an error mask instead of stopping the other rows.
+    Parameters:
+        compiled (CompiledExpression): The expression to evaluate.
+        columns (dict): A buffer of doubles for each variable, by name, all the same
+        length.
+        output: A writable buffer of doubles, as long as the columns, to put the results
+        in. A new array("d") is made if it is None.
+
+    Returns:
+        ColumnResult: The output buffer, the error mask and the error messages.
+    """
+
+    views = {name: AsDoubles(column) for name, column in columns.items()}
+    lengths = {len(view) for view in views.values()}
+    if len(lengths) > 1:
+        raise ValueError("All columns must have the same length.")
+    if lengths:
+        length = lengths.pop()
+    elif output is not None:
+        length = len(AsDoubles(output))
+    else:
+        raise ValueError("At least one column or an output buffer is needed.")
+    for name in compiled.variables:
+        if name not in views:
+            raise ValueError(f"No column given for variable '{name}'.")
+
+    if compiled.backend is not Backend.FLOAT:
+        raise ValueError("Columns can only be evaluated with the float backend.")
+    if compiled.engine is Engine.STACK:
+        program = compiled.compiled
+    else:
+        program = ToPostfix(compiled.expression)
+
+    errors = bytearray(length)
+    messages = {}
+    saved = {}  # Columns kept for Reuse items, by slot
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    for item in program:
+        itemClass = item.__class__
+        if itemClass is float:
+            push(item)
+        elif itemClass is str:
+            push(views[item])
+        elif itemClass is Instruction:
+            # a^b%m, worked out the same way as evaluate does, see ApplyModularPower
+            modulus = pop()
+            exponent = pop()
+            stack[-1] = ApplyColumnModularPower(
+                stack[-1], exponent, modulus, length, errors, messages
+            )
+        elif itemClass is Reuse:
+            if item.save:
+                saved[item.slot] = stack[-1]
+            else:
+                push(saved[item.slot])
+        else:
+            right = pop()
+            stack[-1] = ApplyColumnOperation(
+                item, stack[-1], right, length, errors, messages
+            )
+
+    result = stack[0]
+    if result.__class__ is float:
+        result = array("d", [result]) * length
+    elif result.__class__ is not array:
+        result = array("d", result)
+    if output is None:
+        output = result
+    else:
+        outputView = AsDoubles(output)
+        if outputView.__class__ is not memoryview or len(outputView) != length:
+            raise ValueError("The output buffer must hold one double per row.")
+        outputView[:] = memoryview(result)
+    return ColumnResult(output, errors, messages)
+
+
+def EvaluateExpression(
+    toCalculate: str,
+    engine: Engine = None,
+    backend: Backend = None,
+    precision: int = None,
+    maxBits: int = None,
+    optimize: bool = None,
+) -> str:
+    """
+    This function evaluates a mathematical expression.
+    Parameters:
+        toCalculate (str): The mathematical expression to evaluate, expected to be in the format
+        "a+b", "a-b", "a*b", "a/b", "a%b", "a^b", or "log_b(a)".
+        or a chain of the above operations.
+        engine (Engine): Which engine to evaluate with. Defaults to the module level
+        ENGINE.
+        backend (Backend): The kind of numbers to evaluate with. Defaults to the module
+        level BACKEND.
+        precision (int): Significant digits for the decimal backend. Defaults to
+        DECIMAL_PRECISION.
+        maxBits (int): The biggest power or product allowed, in bits. Defaults to
+        MAX_RESULT_BITS.
+        optimize (bool): True to optimize the expression before evaluating it. Defaults
+        to OPTIMIZE.
+
+    Returns:
+        str: The result of the evaluation as a string.
+    """
+
+    engine = engine or ENGINE
+    backend = backend or BACKEND
+    if engine is Engine.LEGACY:
+        if backend is not Backend.FLOAT:
+            raise ValueError("The legacy engine only supports the float backend.")
+        return Timed(INSTRUMENT, "evaluate", RewriteExpression, toCalculate)
+    if optimize is None:
+        optimize = OPTIMIZE
+    compiled = Timed(
+        INSTRUMENT,
+        "parse",
+        CompileExpression,
+        toCalculate,
+        engine,
+        backend,
+        optimize,
+        precision,
+        maxBits,
+        None,
+        INSTRUMENT,
+    )
+    return FormatNumber(
+        Timed(
+            INSTRUMENT,
+            "evaluate",
+            RunCompiled,
+            compiled,
+            engine,
+            None,
+            backend,
+            precision,
+            maxBits,
+            None,
+            INSTRUMENT,
+        )
+    )
+
+
+def EvaluateStream(
+    stream,
+    backend: Backend = None,
+    precision: int = None,
+    maxBits: int = None,
+    chunkSize: int = STREAM_CHUNK_SIZE,
+    budget: Budget = None,
+) -> str:
+    """
+    This function evaluates one expression too big to hold in memory, like a generated
+    file. The text is read a chunk at a time and goes straight through the tokenizer,
+    the shunting-yard and the stack machine, so memory grows with how deeply the
+    expression nests and not with how long it is. The lexer checks the syntax as it
+    goes, so a mistake is reported as soon as it is read, but a^b%m isn't fused since
+    that needs the whole program. There is only the stack machine here, so there is no
+    engine to pick.
+    Parameters:
+        stream: A text stream holding the expression, like an open file or sys.stdin.
+        backend (Backend): The kind of numbers to evaluate with. Defaults to the module
+        level BACKEND.
+        precision (int): Significant digits for the decimal backend. Defaults to
+        DECIMAL_PRECISION.
+        maxBits (int): The biggest power or product allowed, in bits. Defaults to
+        MAX_RESULT_BITS.
+        chunkSize (int): How many characters to read at a time.
+        budget (Budget): The nesting, operator and time limits. The length limit isn't
+        used, streams are meant to be long. Defaults to the module level BUDGET.
+
+    Returns:
+        str: The result of the evaluation as a string.
+    """
+
+    backend = backend or BACKEND
+    budget = budget or BUDGET
+    number = BACKEND_NUMBERS[backend]
+    tokens = TokenizeStream(ReadChunks(stream, chunkSize), number, budget)
+    program = PostfixItems(tokens, number)
+    apply = BackendApply(backend, maxBits, budget, INSTRUMENT)
+    deadline = None
+    if budget.maxSeconds:
+        deadline = DEADLINE.set(
+            (time.perf_counter() + budget.maxSeconds, budget.maxSeconds)
+        )
+    try:
+        if backend is Backend.DECIMAL:
+            with localcontext(prec=precision or DECIMAL_PRECISION):
+                return FormatNumber(+EvaluatePostfix(program, None, apply))
+        return FormatNumber(EvaluatePostfix(program, None, apply))
+    finally:
+        if deadline is not None:
+            DEADLINE.reset(deadline)
+
+
+# The on-disk cache file is a header, then a table of slots, then the records the slots
+# point to. The header is the format's magic number, the version of the calculator that
+# wrote it, and the number of slots. A slot is the hash of a key and the offset of its
+# record, with a hash of 0 for an empty slot. A record is the lengths of its key and
+# result, then the key and the result
+DISK_CACHE_MAGIC = b"CALCDC01"
+DISK_CACHE_HEADER = struct.Struct("<8s16sQ")
+DISK_CACHE_SLOT = struct.Struct("<QQ")
+DISK_CACHE_RECORD = struct.Struct("<II")
+
+
+def DiskCacheVersion() -> bytes:
+    """
+    This function works out the version stamped on on-disk caches: a hash of this file's
+    source, so any change to the parser or the engines makes the results saved by older
+    versions unused instead of wrong.
+    Parameters:
+        None
+
+    Returns:
+        bytes: The version, 16 bytes long.
+    """
+
+    from hashlib import blake2b
+
+    with open(__file__, "rb") as source:
+        return blake2b(source.read(), digest_size=16).digest()
+
+
+def DiskKey(key) -> bytes:
+    """
+    This function turns an ExpressionCache key into the bytes an on-disk cache stores it
+    as.
+    Parameters:
+        key: The key, a tuple of the settings and the normalized expression.
+
+    Returns:
+        bytes: The key as bytes.
+    """
+
+    return repr(key).encode()
+
+
+def DiskHash(keyBytes: bytes) -> int:
+    """
+    This function hashes a key for the on-disk cache. Python's own hash() changes
+    between runs, so it can't be used for anything saved.
+    Parameters:
+        keyBytes (bytes): The key, see DiskKey.
+
+    Returns:
+        int: The hash, never 0 since that marks an empty slot.
+    """
+
+    from hashlib import blake2b
+
+    return int.from_bytes(blake2b(keyBytes, digest_size=8).digest(), "little") | 1
+
+
+class DiskCache:
+    """
+    Results saved in a file by WriteDiskCache, read through a memory map, so any number
+    of processes can read the same file at once while the operating system keeps one
+    copy of it in memory instead of one per process. The file is never changed in place:
+    writing replaces it, and processes that already have the old one open keep reading
+    the old one. A missing file, a damaged one or one written by another version of the
+    calculator is treated as empty.
+    Only results are saved, not compiled expressions. A result found on disk skips
+    compiling altogether, and closures can't be saved anyway.
+    """
+
+    __slots__ = ("path", "map", "slotCount")
+
+    def __init__(self, path: str, version: bytes = None):
+        """
+        This function opens an on-disk cache for reading.
+        Parameters:
+            path (str): The cache file.
+            version (bytes): The version its results have to be from. Defaults to
+            DiskCacheVersion().
+
+        Returns:
+            None
+        """
+
+        import mmap
+
+        self.path = path
+        self.map = None
+        self.slotCount = 0
+        try:
+            stream = open(path, "rb")
+        except FileNotFoundError:
+            return
+        with stream:
+            size = os.fstat(stream.fileno()).st_size
+            if size < DISK_CACHE_HEADER.size:
+                return
+            fileMap = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fileVersion, slotCount = DISK_CACHE_HEADER.unpack_from(fileMap)
+        if (
+            magic != DISK_CACHE_MAGIC
+            or fileVersion != (version or DiskCacheVersion())
+            or slotCount & (slotCount - 1)  # Always a power of two
+            or size < DISK_CACHE_HEADER.size + slotCount * DISK_CACHE_SLOT.size
+        ):
+            fileMap.close()
+            return
+        self.map = fileMap
+        self.slotCount = slotCount
+
+    def get(self, key) -> str:
+        """
+        This function looks up a result.
+        Parameters:
+            key: The ExpressionCache key of the result.
+
+        Returns:
+            str: The result, or None if it isn't in the file.
+        """
+
+        if not self.slotCount:
+            return None
+        keyBytes = DiskKey(key)
+        keyHash = DiskHash(keyBytes)
+        fileMap = self.map
+        mask = self.slotCount - 1
+        slot = keyHash & mask
+        # Files written by WriteDiskCache always have empty slots, but a damaged one
+        # might not
+        for _ in range(self.slotCount):
+            slotHash, offset = DISK_CACHE_SLOT.unpack_from(
+                fileMap, DISK_CACHE_HEADER.size + slot * DISK_CACHE_SLOT.size
+            )
+            if slotHash == 0:
+                return None
+            if slotHash == keyHash:
+                record = self.record(offset)
+                if record is not None and record[0] == keyBytes:
+                    return record[1]
+            slot = (slot + 1) & mask
+        return None
+
+    def record(self, offset: int):
+        """
+        This function reads the key and result a slot points to. A damaged or cut short
+        file could point anywhere, so records that don't fit in the file are treated as
+        missing.
+        Parameters:
+            offset (int): Where the record starts in the file.
+
+        Returns:
+            tuple: The key as bytes and the result, or None if the record is damaged.
+        """
+
+        fileMap = self.map
+        start = offset + DISK_CACHE_RECORD.size
+        if start > len(fileMap):
+            return None
+        keyLength, resultLength = DISK_CACHE_RECORD.unpack_from(fileMap, offset)
+        end = start + keyLength + resultLength
+        if end > len(fileMap):
+            return None
+        try:
+            result = fileMap[start + keyLength : end].decode()
+        except UnicodeDecodeError:
+            return None
+        return fileMap[start : start + keyLength], result
+
+    def items(self):
+        """
+        This function reads every saved result, skipping damaged ones.
+        Parameters:
+            None
+
+        Returns:
+            generator: (key, result) pairs, with the key as bytes, see DiskKey.
+        """
+
+        for slot in range(self.slotCount):
+            slotHash, offset = DISK_CACHE_SLOT.unpack_from(
+                self.map, DISK_CACHE_HEADER.size + slot * DISK_CACHE_SLOT.size
+            )
+            if slotHash:
+                record = self.record(offset)
+                if record is not None:
+                    yield record
+
+    def __len__(self) -> int:
+        """
+        This function counts the saved results.
+        Parameters:
+            None
+
+        Returns:
+            int: How many results the file has.
+        """
+
+        return sum(1 for _ in self.items())
+
+    def close(self):
+        """
+        This function closes the file. Lookups after this find nothing.
+        Parameters:
+            None
+
+        Returns:
+            None
+        """
+
+        if self.map is not None:
+            self.map.close()
+        self.map = None
+        self.slotCount = 0
+
+
+def WriteDiskCache(path: str, results: dict, version: bytes = None):
+    """
+    This function saves results as an on-disk cache for DiskCache to read. The file is
+    written next to path under another name and then renamed over it, so a process
+    reading it at the same time sees either the whole old file or the whole new one.
+    Parameters:
+        path (str): The cache file.
+        results (dict): The results to save, by key as bytes, see DiskKey.
+        version (bytes): The version to stamp on it. Defaults to DiskCacheVersion().
+
+    Returns:
+        None
+    """
+
+    import tempfile
+
+    # At most half full, so lookups of missing keys stop at an empty slot quickly
+    slotCount = 8
+    while slotCount < len(results) * 2:
+        slotCount *= 2
+    slots = bytearray(slotCount * DISK_CACHE_SLOT.size)
+    records = bytearray()
+    recordsStart = DISK_CACHE_HEADER.size + len(slots)
+    mask = slotCount - 1
+    for keyBytes, result in results.items():
+        resultBytes = result.encode()
+        keyHash = DiskHash(keyBytes)
+        slot = keyHash & mask
+        while DISK_CACHE_SLOT.unpack_from(slots, slot * DISK_CACHE_SLOT.size)[0]:
+            slot = (slot + 1) & mask
+        DISK_CACHE_SLOT.pack_into(
+            slots, slot * DISK_CACHE_SLOT.size, keyHash, recordsStart + len(records)
+        )
+        records += DISK_CACHE_RECORD.pack(len(keyBytes), len(resultBytes))
+        records += keyBytes
+        records += resultBytes
+
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(handle, "wb") as stream:
+            stream.write(
+                DISK_CACHE_HEADER.pack(
+                    DISK_CACHE_MAGIC, version or DiskCacheVersion(), slotCount
+                )
+            )
+            stream.write(slots)
+            stream.write(records)
+        # Temporary files are only readable by their owner, but other users' workers may
+        # read it
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(temporary, mode)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+class ExpressionCache:
+    """
+    A bounded least recently used cache that maps normalized expressions
+    to their compiled form and their result, and counts how well it is doing.
+    It is locked, so threads can share one. Expressions it doesn't have can be looked up
+    in a DiskCache behind it.
+    """
+
+    def __init__(self, maxSize: int = CACHE_SIZE, disk: DiskCache = None):
+        """
+        This function creates an empty cache.
+        Parameters:
+            maxSize (int): The most entries to keep, 0 or less keeps nothing.
+            disk (DiskCache): Where to look for results that aren't in memory, None for
+            nowhere.
+
+        Returns:
+            None
+        """
+
+        self.maxSize = maxSize
+        self.disk = disk
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = _thread.allocate_lock()
+
+    def get(self, key):
+        """
+        This function looks up an entry and marks it as the most recently used.
+        Parameters:
+            key: The key of the entry.
+
+        Returns:
+            tuple: The (compiled, result) pair, or None if the key is not cached.
+        """
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            result = None if self.disk is None else self.disk.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            # Results on disk have nothing compiled with them, an answer is all a hit
+            # needs
+            self.diskHits += 1
+            entry = (None, result)
+            if self.maxSize > 0:
+                self.entries[key] = entry
+                if len(self.entries) > self.maxSize:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+            return entry
+
+    def put(self, key, compiled, result: str):
+        """
+        This function stores an entry, evicting the least recently used one if the cache
+        is full.
+        Parameters:
+            key: The key of the entry.
+            compiled: The compiled expression.
+            result (str): The formatted result of the expression.
+
+        Returns:
+            None
+        """
+
+        if self.maxSize <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (compiled, result)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        This function empties the cache and resets its counters.
+        Parameters:
+            None
+
+        Returns:
+            None
+        """
+
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.diskHits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> dict:
+        """
+        This function reports how the cache is doing.
+        Parameters:
+            None
+
+        Returns:
+            dict: The hits, hits found on disk, misses, evictions, current size and
+            maximum size of the cache.
+        """
+
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "diskHits": self.diskHits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self.entries),
+                "maxSize": self.maxSize,
+            }
+
+    def memory(self) -> dict:
+        """
+        This function reports how much memory the compiled expressions in the cache take
+        up. It measures every entry, so it is meant for checking, not for calling all
+        the time.
+        Parameters:
+            None
+
+        Returns:
+            dict: The total bytes of the compiled expressions and the average bytes per
+            entry.
+        """
+
+        with self.lock:
+            entries = list(self.entries.values())
+        total = sum(CompiledSize(compiled) for compiled, _ in entries)
+        return {
+            "bytes": total,
+            "bytesPerEntry": total / len(entries) if entries else 0,
+        }
+
+
+CACHE = ExpressionCache()  # Shared by every Calculate call that doesn't bring its own
+
+
+def NormalizeExpression(toCalculate: str) -> str:
+    """
+    This function removes the whitespace from an expression that doesn't change what it
+    means, so "2 + 3" and "2+3" share a cache entry. It is only for cache keys, the
+    expression itself is tokenized as typed, so "12 34" is an error and not 1234.
+    Parameters:
+        toCalculate (str): The expression as typed.
+
+    Returns:
+        str: The expression without whitespace, except for one space wherever removing
+        it would join two numbers or names together.
+    """
+
+    parts = toCalculate.split()
+    pieces = parts[:1]
+    joining = NAME_CHARS | NUMBER_CHARS
+    for part in parts[1:]:
+        if pieces[-1][-1] in joining and part[0] in joining:
+            pieces.append(" ")
+        pieces.append(part)
+    return "".join(pieces)
+
+
+def Calculate(
+    toCalculate: str,
+    engine: Engine = None,
+    cache: ExpressionCache = None,
+    backend: Backend = None,
+    precision: int = None,
+    maxBits: int = None,
+    optimize: bool = None,
+    budget: Budget = None,
+) -> str:
+    """
+    This function validates and evaluates an expression as typed by the user,
+    answering repeated expressions from the cache without validating or parsing them
+    again. An expression that goes over its budget fails with a ValueError as soon as it
+    does.
+    Parameters:
+        toCalculate (str): The expression as typed.
+        engine (Engine): Which engine to evaluate with. Defaults to the module level
+        ENGINE.
+        cache (ExpressionCache): The cache to use. Defaults to the module level CACHE.
+        backend (Backend): The kind of numbers to evaluate with. Defaults to the module
+        level BACKEND.
+        precision (int): Significant digits for the decimal backend. Defaults to
+        DECIMAL_PRECISION.
+        maxBits (int): The biggest power or product allowed, in bits. Defaults to
+        MAX_RESULT_BITS.
+        optimize (bool): True to optimize the expression before evaluating it. Defaults
+        to OPTIMIZE.
+        budget (Budget): The expression's length, nesting, operator and time limits.
+        Defaults to the module level BUDGET.
+
+    Returns:
+        str: The result of the evaluation as a string.
+    """
+
+    if optimize is None:
+        optimize = OPTIMIZE
+    return CalculateWith(
+        toCalculate,
+        engine or ENGINE,
+        CACHE if cache is None else cache,
+        backend or BACKEND,
+        precision,
+        maxBits or MAX_RESULT_BITS,
+        optimize,
+        budget or BUDGET,
+        INSTRUMENT,
+    )
+
+
+def CalculateWith(
+    toCalculate: str,
+    engine: Engine,
+    cache: ExpressionCache,
+    backend: Backend,
+    precision: int,
+    maxBits: int,
+    optimize: bool,
+    budget: Budget,
+    instrument: Instrument,
+) -> str:
+    """
+    This function is Calculate with every setting given, so none of the module level
+    ones are used. It keeps nothing between calls except what it puts in the cache, so
+    any number of threads can call it at once.
+    Parameters:
+        toCalculate (str): The expression as typed.
+        engine (Engine): Which engine to evaluate with. The legacy engine still uses
+        INSTRUMENT.
+        cache (ExpressionCache): The cache to use.
+        backend (Backend): The kind of numbers to evaluate with.
+        precision (int): Significant digits for the decimal backend, None for
+        DECIMAL_PRECISION.
+        maxBits (int): The biggest power or product allowed, in bits, None for no limit.
+        optimize (bool): True to optimize the expression before evaluating it.
+        budget (Budget): The expression's length, nesting, operator and time limits.
+        instrument (Instrument): Counts and times everything, None to not.
+
+    Returns:
+        str: The result of the evaluation as a string.
+    """
+
+    CheckLength(toCalculate, budget)
+    normalized = NormalizeExpression(toCalculate)
+    if instrument is not None:
+        instrument.step(f"expression {normalized}")
+    if engine is Engine.LEGACY:
+        # The rewrite engine has nothing to compile, so it is not cached
+        if not normalized:
+            raise ValueError("Input cannot be empty.")
+        GeneralSyntax(toCalculate)
+        # Once the syntax is checked, the spaces left can go, the rewrites don't expect
+        # them
+        return EvaluateExpression(normalized.replace(" ", ""), engine, backend)
+
+    if backend is Backend.DECIMAL:
+        precision = precision or DECIMAL_PRECISION
+    else:
+        # Only the decimal backend uses it, so it shouldn't split the cache
+        precision = None
+    key = (engine, backend, precision, maxBits, optimize, budget, normalized)
+    entry = cache.get(key)
+    if instrument is not None:
+        instrument.count("cache miss" if entry is None else "cache hit")
+    if entry is not None:
+        return entry[1]
+
+    if not normalized:
+        raise ValueError("Input cannot be empty.")
+    deadline = None
+    if budget.maxSeconds:
+        deadline = DEADLINE.set(
+            (time.perf_counter() + budget.maxSeconds, budget.maxSeconds)
+        )
+    try:
+        # Compiling checks the syntax while tokenizing, so there is no separate
+        # GeneralSyntax pass
+        compiled = Timed(
+            instrument,
+            "parse",
+            CompileExpression,
+            toCalculate,
+            engine,
+            backend,
+            optimize,
+            precision,
+            maxBits,
+            budget,
+            instrument,
+        )
+        result = FormatNumber(
+            Timed(
+                instrument,
+                "evaluate",
+                RunCompiled,
+                compiled,
+                engine,
+                None,
+                backend,
+                precision,
+                maxBits,
+                budget,
+                instrument,
+            )
+        )
+    finally:
+        if deadline is not None:
+            DEADLINE.reset(deadline)
+    cache.put(key, compiled, result)
+    return result
+
+
+class Calculator:
+    """
+    A calculator with its own settings, cache and metrics, for using the calculator from
+    other programs instead of through main(). It doesn't use the module level settings,
+    CACHE or INSTRUMENT after it is created, and nothing is shared between calculators,
+    so one can be used from many threads at once, like from a
+    concurrent.futures.ThreadPoolExecutor.
+    """
+
+    __slots__ = (
+        "engine",
+        "backend",
+        "precision",
+        "maxBits",
+        "optimize",
+        "budget",
+        "cache",
+        "instrument",
+    )
+
+    def __init__(
+        self,
+        engine: Engine = None,
+        backend: Backend = None,
+        precision: int = None,
+        maxBits: int = None,
+        optimize: bool = None,
+        budget: Budget = None,
+        cacheSize: int = CACHE_SIZE,
+        metrics: bool = False,
+        diskCache: str = None,
+    ):
+        """
+        This function creates a calculator, filling in any settings not given from the
+        module level ones.
+        Parameters:
+            engine (Engine): Which engine to evaluate with. Defaults to ENGINE.
+            backend (Backend): The kind of numbers to evaluate with. Defaults to
+            BACKEND.
+            precision (int): Significant digits for the decimal backend. Defaults to
+            DECIMAL_PRECISION.
+            maxBits (int): The biggest power or product allowed, in bits. Defaults to
+            MAX_RESULT_BITS.
+            optimize (bool): True to optimize expressions before evaluating them.
+            Defaults to OPTIMIZE.
+            budget (Budget): Each expression's length, nesting, operator and time
+            limits. Defaults to BUDGET.
+            cacheSize (int): How many expressions to remember, 0 turns the cache off.
+            metrics (bool): True to count and time everything, see metrics().
+            diskCache (str): An on-disk cache to look results up in, see WarmDiskCache.
+            None for none.
+
+        Returns:
+            None
+        """
+
+        self.engine = engine or ENGINE
+        if self.engine is Engine.LEGACY:
+            raise ValueError(
+                "The legacy engine only works with the module level settings."
+            )
+        self.backend = backend or BACKEND
+        self.precision = None
+        if self.backend is Backend.DECIMAL:
+            self.precision = precision or DECIMAL_PRECISION
+        self.maxBits = maxBits or MAX_RESULT_BITS
+        self.optimize = OPTIMIZE if optimize is None else optimize
+        self.budget = budget or BUDGET
+        self.cache = ExpressionCache(
+            cacheSize, None if diskCache is None else DiskCache(diskCache)
+        )
+        self.instrument = Instrument() if metrics else None
+
+    def evaluate(self, expression: str) -> str:
+        """
+        This function evaluates one expression.
+        Parameters:
+            expression (str): The expression as typed.
+
+        Returns:
+            str: The result of the evaluation as a string. Mistakes raise ValueError.
+        """
+
+        return CalculateWith(
+            expression,
+            self.engine,
+            self.cache,
+            self.backend,
+            self.precision,
+            self.maxBits,
+            self.optimize,
+            self.budget,
+            self.instrument,
+        )
+
+    def evaluate_many(self, expressions) -> list:
+        """
+        This function evaluates expressions one after another, turning failures into
+        error results so one bad expression doesn't stop the rest. The settings are
+        gathered once for all of them instead of once per expression, and an expression
+        that comes up more than once is only worked out the first time, even with the
+        cache turned off.
+        Parameters:
+            expressions: An iterable of expressions.
+
+        Returns:
+            list: A LineResult for every expression, in order, numbered from 1.
+        """
+
+        settings = (
+            self.engine,
+            self.cache,
+            self.backend,
+            self.precision,
+            self.maxBits,
+            self.optimize,
+            self.budget,
+            self.instrument,
+        )
+        answers = {}  # The (result, error) of every expression worked out so far
+        results = []
+        append = results.append
+        for lineNumber, expression in enumerate(expressions, 1):
+            answer = answers.get(expression)
+            if answer is None:
+                try:
+                    answer = (CalculateWith(expression, *settings), None)
+                except Exception as e:
+                    answer = (None, str(e))
+                answers[expression] = answer
+            append(LineResult(lineNumber, expression, *answer))
+        return results
+
+    def metrics(self) -> dict:
+        """
+        This function reports the calculator's metrics and how its cache is doing.
+        Parameters:
+            None
+
+        Returns:
+            dict: The metrics, empty unless the calculator was created with
+            metrics=True, and the cache's stats, see Instrument.metrics and
+            ExpressionCache.stats.
+        """
+
+        return {
+            "metrics": {} if self.instrument is None else self.instrument.metrics(),
+            "cache": self.cache.stats(),
+        }
+
+
+def RewriteExpression(toCalculate: str) -> str:
+    """
+    This function evaluates a mathematical expression by repeatedly finding one
+    operator, calculating it, and pasting the result back into the string.
+    This is the original engine, kept so it can be compared against the tree engine.
+    Parameters:
+        toCalculate (str): The mathematical expression to evaluate, expected to be in the format
+        "a+b", "a-b", "a*b", "a/b", "a%b", "a^b", or "log_b(a)".
+        or a chain of the above operations.
+
+    Returns:
+        str: The result of the evaluation as a string.
+    """
+
+    # Every step rewrites the expression and goes around again, instead of calling
+    # itself, So long or deeply nested expressions can't run into the recursion limit
+    while True:
+        # I want to see if the expression is fully evaluated at this point,
+        # So i will itterate through each character starting from the 2nd postion (since the first is always a digit or a - for negative numbers)
+        # If it's a digit or decimal, we keep going
+        # If it's an operator, we will break out of the loop and continue with the logic below
+        # But what if the user inputs something of length 1?
+        if len(toCalculate) == 1:
+            if toCalculate[0].isdigit():
+                # If the input is a single digit, we can return the expression as is
+                return toCalculate
+            else:
+                # Length is 1 but it is not a digit
+                return "\nYou fool.\nYou absolute buffoon.\nYour mother was a hamster and your father smelt of elderberry.\nGet you and your galoping coconuts out of here."
+
+        # Range(1, len(toCalculate)) is used to skip the first character
+        for i in range(1, len(toCalculate)):
+            if toCalculate[i].isdigit() or toCalculate[i] == ".":
+                if i == len(toCalculate) - 1:
+                    # If we are at the last character and it's a digit or decimal, we can assume the expression is fully evaluated
+                    # So we can return the expression as is
+                    return toCalculate
+                # If we are not at the last character, we continue to the next character
+                continue
+            else:
+                # If we hit a non-digit, non-decimal, non-negative sign, we break out of the loop
+                # This means that the expression is not fully evaluated yet
+                break
+        if INSTRUMENT is not None:
+            INSTRUMENT.step(f"rewrite {toCalculate}")
+
+        # Since a given input will only be one operation,
+        # We can use a switch case to determine the operation
+        match True:
+
+            # I want to do it in order of PEMDAS, so I will handle parentheses first
+            # If there an opening parenthasis, that is not part of a logarithm, we will handle it first
+            case _ if (
+                "(" in toCalculate
+                and ")" in toCalculate
+                and Operation.LOGARITHM.value not in toCalculate
+            ):
+                # Handle innermost parentheses first
+
+                # Finds the last opening parenthasis
+                start = toCalculate.rfind("(")
+                # Finds the first closing parenthasis after the opening parenthasis
+                end = toCalculate.find(")", start)
+                if start == -1 or end == -1:
+                    raise ValueError("Mismatched parentheses.")
+                innerExpression = toCalculate[start + 1 : end]
+                innerResult = RewriteExpression(innerExpression)  # Recursive call
+
+                # 3 parts in the return value:
+                # 1. The part of the string before the parentheses
+                # 2. The result of the inner expression
+                # 3. The part of the string after the parentheses
+                # Replace the inner expression with its result
+                # After evaluating the inner expression, we call evaluateExpression
+                # again
+                # To handle any remaining operations in the rest of the expression
+                toCalculate = (
+                    toCalculate[:start] + str(innerResult) + toCalculate[end + 1 :]
+                )
+                continue
+
+            case _ if Operation.LOGARITHM.value in toCalculate:
+                # The logic for logarithm is a bit (AAAAAAAAAAAAAAAAAAAAAA) more
+                # complex,
+                # So i will be placing it an entirely sepreate method
+                # Which will be called ReplaceLogarithms(toCalculate)
+                # It does all of the logarithms in one go, instead of one at a time
+
+                toCalculate = ReplaceLogarithms(toCalculate)
+                continue
+
+            case _ if Operation.EXPONENT.value in toCalculate:
+                start, end = FindStartAndEnd(toCalculate, Operation.EXPONENT.value)
+                expResult = Exponent(toCalculate[start:end])
+                toCalculate = toCalculate[:start] + expResult + toCalculate[end:]
+                continue
+
+            case _ if Operation.MULTIPLY.value in toCalculate:
+                start, end = FindStartAndEnd(toCalculate, Operation.MULTIPLY.value)
+                mulResult = Multiply(toCalculate[start:end])
+                toCalculate = toCalculate[:start] + mulResult + toCalculate[end:]
+                continue
+
+            case _ if Operation.DIVIDE.value in toCalculate:
+                start, end = FindStartAndEnd(toCalculate, Operation.DIVIDE.value)
+                divResult = Divide(toCalculate[start:end])
+                toCalculate = toCalculate[:start] + divResult + toCalculate[end:]
+                continue
+
+            case _ if Operation.MOD.value in toCalculate:
+                start, end = FindStartAndEnd(toCalculate, Operation.MOD.value)
+                modResult = Mod(toCalculate[start:end])
+                toCalculate = toCalculate[:start] + modResult + toCalculate[end:]
+                continue
+
+            case _ if Operation.ADD.value in toCalculate:
+                start, end = FindStartAndEnd(toCalculate, Operation.ADD.value)
+                addResult = Add(toCalculate[start:end])
+                toCalculate = toCalculate[:start] + addResult + toCalculate[end:]
+                continue
+
+            case _ if Operation.SUBTRACT.value in toCalculate:
+                start, end = FindStartAndEnd(toCalculate, Operation.SUBTRACT.value)
+                subResult = Subtract(toCalculate[start:end])
+                toCalculate = toCalculate[:start] + subResult + toCalculate[end:]
+                continue
+
+            case _:
+                raise ValueError(
+                    "Invalid operation. Please use +, -, *, /, %, ^, or log_b(a)."
+                )
+
+
+class LineResult(NamedTuple):
+    lineNumber: int
+    expression: str
+    result: str  # None if the line failed
+    error: str  # None if the line succeeded
+
+
+def ReadExpressions(stream):
+    """
+    This function reads one expression per line, lazily, so any size of input uses the
+    same memory.
+    Parameters:
+        stream: A text stream to read from.
+
+    Returns:
+        generator: Each line without its line ending.
+    """
+
+    for line in stream:
+        yield line.rstrip("\r\n")
+
+
+def EvaluateLines(expressions, firstLineNumber: int = 1, **options):
+    """
+    This function evaluates expressions one after another, turning failures into error
+    results so one bad line doesn't stop the rest.
+    Parameters:
+        expressions: An iterable of expressions.
+        firstLineNumber (int): The line number of the first expression.
+        **options: Passed on to Calculate, like engine, backend or precision.
+
+    Returns:
+        generator: A LineResult for every expression, in input order.
+    """
+
+    lineNumber = firstLineNumber - 1
+    for expression in expressions:
+        lineNumber += 1
+        try:
+            yield LineResult(
+                lineNumber, expression, Calculate(expression, **options), None
+            )
+        except Exception as e:
+            yield LineResult(lineNumber, expression, None, str(e))
+
+
+def FormatText(results):
+    """
+    This function formats results as plain text, the result or "Error: ..." on each
+    line.
+    Parameters:
+        results: An iterable of LineResult.
+
+    Returns:
+        generator: One output line per result.
+    """
+
+    for lineResult in results:
+        if lineResult.error is None:
+            yield lineResult.result + "\n"
+        else:
+            yield "Error: " + lineResult.error + "\n"
+
+
+def FormatJsonLines(results):
+    """
+    This function formats results as JSON lines, with a separate result and error field.
+    Parameters:
+        results: An iterable of LineResult.
+
+    Returns:
+        generator: One JSON object per line per result.
+    """
+
+    import json
+
+    dumps = json.dumps
+    for lineResult in results:
+        yield dumps(lineResult._asdict()) + "\n"
+
+
+OUTPUT_FORMATS = {"text": FormatText, "jsonl": FormatJsonLines}
+
+
+def RunBatch(inputStream, outputStream, outputFormat: str = "text", **options):
+    """
+    This function evaluates every line of inputStream and writes a result line for each,
+    in the same order, without ever holding the whole input or output in memory.
+    Parameters:
+        inputStream: A text stream with one expression per line.
+        outputStream: A text stream to write the results to.
+        outputFormat (str): "text" or "jsonl".
+        **options: Passed on to Calculate, like engine, backend or precision.
+
+    Returns:
+        None
+    """
+
+    formatter = OUTPUT_FORMATS[outputFormat]
+    outputStream.writelines(
+        formatter(EvaluateLines(ReadExpressions(inputStream), **options))
+    )
+    outputStream.flush()
+
+
+def ChunkLines(lines, chunkSize: int):
+    """
+    This function groups lines into lists of chunkSize lines, lazily.
+    Parameters:
+        lines: An iterable of lines.
+        chunkSize (int): How many lines go in each chunk.
+
+    Returns:
+        generator: Lists of up to chunkSize lines, in input order.
+    """
+
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == chunkSize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def WarmDiskCache(path: str, inputStream, **options) -> int:
+    """
+    This function works out every expression of a corpus and saves the results in an
+    on-disk cache, along with the ones already there, so later runs with the same
+    settings start out knowing them. Lines that fail aren't saved.
+    Parameters:
+        path (str): The cache file, created if it doesn't exist.
+        inputStream: A text stream with one expression per line.
+        **options: Passed on to Calculate, like engine, backend or precision.
+
+    Returns:
+        int: How many results the cache has now.
+    """
+
+    existing = DiskCache(path)
+    results = dict(existing.items())
+    existing.close()
+    for chunk in ChunkLines(ReadExpressions(inputStream), BATCH_CHUNK_SIZE):
+        # Big enough that nothing is evicted before it is saved, and only one chunk's
+        # worth of compiled expressions is kept at a time
+        cache = ExpressionCache(len(chunk))
+        for _ in EvaluateLines(chunk, cache=cache, **options):
+            pass
+        for key, (_, result) in cache.entries.items():
+            results[DiskKey(key)] = result
+    WriteDiskCache(path, results)
+    return len(results)
+
+
+def StartWorker(cacheSize: int, diskCache: str = None):
+    """
+    This function sets up a batch worker process.
+    Parameters:
+        cacheSize (int): How many expressions the worker's cache remembers.
+        diskCache (str): The on-disk cache to look results up in, None for none.
+
+    Returns:
+        None
+    """
+
+    CACHE.maxSize = cacheSize
+    if diskCache is not None:
+        CACHE.disk = DiskCache(diskCache)
+
+
+def WorkerArguments() -> tuple:
+    """
+    This function collects what StartWorker needs to set a worker up like this process.
+    Parameters:
+        None
+
+    Returns:
+        tuple: The arguments for StartWorker.
+    """
+
+    return (CACHE.maxSize, None if CACHE.disk is None else CACHE.disk.path)
+
+
+def EvaluateChunk(
+    expressions: list, firstLineNumber: int, outputFormat: str, options: dict
+) -> str:
+    """
+    This function evaluates a chunk of lines inside a worker process and formats them
+    there, so only one string per chunk has to travel back to the parent process.
+    Parameters:
+        expressions (list): The lines of the chunk.
+        firstLineNumber (int): The line number of the first line in the chunk.
+        outputFormat (str): "text" or "jsonl".
+        options (dict): Passed on to Calculate, like engine, backend or precision.
+
+    Returns:
+        str: The formatted output of every line in the chunk.
+    """
+
+    formatter = OUTPUT_FORMATS[outputFormat]
+    return "".join(formatter(EvaluateLines(expressions, firstLineNumber, **options)))
+
+
+def RunParallelBatch(
+    inputStream,
+    outputStream,
+    outputFormat: str = "text",
+    workers: int = 0,
+    chunkSize: int = BATCH_CHUNK_SIZE,
+    **options,
+):
+    """
+    This function works like RunBatch but spreads chunks of lines over a pool of
+    processes. Only a couple of chunks per worker are in flight at once, so memory stays
+    flat, and chunks are written in the order they were read.
+    Parameters:
+        inputStream: A text stream with one expression per line.
+        outputStream: A text stream to write the results to.
+        outputFormat (str): "text" or "jsonl".
+        workers (int): How many processes to use, 0 uses one per CPU.
+        chunkSize (int): How many lines to send to a process at a time.
+        **options: Passed on to Calculate, like engine, backend or precision.
+
+    Returns:
+        None
+    """
+
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    # Only imported here since it takes longer to import than the rest of the calculator
+    from concurrent.futures import ProcessPoolExecutor
+
+    maxInFlight = workers * 2
+    pending = deque()
+    firstLineNumber = 1
+    with ProcessPoolExecutor(
+        workers, initializer=StartWorker, initargs=WorkerArguments()
+    ) as pool:
+        for chunk in ChunkLines(ReadExpressions(inputStream), chunkSize):
+            pending.append(
+                pool.submit(
+                    EvaluateChunk, chunk, firstLineNumber, outputFormat, options
+                )
+            )
+            firstLineNumber += len(chunk)
+            # Wait for the oldest chunk before reading more, to keep the output in order
+            if len(pending) >= maxInFlight:
+                outputStream.write(pending.popleft().result())
+        while pending:
+            outputStream.write(pending.popleft().result())
+    outputStream.flush()
+
+
+def EvaluateRequests(expressions: list, options: dict) -> list:
+    """
+    This function evaluates a batch of server requests inside the server's executor.
+    Parameters:
+        expressions (list): The expressions, one per request.
+        options (dict): Passed on to Calculate, like engine, backend or precision.
+
+    Returns:
+        list: A (result, error) pair for every expression, in order.
+    """
+
+    return [
+        (lineResult.result, lineResult.error)
+        for lineResult in EvaluateLines(expressions, **options)
+    ]
+
+
+class CalculatorServer:
+    """
+    Serves the calculator over TCP or a Unix socket, one expression per line in and one
+    result per line out, in order. Clients can send as many lines as they like without
+    waiting, but only maxInFlight of them per connection are worked on at once; after
+    that the server stops reading from the connection until results have been written,
+    so a fast client slows down instead of filling the server's memory. Results are
+    remembered in a cache shared by every connection. Everything else is collected into
+    batches and evaluated in an executor, so a slow expression never holds up the
+    connections around it.
+    """
+
+    def __init__(
+        self,
+        options: dict,
+        workers: int = 1,
+        maxInFlight: int = SERVER_MAX_IN_FLIGHT,
+        outputFormat: str = "text",
+        chunkSize: int = BATCH_CHUNK_SIZE,
+        cacheSize: int = CACHE_SIZE,
+    ):
+        """
+        This function creates a server.
+        Parameters:
+            options (dict): Passed on to Calculate, like engine, backend or precision.
+            workers (int): 1 evaluates on a thread, more on that many processes, 0 one
+            per CPU.
+            maxInFlight (int): The most requests per connection worked on at once.
+            outputFormat (str): "text" or "jsonl".
+            chunkSize (int): The most requests sent to the executor at a time.
+            cacheSize (int): How many results the shared cache remembers.
+
+        Returns:
+            None
+        """
+
+        self.options = options
+        self.workers = workers
+        self.maxInFlight = max(1, maxInFlight)
+        self.formatter = OUTPUT_FORMATS[outputFormat]
+        self.chunkSize = chunkSize
+        self.cache = ExpressionCache(cacheSize)
+        self.executor = None
+        self.loop = None
+        # Requests waiting for the executor, as (key, expression, future)
+        self.batch = []
+
+    def start_executor(self):
+        """
+        This function starts the executor requests are evaluated in.
+        Parameters:
+            None
+
+        Returns:
+            None
+        """
+
+        # Only imported here since it takes longer to import than the rest of the
+        # calculator
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+        if self.workers == 1:
+            # One thread, so the calculator's own cache is only ever used by that thread
+            self.executor = ThreadPoolExecutor(1)
+        else:
+            self.executor = ProcessPoolExecutor(
+                self.workers if self.workers > 0 else os.cpu_count() or 1,
+                initializer=StartWorker,
+                initargs=WorkerArguments(),
+            )
+            # The workers are forked on the first job, and if that happened after a
+            # connection was accepted they'd all keep a copy of it, so closing it would
+            # never reach the client
+            self.executor.submit(int).result()
+
+    def submit(self, expression: str):
+        """
+        This function starts working on a request.
+        Parameters:
+            expression (str): The expression as it was sent.
+
+        Returns:
+            asyncio.Future: Resolves to the (result, error) pair.
+        """
+
+        future = self.loop.create_future()
+        key = NormalizeExpression(expression)
+        entry = self.cache.get(key)
+        if entry is not None:
+            future.set_result((entry[1], None))
+            return future
+        if not self.batch:
+            # Every line that has already arrived is read before this runs, so they go
+            # together
+            self.loop.call_soon(self.flush)
+        self.batch.append((key, expression, future))
+        if len(self.batch) >= self.chunkSize:
+            self.flush()
+        return future
+
+    def flush(self):
+        """
+        This function sends the waiting requests to the executor as one batch.
+        Parameters:
+            None
+
+        Returns:
+            None
+        """
+
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        done = self.loop.run_in_executor(
+            self.executor,
+            EvaluateRequests,
+            [expression for _, expression, _ in batch],
+            self.options,
+        )
+        done.add_done_callback(partial(self.finish, batch))
+
+    def finish(self, batch: list, done):
+        """
+        This function hands the results of a batch back to the requests waiting for
+        them.
+        Parameters:
+            batch (list): The batch's requests, as (key, expression, future).
+            done (asyncio.Future): The executor's result for the batch.
+
+        Returns:
+            None
+        """
+
+        if done.exception() is not None:
+            results = [(None, str(done.exception()))] * len(batch)
+        else:
+            results = done.result()
+        for (key, _, future), (result, error) in zip(batch, results):
+            if error is None and result is not None:
+                self.cache.put(key, None, result)
+            # Cancelled by respond if the connection went away while the batch was being
+            # worked on
+            if not future.done():
+                future.set_result((result, error))
+
+    async def handle(self, reader, writer):
+        """
+        This function serves one connection until the client closes it.
+        Parameters:
+            reader (asyncio.StreamReader): The connection's incoming side.
+            writer (asyncio.StreamWriter): The connection's outgoing side.
+
+        Returns:
+            None
+        """
+
+        import asyncio
+
+        inFlight = asyncio.Semaphore(self.maxInFlight)
+        responses = asyncio.Queue()  # The requests' futures, in the order they came in
+        responder = asyncio.create_task(self.respond(responses, writer, inFlight))
+        lineNumber = 0
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Longer than SERVER_LINE_LIMIT, the rest of the line can't be found
+                    # reliably
+                    future = self.loop.create_future()
+                    future.set_result((None, "Line is too long."))
+                    responses.put_nowait((lineNumber + 1, "", future))
+                    break
+                if not line:
+                    break
+                # Stop reading while too many of this connection's requests are being
+                # worked on
+                await inFlight.acquire()
+                lineNumber += 1
+                expression = line.decode("utf-8", "replace").rstrip("\r\n")
+                responses.put_nowait((lineNumber, expression, self.submit(expression)))
+        except ConnectionError:
+            pass
+        finally:
+            responses.put_nowait(None)
+            await responder
+            writer.close()
+
+    async def respond(self, responses, writer, inFlight):
+        """
+        This function writes a connection's results in the order the requests came in.
+        Parameters:
+            responses (asyncio.Queue): The requests as (line number, expression,
+            future), then None when there are no more.
+            writer (asyncio.StreamWriter): Where to write the results.
+            inFlight (asyncio.Semaphore): Released for every result written.
+
+        Returns:
+            None
+        """
+
+        formatter = self.formatter
+        closed = False  # Once the client is gone there is nobody to send results to
+        while True:
+            response = await responses.get()
+            if response is None:
+                break
+            lineNumber, expression, future = response
+            if closed:
+                future.cancel()
+                inFlight.release()
+                continue
+            result, error = await future
+            try:
+                for text in formatter(
+                    [LineResult(lineNumber, expression, result, error)]
+                ):
+                    writer.write(text.encode())
+                # Wait here if the client isn't reading its results
+                await writer.drain()
+            except ConnectionError:
+                closed = True  # Keep going so the reading side can finish
+            inFlight.release()
+
+    async def serve(
+        self, host: str = None, port: int = None, path: str = None, ready=None
+    ):
+        """
+        This function runs the server until it is cancelled.
+        Parameters:
+            host (str): The address to listen on for TCP.
+            port (int): The port to listen on, 0 picks a free one.
+            path (str): A Unix socket to listen on instead of TCP.
+            ready: Called with the address being listened on once the server has
+            started.
+
+        Returns:
+            None
+        """
+
+        import asyncio
+
+        self.loop = asyncio.get_running_loop()
+        self.start_executor()
+        try:
+            if path is not None:
+                server = await asyncio.start_unix_server(
+                    self.handle, path, limit=SERVER_LINE_LIMIT
+                )
+            else:
+                server = await asyncio.start_server(
+                    self.handle, host, port, limit=SERVER_LINE_LIMIT
+                )
+            if ready is not None:
+                ready(path or "%s:%d" % server.sockets[0].getsockname()[:2])
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+
+
+def ParseAddress(address: str) -> tuple:
+    """
+    This function reads a TCP address like "127.0.0.1:8000", ":8000" or "8000".
+    Parameters:
+        address (str): The address.
+
+    Returns:
+        tuple: The host, "127.0.0.1" if none is given, and the port.
+    """
+
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def ParseArguments(argv: list = None):
+    """
+    This function reads the command line options.
+    Parameters:
+        argv (list): The arguments to parse. Defaults to sys.argv.
+
+    Returns:
+        argparse.Namespace: The parsed options.
+    """
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Le calculator (honhon baguette).")
+    parser.add_argument(
+        "expression",
+        nargs="?",
+        help="evaluate EXPRESSION, or the one on stdin when it is -, print the result "
+        "and exit (put -- before expressions that start with a minus sign)",
+    )
+    parser.add_argument(
+        "--self-test",
+        action="store_true",
+        help="run the built in test cases and exit",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        nargs="?",
+        const="-",
+        help="evaluate one expression per line of FILE (or stdin when FILE is - or "
+        "left out) and exit",
+    )
+    parser.add_argument(
+        "--stream",
+        metavar="FILE",
+        nargs="?",
+        const="-",
+        help="evaluate one huge expression from FILE (or stdin) a chunk at a time and "
+        "exit, always with the stack engine, so --engine is ignored",
+    )
+    parser.add_argument(
+        "--serve",
+        metavar="[HOST:]PORT",
+        help="serve expressions over TCP, one per line, until stopped",
+    )
+    parser.add_argument(
+        "--unix",
+        metavar="PATH",
+        help="serve expressions on a Unix socket at PATH, one per line, until stopped",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=SERVER_MAX_IN_FLIGHT,
+        metavar="N",
+        help="how many requests per connection the server works on at once",
+    )
+    parser.add_argument(
+        "--output", metavar="FILE", help="write batch results to FILE instead of stdout"
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(OUTPUT_FORMATS),
+        default="text",
+        help="how batch and server results are written",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        metavar="N",
+        help="evaluate batches and server requests on N processes, 0 uses one per CPU",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=BATCH_CHUNK_SIZE,
+        metavar="LINES",
+        help="how many lines each batch worker gets at a time",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=[engine.value for engine in Engine],
+        default=ENGINE.value,
+        help="which evaluation engine to use",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=[backend.value for backend in Backend],
+        default=BACKEND.value,
+        help="the kind of numbers to calculate with",
+    )
+    parser.add_argument(
+        "--precision",
+        type=int,
+        default=DECIMAL_PRECISION,
+        metavar="DIGITS",
+        help="significant digits kept by the decimal backend",
+    )
+    parser.add_argument(
+        "--max-bits",
+        type=int,
+        metavar="BITS",
+        help=f"reject powers and products that would be larger than BITS bits "
+        f"(default {MAX_RESULT_BITS})",
+    )
+    parser.add_argument(
+        "--max-length",
+        type=int,
+        default=MAX_EXPRESSION_LENGTH,
+        metavar="CHARACTERS",
+        help="reject expressions longer than this, 0 for no limit (default "
+        "%(default)s)",
+    )
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        default=MAX_NESTING_DEPTH,
+        metavar="LEVELS",
+        help="reject parentheses nested deeper than this, 0 for no limit (default "
+        "%(default)s)",
+    )
+    parser.add_argument(
+        "--max-operations",
+        type=int,
+        default=MAX_OPERATIONS,
+        metavar="N",
+        help="reject expressions with more operators than this, 0 for no limit "
+        "(default %(default)s)",
+    )
+    parser.add_argument(
+        "--max-seconds",
+        type=float,
+        default=MAX_SECONDS,
+        metavar="SECONDS",
+        help="give up on expressions that take longer than this to calculate",
+    )
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        default=OPTIMIZE,
+        help="fold constants and reuse repeated parts of expressions before evaluating "
+        "them",
+    )
+    parser.add_argument(
+        "--dump",
+        metavar="EXPRESSION",
+        help="print the optimized form of EXPRESSION and exit",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        nargs="?",
+        const="-",
+        help="collect counters and timings and write them to FILE (or stderr) as JSON "
+        "on exit",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="print every step each expression is worked out in to stderr",
+    )
+    parser.add_argument(
+        "--disk-cache",
+        metavar="FILE",
+        help="look results up in the on-disk cache FILE before working them out, see "
+        "--warm",
+    )
+    parser.add_argument(
+        "--warm",
+        metavar="CORPUS",
+        help="work out every expression in CORPUS (one per line, - for stdin), save "
+        "the results in the --disk-cache file for later runs with the same settings, "
+        "and exit",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=CACHE_SIZE,
+        help="how many expressions to remember, 0 turns the cache off",
+    )
+    return parser.parse_args(argv)
+
+
+def DumpMetrics(instrument: Instrument, path: str):
+    """
+    This function writes an instrument's metrics to a file, for when the program exits.
+    Parameters:
+        instrument (Instrument): The instrument.
+        path (str): The file to write to, or "-" for stderr.
+
+    Returns:
+        None
+    """
+
+    if path == "-":
+        instrument.dump()
+        return
+    with open(path, "w") as stream:
+        instrument.dump(stream)
+
+
+def main(argv: list = None):
+    """
+    This function serves as the main entry point for the calculator program.
+    Without any options it prompts the user for a mathematical expression, and then
+    validates, evaluates, and prints it. Given an expression it evaluates just that one
+    and exits, which starts up a lot faster, fastest as "python -m main EXPRESSION"
+    since modules are loaded from the bytecode cache. With --batch it evaluates a whole
+    file or stdin, one expression per line. With --stream it evaluates one huge
+    expression from a file or stdin without reading it all in. With --serve or --unix it
+    keeps running as a server, see CalculatorServer. With --warm it fills the on-disk
+    cache given by --disk-cache from a corpus, see DiskCache.
+    Parameters:
+        argv (list): The command line arguments. Defaults to sys.argv.
+
+    Returns:
+        None
+    """
+
+    args = ParseArguments(argv)
+    if args.self_test:
+        TestCases()
+        return
+    options = {
+        "engine": Engine(args.engine),
+        "backend": Backend(args.backend),
+        "precision": args.precision,
+        "maxBits": args.max_bits,
+        "optimize": args.optimize,
+        "budget": Budget(
+            args.max_length, args.max_depth, args.max_operations, args.max_seconds
+        ),
+    }
+    CACHE.maxSize = args.cache_size
+    global INSTRUMENT
+    if args.metrics is not None or args.trace:
+        INSTRUMENT = Instrument(partial(print, file=sys.stderr) if args.trace else None)
+    if args.metrics is not None:
+        atexit.register(DumpMetrics, INSTRUMENT, args.metrics)
+
+    if args.warm is not None:
+        if args.disk_cache is None:
+            print(
+                "Error: --warm needs --disk-cache FILE to save the results in.",
+                file=sys.stderr,
+            )
+            raise SystemExit(2)
+        inputStream = (
+            sys.stdin
+            if args.warm == "-"
+            else open(args.warm, buffering=BATCH_BUFFER_SIZE)
+        )
+        try:
+            count = WarmDiskCache(args.disk_cache, inputStream, **options)
+        finally:
+            if inputStream is not sys.stdin:
+                inputStream.close()
+        print(f"{args.disk_cache} has {count} results.")
+        return
+    if args.disk_cache is not None:
+        CACHE.disk = DiskCache(args.disk_cache)
+
+    if args.expression is not None:
+        toCalculate = sys.stdin.read() if args.expression == "-" else args.expression
+        try:
+            print(Calculate(toCalculate.rstrip(), **options))
+        except Exception as error:
+            print("Error:", error, file=sys.stderr)
+            raise SystemExit(1)
+        return
+
+    if args.dump is not None:
+        print(
+            DumpOptimized(args.dump, options["backend"], args.precision, args.max_bits)
+        )
+        return
+
+    if args.serve is not None or args.unix is not None:
+        import asyncio
+
+        server = CalculatorServer(
+            options,
+            args.workers,
+            args.max_in_flight,
+            args.format,
+            args.chunk_size,
+            args.cache_size,
+        )
+        host, port = (
+            ParseAddress(args.serve) if args.serve is not None else (None, None)
+        )
+        try:
+            asyncio.run(
+                server.serve(
+                    host, port, args.unix, partial(print, "Listening on", flush=True)
+                )
+            )
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.stream is not None:
+        inputStream = (
+            sys.stdin
+            if args.stream == "-"
+            else open(args.stream, buffering=BATCH_BUFFER_SIZE)
+        )
+        try:
+            print(
+                EvaluateStream(
+                    inputStream,
+                    options["backend"],
+                    args.precision,
+                    args.max_bits,
+                    budget=options["budget"],
+                )
+            )
+        except Exception as error:
+            print("Error:", error, file=sys.stderr)
+            raise SystemExit(1)
+        finally:
+            if inputStream is not sys.stdin:
+                inputStream.close()
+        return
+
+    if args.batch is not None:
+        inputStream = (
+            sys.stdin
+            if args.batch == "-"
+            else open(args.batch, buffering=BATCH_BUFFER_SIZE)
+        )
+        outputStream = (
+            sys.stdout
+            if args.output is None
+            else open(args.output, "w", buffering=BATCH_BUFFER_SIZE)
+        )
+        try:
+            if args.workers == 1:
+                RunBatch(inputStream, outputStream, args.format, **options)
+            else:
+                RunParallelBatch(
+                    inputStream,
+                    outputStream,
+                    args.format,
+                    args.workers,
+                    args.chunk_size,
+                    **options,
+                )
+        finally:
+            if inputStream is not sys.stdin:
+                inputStream.close()
+            if outputStream is not sys.stdout:
+                outputStream.close()
+        return
+
+    print("Welcome to le calculator! (honhon baguette)")
+    while True:
+        toCalculate = input("Enter an expression (or 'quit' to exit): ")
+        if toCalculate.lower() == "quit":
+            # using lower() so i don't need to care about casing for the input so my enum will work
+
+            print("quiter :/")
+            break
+        if toCalculate.lower() == "metrics":
+            # The metrics so far, on demand
+            if INSTRUMENT is None:
+                print("Metrics are off, start with --metrics to collect them.")
+            else:
+                INSTRUMENT.dump(sys.stdout)
+            continue
         try:
-            GeneralSyntax(toCalculate)
-            # o7
-            if not toCalculate:
-                raise ValueError("Input cannot be empty.")
-            toCalculate = toCalculate.replace(
-                " ", ""
-            )  # Remove spaces for easier parsing
-            result = EvaluateExpression(toCalculate)
+            # Validates, evaluates, and remembers the expression for next time
+            result = Calculate(toCalculate, **options)
             # Print the result
             print("Result: ", result)
 